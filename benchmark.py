@@ -0,0 +1,314 @@
+from argparse import ArgumentParser
+from json import dump, load
+from random import Random
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+import io
+import re
+import tracemalloc
+from talmudifier.column import Column
+from talmudifier.compiled_recipe import CompiledRecipe
+from talmudifier.pdf_writer import PDFWriter
+from talmudifier.measurement_server import MeasurementServer
+from talmudifier.row_maker import RowMaker
+from talmudifier.talmudifier import Talmudifier
+from talmudifier.tokenizer import Tokenizer
+from talmudifier.word import Word
+
+
+class StubTypesetter:
+    """
+    A deterministic replacement for xelatex. It breaks the words of a paracol block into rows greedily,
+    using the column ratio and the font size to get the number of characters per row.
+    The numbers are only roughly like xelatex's, but they are always the same, so benchmarks only measure Python.
+    """
+
+    # The number of characters in a full-width row at 11pt.
+    ROW_LENGTH = 95
+    COMMAND = re.compile(r"\\[a-zA-Z]+\*?(\[[^\]]*\])?|[{}]")
+    COLUMN_RATIO = re.compile(r"\\columnratio{([^}]*)}")
+    SWITCH = re.compile(r"\\switchcolumn(\[(\d)\])?")
+    FONT_SIZE = re.compile(r"\\fontsize{(\d+)}")
+
+    @staticmethod
+    def get_num_rows(block: str, report_rows: str) -> int:
+        """
+        Returns the number of rows of a paracol block (see `RowMaker.get_block()`).
+
+        :param block: The paracol block.
+        :param report_rows: The TeX that ends the measured text of the block (see `Typesetter.report_rows`).
+        """
+
+        assert report_rows in block, f"The block doesn't report its number of rows:\n\n{block}"
+
+        # Get the width of the target column.
+        ratios = [float(r) for r in StubTypesetter.COLUMN_RATIO.search(block).group(1).split(",")]
+        switch = StubTypesetter.SWITCH.search(block)
+        index = 0 if switch is None else (int(switch.group(2)) if switch.group(2) is not None else 1)
+        ratio = ratios[index] if index < len(ratios) else 1 - sum(ratios)
+        font_size = StubTypesetter.FONT_SIZE.search(block)
+        font_size = int(font_size.group(1)) if font_size is not None else 11
+        row_length = max(int(StubTypesetter.ROW_LENGTH * ratio * 11 / font_size), 1)
+
+        # Get the text.
+        text = block.split(r"\begin{linenumbers}")[1].split(report_rows)[0]
+        num_rows = 1
+        length = 0
+        for word in StubTypesetter.COMMAND.sub(" ", text).split():
+            if length > 0 and length + 1 + len(word) > row_length:
+                num_rows += 1
+                length = len(word)
+            else:
+                length += len(word) + (1 if length > 0 else 0)
+        return num_rows
+
+    @staticmethod
+    def measure_blocks(writer: PDFWriter, blocks: List[str], server: Optional[MeasurementServer] = None,
+                       read_log=True) -> List[int]:
+        """
+        Returns the number of rows of each block. The parameters are the same as `RowMaker.measure_blocks()`.
+        """
+
+        return [StubTypesetter.get_num_rows(block, writer.typesetter.report_rows) for block in blocks]
+
+    @staticmethod
+    async def measure_blocks_async(writer: PDFWriter, blocks: List[str], server: Optional[MeasurementServer] = None,
+                                   read_log=True) -> List[int]:
+        """
+        Returns the number of rows of each block. The parameters are the same as `RowMaker.measure_blocks_async()`.
+        """
+
+        return StubTypesetter.measure_blocks(writer, blocks)
+
+    @staticmethod
+    def install() -> None:
+        """
+        Measure every row with the stub instead of xelatex.
+        """
+
+        RowMaker.measure_blocks = staticmethod(StubTypesetter.measure_blocks)
+        RowMaker.measure_blocks_async = staticmethod(StubTypesetter.measure_blocks_async)
+
+
+class StubHyphenator:
+    """
+    A deterministic replacement for the hyphenation dictionary: split long words every three letters.
+    """
+
+    def pairs(self, word: str) -> List[List[str]]:
+        """
+        Returns the hyphenated pairs of a word.
+
+        :param word: The word.
+        """
+
+        return [[word[:i], word[i:]] for i in range(3, len(word) - 2, 3)]
+
+
+class Benchmark:
+    """
+    Time the Python side of Talmudifier, one stage at a time, on synthetic text.
+    xelatex is replaced with `StubTypesetter`.
+    """
+
+    STAGES = ["tokenize", "column", "hyphenate", "tex", "prefix_tex", "row_maker", "page"]
+
+    def __init__(self, recipe_filename="default.json", seed=0, repeat=3, max_page_words=10000, engine="xelatex"):
+        """
+        :param recipe_filename: The filename of the recipe, located in recipes/
+        :param seed: The random seed of the synthetic text.
+        :param repeat: Each stage's time is the fastest of this many runs.
+        :param max_page_words: Skip the page stage if there are more than this many words per column.
+        :param engine: The TeX engine: "xelatex" or "lualatex" (see `Typesetter`). Its TeX is measured by the stub.
+        """
+
+        StubTypesetter.install()
+        self.recipe = CompiledRecipe(recipe_filename, engine=engine)
+        self.seed = seed
+        self.repeat = repeat
+        self.max_page_words = max_page_words
+        with open("test/josephus.txt", "rt") as f:
+            self.josephus = [w for w in f.read().split(" ") if w.strip() != ""]
+
+    def get_text(self, num_words: int, column_name="left") -> str:
+        """
+        Returns synthetic markdown: random words from Antiquities, some bold or italic, and some citations.
+
+        :param num_words: The number of words.
+        :param column_name: The name of the column. Citations point away from this column.
+        """
+
+        random = Random(f"{self.seed}{column_name}{num_words}")
+        words = []
+        citation = "R" if column_name == "left" else "L"
+        for i in range(num_words):
+            word = random.choice(self.josephus).strip()
+            r = random.random()
+            if r < 0.03:
+                word = "**" + word + "**"
+            elif r < 0.06:
+                word = "_" + word + "_"
+            elif r < 0.07 and column_name != "center":
+                word = "`" + citation + str(i % 10) + "`"
+            words.append(word)
+        return " ".join(words)
+
+    def get_column(self, text: str, column_name="left") -> Column:
+        """
+        Returns a column of text with all of its words read.
+
+        :param text: The markdown text.
+        :param column_name: The name of the column.
+        """
+
+        column = Talmudifier("", "", "", compiled_recipe=self.recipe)._get_column(text, column_name)
+        column.fill()
+        return column
+
+    def run(self, sizes: List[int], stages: List[str]) -> Dict[str, Dict[str, dict]]:
+        """
+        Returns a dictionary: Key = The stage. Value = A dictionary: Key = The number of words.
+        Value = `{"seconds": 0.01, "peak_kb": 120}`
+
+        :param sizes: The numbers of words per column.
+        :param stages: The names of the stages to run.
+        """
+
+        results = dict()
+        for stage in stages:
+            assert stage in Benchmark.STAGES, f"Invalid stage: {stage}"
+            results[stage] = dict()
+            for size in sizes:
+                if stage == "page" and size > self.max_page_words:
+                    continue
+                setup, function = self._get_stage(stage, size)
+                seconds, peak = self._measure(setup, function)
+                results[stage][str(size)] = {"seconds": seconds, "peak_kb": round(peak / 1024)}
+                print(f"{stage:<12}{size:>8}{seconds:>12.4f}{round(peak / 1024):>12}")
+        return results
+
+    def _get_stage(self, stage: str, size: int) -> Tuple[Callable, Callable]:
+        """
+        Returns the set-up function of a stage, and the function to measure.
+        The set-up function returns the argument of the measured function. Set-up isn't timed.
+
+        :param stage: The name of the stage.
+        :param size: The number of words.
+        """
+
+        text = self.get_text(size)
+        if stage == "tokenize":
+            return lambda: text, lambda t: list(Tokenizer(t))
+        elif stage == "column":
+            return lambda: text, lambda t: self.get_column(t)
+        elif stage == "hyphenate":
+            def setup():
+                Word.CACHE.clear()
+                return self.get_column(text)
+            return setup, lambda column: [w.pairs for w in column.words]
+        elif stage == "tex":
+            return lambda: self.get_column(text), lambda column: column.get_tex(True)
+        elif stage == "prefix_tex":
+            # Build the TeX of up to 1000 prefixes of the column, like a row maker's search does.
+            def prefix_tex(column: Column):
+                for k in range(1, len(column.words) + 1, max(len(column.words) // 1000, 1)):
+                    column.get_prefix_tex(k)
+            return lambda: self.get_column(text), prefix_tex
+        elif stage == "row_maker":
+            # Cut the whole column into blocks of 4 rows.
+            rowmaker = self.recipe.get_row_maker(True, False, True, "left")
+            expected_length = self.recipe.recipe["character_counts"]["half"]["left"]["4"] \
+                if "character_counts" in self.recipe.recipe else -1
+
+            def row_maker(column: Column):
+                while not column.is_empty():
+                    tex, column = rowmaker.get_text_of_length(column, 4, expected_length)
+            return lambda: self.get_column(text), row_maker
+        elif stage == "page":
+            center = self.get_text(size // 2, "center")
+            right = self.get_text(size, "right")
+            return lambda: (text, center, right), lambda t: self.recipe.get_tex(*t)
+        else:
+            raise Exception(f"Invalid stage: {stage}")
+
+    def _measure(self, setup: Callable, function: Callable) -> Tuple[float, int]:
+        """
+        Returns the fastest time of the function, in seconds, and its peak memory usage, in bytes.
+        Memory is measured in a separate run, because tracing memory slows everything down.
+
+        :param setup: Returns the argument of the function.
+        :param function: The function.
+        """
+
+        seconds = []
+        for i in range(self.repeat):
+            arg = setup()
+            t0 = perf_counter()
+            function(arg)
+            seconds.append(perf_counter() - t0)
+
+        arg = setup()
+        tracemalloc.start()
+        function(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return min(seconds), peak
+
+    @staticmethod
+    def compare(results: Dict[str, Dict[str, dict]], baseline: Dict[str, Dict[str, dict]],
+                tolerance: float) -> List[str]:
+        """
+        Returns a description of each stage and size that is slower than the baseline by more than the tolerance.
+
+        :param results: The results of `self.run()`.
+        :param baseline: Earlier results of `self.run()`.
+        :param tolerance: For example, 1.25 allows a stage to be 25% slower than the baseline.
+        """
+
+        regressions = []
+        for stage in results:
+            if stage not in baseline:
+                continue
+            for size in results[stage]:
+                if size not in baseline[stage]:
+                    continue
+                ratio = results[stage][size]["seconds"] / max(baseline[stage][size]["seconds"], 1e-9)
+                if ratio > tolerance:
+                    regressions.append(f"{stage} ({size} words): {round(ratio, 2)}x slower")
+        return regressions
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", nargs="?", default="100,1000,10000,100000")
+    parser.add_argument("--stages", nargs="?", default=",".join(Benchmark.STAGES))
+    parser.add_argument("--recipe", nargs="?", default="default.json")
+    parser.add_argument("--engine", nargs="?", default="xelatex")
+    parser.add_argument("--repeat", nargs="?", default=3, type=int)
+    parser.add_argument("--max_page_words", nargs="?", default=10000, type=int)
+    parser.add_argument("--real_hyphenation", action="store_true")
+    parser.add_argument("--output", nargs="?", default=None)
+    parser.add_argument("--baseline", nargs="?", default=None)
+    parser.add_argument("--tolerance", nargs="?", default=1.25, type=float)
+
+    args = parser.parse_args()
+
+    if not args.real_hyphenation:
+        Word.H = StubHyphenator()
+
+    benchmark = Benchmark(args.recipe, repeat=args.repeat, max_page_words=args.max_page_words,
+                          engine=args.engine)
+    print(f"{'Stage':<12}{'Words':>8}{'Seconds':>12}{'Peak (KB)':>12}")
+    r = benchmark.run([int(s) for s in args.sizes.split(",")], args.stages.split(","))
+
+    if args.output is not None:
+        with io.open(args.output, "wt", encoding="utf-8") as f:
+            dump(r, f, indent=2)
+    if args.baseline is not None:
+        with io.open(args.baseline, "rt", encoding="utf-8") as f:
+            b = load(f)
+        slower = Benchmark.compare(r, b, args.tolerance)
+        for s in slower:
+            print(f"REGRESSION: {s}")
+        if len(slower) > 0:
+            exit(1)
@@ -0,0 +1,33 @@
+from argparse import ArgumentParser
+from talmudifier.book import Book
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--manifest", type=str)
+    parser.add_argument("--jobs", nargs="?", default=1, type=int)
+    parser.add_argument("--recipe", nargs="?", default="default.json")
+    parser.add_argument("--output", nargs="?", default="book")
+    parser.add_argument("--per_page", action="store_true")
+    parser.add_argument("--no_pdf", action="store_true")
+    parser.add_argument("--server", action="store_true")
+    parser.add_argument("--cache", nargs="?", default=None)
+    parser.add_argument("--simulate", action="store_true")
+    parser.add_argument("--batch", nargs="?", default=1, type=int)
+    parser.add_argument("--label_words", action="store_true")
+    parser.add_argument("--engine", nargs="?", default="xelatex")
+    parser.add_argument("--capped", action="store_true")
+    parser.add_argument("--page_cache", nargs="?", default=None)
+
+    args = parser.parse_args()
+
+    book = Book.read_manifest(args.manifest, recipe_filename=args.recipe, jobs=args.jobs, use_server=args.server,
+                              cache_path=args.cache, simulate=args.simulate, batch_size=args.batch,
+                              label_words=args.label_words, engine=args.engine, capped=args.capped,
+                              page_cache_path=args.page_cache)
+    if args.per_page:
+        paths = book.write_pages(name=args.output, pdf=not args.no_pdf)
+        print(f"Pages: {len(paths)}\nFirst page: {paths[0] if len(paths) > 0 else ''}")
+    else:
+        path = book.write_book(output_filename=args.output, pdf=not args.no_pdf)
+        print(f"Pages: {len(book.pages)}\nBook: {path}")
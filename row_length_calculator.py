@@ -1,13 +1,17 @@
 from talmudifier.word import Word
 from talmudifier.pdf_writer import PDFWriter
-from talmudifier.pdf_reader import PDFReader
+from talmudifier.row_maker import RowMaker
 from talmudifier.style import Style
 from random import shuffle
 from tqdm import tqdm
 from talmudifier.talmudifier import Paracol
+from talmudifier.compiled_recipe import CompiledRecipe
 from argparse import ArgumentParser
-from json import load
-from pathlib import Path
+from json import load, dump
+from multiprocessing import Pool
+from statistics import mean, pstdev
+from typing import Dict, List, Optional, Tuple
+import io
 
 
 class RowLengthCalculator:
@@ -15,13 +19,16 @@ class RowLengthCalculator:
     Calculate the average number of characters in a given number of rows.
     """
 
-    def __init__(self, columns: str, target: str, font: str, font_size: str, num_rows: int):
+    def __init__(self, columns: str, target: str, font: str, font_size: str, num_rows: int, batch_size=1,
+                 preamble: Optional[str] = None):
         """
         :param columns: The columns included in this paracol environment as a string, e.g. "LC"
         :param target: The target column, e.g. "left"
         :param font: The font command, e.g. "\\leftfont"
         :param font_size: The font size command, e.g. "\\fontsize{11}{13}"
         :param num_rows: The number of rows to make.
+        :param batch_size: The number of words to try in one compile.
+        :param preamble: The preamble, which must declare the font. If None, use the preamble of the default recipe.
         """
 
         self.paracol = Paracol.get_paracol_header("L" in columns, "C" in columns, "R" in columns)
@@ -29,21 +36,23 @@ class RowLengthCalculator:
         self.paracol += "\n\n" + switch
         self.paracol += "\n\n" + font_size + font
 
-        self.writer = PDFWriter(Path("header.txt").read_text())
+        self.writer = PDFWriter(preamble if preamble is not None else CompiledRecipe().preamble)
         self.num_rows = num_rows
+        self.batch_size = batch_size
 
-    def _get_num_rows(self, line: str, word: Word) -> int:
+    def _get_num_rows(self, lines: List[str]) -> List[int]:
         """
-        Returns the number of rows if the word was added to the line.
+        Returns the number of rows of each line. All of the lines are measured in one compile.
 
-        :param line: The line.
-        :param word: The new word.
+        :param lines: The lines.
         """
-        tex = r"\internallinenumbers \begin{linenumbers}" + line + " " + word.word + r"\end{linenumbers} \resetlinenumber[1]"
-        tex = self.paracol + tex + "\n\n\\end{paracol}"
-        self.writer.write(tex, "line_count")
-        output_path = str(Path("Output/line_count.pdf").resolve())
-        return PDFReader.get_num_rows(output_path)
+
+        blocks = []
+        for line in lines:
+            tex = r"\internallinenumbers \begin{linenumbers}" + line + self.writer.typesetter.report_rows + \
+                  r"\end{linenumbers} \resetlinenumber[1]"
+            blocks.append(self.paracol + tex + "\n\n\\end{paracol}")
+        return RowMaker.measure_blocks(self.writer, blocks)
 
     def _get_num_characters_in_trial(self, josephus: list, style: Style) -> int:
         """
@@ -60,29 +69,32 @@ class RowLengthCalculator:
         shuffle(random_words)
 
         # Build a row of random words.
-        done = False
-        while not done:
-            word = Word(random_words.pop(), style, None, None)
-
-            # Filter out invalid words.
-            while not Word.is_valid(word.word):
+        while True:
+            # Get the next few words. Filter out invalid words.
+            words = []
+            while len(words) < self.batch_size:
                 word = Word(random_words.pop(), style, None, None)
+                if Word.is_valid(word.word):
+                    words.append(word)
 
-            num_lines = self._get_num_rows(line, word)
-
-            # We went over the end. Try to get a hyphenated fragment.
-            if num_lines > self.num_rows:
-                pairs = word.pairs
-                for pair in pairs:
-                    for p in pair:
-                        num_lines = self._get_num_rows(line, p)
-                        if num_lines == self.num_rows:
-                            line += " " + p.word
-                            return len(line.strip())
-                done = True
-            else:
-                line += " " + word.word
-        return len(line.strip())
+            # Try adding each of the words.
+            lines = []
+            for word in words:
+                lines.append((lines[-1] if len(lines) > 0 else line) + " " + word.word)
+            for i, num_lines in enumerate(self._get_num_rows(lines)):
+                # We went over the end. Try to get a hyphenated fragment.
+                if num_lines > self.num_rows:
+                    if i > 0:
+                        line = lines[i - 1]
+                    fragments = [p for pair in words[i].pairs for p in pair]
+                    for j in range(0, len(fragments), self.batch_size):
+                        batch = fragments[j: j + self.batch_size]
+                        for p, n in zip(batch, self._get_num_rows([line + " " + p.word for p in batch])):
+                            if n == self.num_rows:
+                                line += " " + p.word
+                                return len(line.strip())
+                    return len(line.strip())
+            line = lines[-1]
 
     def get_num_chars(self, num_trials: int) -> int:
         """
@@ -91,25 +103,252 @@ class RowLengthCalculator:
         :param num_trials: The number of trials.
         """
 
-        num_chars_total = 0
+        return round(mean(self.get_trials(num_trials, RowLengthCalculator.read_josephus())))
 
-        pbar = tqdm(total=num_trials)
+    def get_trials(self, num_trials: int, josephus: List[str], progress=True) -> List[int]:
+        """
+        Returns the number of characters of each of many trials.
 
-        # Get some words.
-        with open("test/josephus.txt", "rt") as f:
-            josephus = f.read()
-        josephus = josephus.split(" ")
-        josephus = [j for j in josephus if j != ""]
+        :param num_trials: The number of trials.
+        :param josephus: Words from Antiquities.
+        :param progress: If true, show a progress bar.
+        """
+
+        num_chars = []
+
+        pbar = tqdm(total=num_trials, disable=not progress)
 
         style = Style(False, False, False)
 
         for i in range(num_trials):
-            num_chars_total += self._get_num_characters_in_trial(josephus, style)
+            num_chars.append(self._get_num_characters_in_trial(josephus, style))
             pbar.update(1)
-            pbar.set_description(str(round(num_chars_total / (i + 1))))
+            pbar.set_description(str(round(mean(num_chars))))
         pbar.close()
 
-        return round(num_chars_total / num_trials)
+        return num_chars
+
+    @staticmethod
+    def get_font(target: str) -> str:
+        """
+        Returns the font command of the target column, e.g. "\\leftfont"
+
+        :param target: The target column, e.g. "left"
+        """
+
+        if target == "left":
+            return r"\leftfont"
+        elif target == "center":
+            return r"\centerfont"
+        elif target == "right":
+            return r"\rightfont"
+        else:
+            raise Exception(f"Invalid target: {target}")
+
+    @staticmethod
+    def get_font_size(fonts: dict, target: str) -> str:
+        """
+        Returns the font size command of the target column, e.g. "\\fontsize{11}{13}"
+        If the recipe doesn't set the size of the column, this is an empty string.
+
+        :param fonts: The recipe's fonts.
+        :param target: The target column, e.g. "left"
+        """
+
+        if "size" not in fonts[target] or "skip" not in fonts[target]:
+            return ""
+        return r"\fontsize{" + str(fonts[target]["size"]) + "}{" + str(fonts[target]["skip"]) + "}"
+
+    @staticmethod
+    def read_josephus() -> List[str]:
+        """
+        Returns the words of Josephus' Antiquities.
+        """
+
+        with open("test/josephus.txt", "rt") as f:
+            josephus = f.read()
+        josephus = josephus.split(" ")
+        return [j for j in josephus if j != ""]
+
+
+class CalibrationSweep:
+    """
+    Calculate every `character_counts` value of a recipe: each column width, each target column,
+    and each number of rows. The trials are divided among a pool of worker processes.
+    """
+
+    # The column arrangements that `Talmudifier` uses, in order of preference.
+    # Each (width, target) is calibrated with the first arrangement that has that width at that target.
+    ARRANGEMENTS = ["LCR", "LR", "LC", "CR"]
+
+    # The words of Antiquities, and this worker's preamble, fonts, and batch size.
+    _josephus: List[str] = []
+    _preamble = ""
+    _fonts: dict = dict()
+    _batch_size = 1
+
+    def __init__(self, recipe_filename="default.json", max_rows=4, num_trials=100, jobs=1, batch_size=1):
+        """
+        :param recipe_filename: The filename of the recipe, located in recipes/
+        :param max_rows: Calibrate each number of rows from 1 to this number.
+        :param num_trials: The number of trials of each (width, target, number of rows).
+        :param jobs: The number of worker processes.
+        :param batch_size: The number of words to try in one compile.
+        """
+
+        assert jobs > 0, f"Invalid number of jobs: {jobs}"
+        assert max_rows > 0, f"Invalid number of rows: {max_rows}"
+        self.recipe_filename = recipe_filename
+        compiled_recipe = CompiledRecipe(recipe_filename)
+        self.recipe = compiled_recipe.recipe
+        self.preamble = compiled_recipe.preamble
+        self.max_rows = max_rows
+        self.num_trials = num_trials
+        self.jobs = jobs
+        self.batch_size = batch_size
+
+    @staticmethod
+    def get_grid() -> List[Tuple[str, str, str]]:
+        """
+        Returns every (width, target, columns) that `Talmudifier` might ask for, e.g. ("half", "left", "LR").
+        """
+
+        grid = []
+        widths = set()
+        for columns in CalibrationSweep.ARRANGEMENTS:
+            for target, letter in [("left", "L"), ("center", "C"), ("right", "R")]:
+                if letter not in columns:
+                    continue
+                width = Paracol.get_width("L" in columns, "C" in columns, "R" in columns, target)
+                if (width, target) not in widths:
+                    widths.add((width, target))
+                    grid.append((width, target, columns))
+        return grid
+
+    def run(self, progress=True) -> Dict[str, Dict[str, Dict[str, dict]]]:
+        """
+        Run the trials of every (width, target, number of rows).
+        Returns a dictionary: width, target, number of rows, and then the spread of the trials:
+        `{"mean": 47, "stdev": 3.2, "min": 41, "max": 54, "trials": 100}`
+
+        :param progress: If true, show a progress bar.
+        """
+
+        # Divide each cell's trials into one chunk per job so that small grids still use every worker.
+        tasks = []
+        num_chunks = min(self.jobs, self.num_trials)
+        for width, target, columns in CalibrationSweep.get_grid():
+            for num_rows in range(1, self.max_rows + 1):
+                for i in range(num_chunks):
+                    num_trials = self.num_trials // num_chunks + (1 if i < self.num_trials % num_chunks else 0)
+                    tasks.append((width, target, columns, num_rows, num_trials))
+
+        initargs = (self.preamble, self.recipe["fonts"], self.batch_size)
+        if self.jobs == 1:
+            CalibrationSweep._initialize_worker(*initargs)
+            results = [CalibrationSweep._run_task(task) for task in tqdm(tasks, disable=not progress)]
+        else:
+            with Pool(self.jobs, initializer=CalibrationSweep._initialize_worker, initargs=initargs) as pool:
+                results = list(tqdm(pool.imap_unordered(CalibrationSweep._run_task, tasks), total=len(tasks),
+                                    disable=not progress))
+                # Let the workers exit on their own so that they remove their scratch directories.
+                pool.close()
+                pool.join()
+
+        # Combine the chunks.
+        trials: Dict[Tuple[str, str, int], List[int]] = dict()
+        for width, target, num_rows, num_chars in results:
+            key = (width, target, num_rows)
+            if key not in trials:
+                trials[key] = []
+            trials[key].extend(num_chars)
+
+        spreads = dict()
+        for (width, target, num_rows), num_chars in sorted(trials.items()):
+            if width not in spreads:
+                spreads[width] = dict()
+            if target not in spreads[width]:
+                spreads[width][target] = dict()
+            spreads[width][target][str(num_rows)] = {"mean": round(mean(num_chars)),
+                                                     "stdev": round(pstdev(num_chars), 1),
+                                                     "min": min(num_chars),
+                                                     "max": max(num_chars),
+                                                     "trials": len(num_chars)}
+        return spreads
+
+    def write(self, spreads: Dict[str, Dict[str, Dict[str, dict]]], path: Optional[str] = None) -> str:
+        """
+        Write the means into the recipe's `character_counts`. Other keys of the recipe are unchanged.
+        Returns the path to the recipe.
+
+        :param spreads: The results of `self.run()`.
+        :param path: The path to the output file. If None, overwrite the recipe.
+        """
+
+        if path is None:
+            path = "recipes/" + self.recipe_filename
+        if "character_counts" not in self.recipe:
+            self.recipe["character_counts"] = dict()
+        counts = self.recipe["character_counts"]
+        for width in spreads:
+            if width not in counts:
+                counts[width] = dict()
+            for target in spreads[width]:
+                if target not in counts[width]:
+                    counts[width][target] = dict()
+                for num_rows in spreads[width][target]:
+                    counts[width][target][num_rows] = spreads[width][target][num_rows]["mean"]
+        with io.open(path, "wt", encoding="utf-8") as f:
+            dump(self.recipe, f, indent=2, ensure_ascii=False)
+        return path
+
+    @staticmethod
+    def get_report(spreads: Dict[str, Dict[str, Dict[str, dict]]]) -> str:
+        """
+        Returns a table of the spread of each estimate.
+
+        :param spreads: The results of `self.run()`.
+        """
+
+        lines = ["Width       Target  Rows  Mean  Stdev  Min  Max  Trials"]
+        for width in spreads:
+            for target in spreads[width]:
+                for num_rows, s in spreads[width][target].items():
+                    lines.append(f"{width:<12}{target:<8}{num_rows:>4}{s['mean']:>6}{s['stdev']:>7}{s['min']:>5}"
+                                 f"{s['max']:>5}{s['trials']:>8}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _initialize_worker(preamble: str, fonts: dict, batch_size: int) -> None:
+        """
+        Read the words of Antiquities once per worker process.
+
+        :param preamble: The recipe's preamble.
+        :param fonts: The recipe's fonts.
+        :param batch_size: The number of words to try in one compile.
+        """
+
+        CalibrationSweep._preamble = preamble
+        CalibrationSweep._fonts = fonts
+        CalibrationSweep._batch_size = batch_size
+        if len(CalibrationSweep._josephus) == 0:
+            CalibrationSweep._josephus = RowLengthCalculator.read_josephus()
+
+    @staticmethod
+    def _run_task(task: Tuple[str, str, str, int, int]) -> Tuple[str, str, int, List[int]]:
+        """
+        Run some of the trials of one (width, target, number of rows) in this worker process.
+        Returns the width, the target, the number of rows, and the number of characters of each trial.
+
+        :param task: A tuple: The width, the target, the columns, the number of rows, and the number of trials.
+        """
+
+        width, target, columns, num_rows, num_trials = task
+        calculator = RowLengthCalculator(columns, target, RowLengthCalculator.get_font(target),
+                                         RowLengthCalculator.get_font_size(CalibrationSweep._fonts, target),
+                                         num_rows, batch_size=CalibrationSweep._batch_size,
+                                         preamble=CalibrationSweep._preamble)
+        return width, target, num_rows, calculator.get_trials(num_trials, CalibrationSweep._josephus, progress=False)
 
 
 if __name__ == "__main__":
@@ -119,22 +358,27 @@ if __name__ == "__main__":
     parser.add_argument("--rows", nargs="?", default=1, type=int)
     parser.add_argument("--trials", nargs="?", default=100, type=int)
     parser.add_argument("--recipe", nargs="?", default="default.json")
+    parser.add_argument("--batch", nargs="?", default=1, type=int)
+    parser.add_argument("--sweep", action="store_true")
+    parser.add_argument("--jobs", nargs="?", default=1, type=int)
+    parser.add_argument("--output", nargs="?", default=None)
 
     args = parser.parse_args()
 
-    # Load the recipe
-    with open("recipes/" + args.recipe, "rt") as f:
-        recipe = load(f)
-    if args.target == "left":
-        font = r"\leftfont"
-    elif args.target == "center":
-        font = r"\centerfont"
-    elif args.target == "right":
-        font = r"\rightfont"
+    # Calibrate every width, target, and number of rows, and write the results to the recipe.
+    if args.sweep:
+        sweep = CalibrationSweep(args.recipe, max_rows=args.rows, num_trials=args.trials, jobs=args.jobs,
+                                 batch_size=args.batch)
+        results = sweep.run()
+        print(CalibrationSweep.get_report(results))
+        print(f"Recipe: {sweep.write(results, args.output)}")
     else:
-        raise Exception(f"Invalid target: {args.target}")
-
-    size = r"\fontsize{" + str(recipe["fonts"][args.target]["size"]) + "}{" + str(recipe["fonts"][args.target]["skip"]) + "}"
+        # Load the recipe
+        with open("recipes/" + args.recipe, "rt") as f:
+            recipe = load(f)
+        font = RowLengthCalculator.get_font(args.target)
+        size = RowLengthCalculator.get_font_size(recipe["fonts"], args.target)
 
-    num_chars = RowLengthCalculator(args.columns, args.target, font, size, args.rows).get_num_chars(args.trials)
-    print(f"Cols: {args.columns}\nTarget: {args.target}\nRows: {args.rows}\nAVERAGE: {num_chars}")
+        num_chars = RowLengthCalculator(args.columns, args.target, font, size, args.rows, batch_size=args.batch,
+                                        preamble=CompiledRecipe(args.recipe).preamble).get_num_chars(args.trials)
+        print(f"Cols: {args.columns}\nTarget: {args.target}\nRows: {args.rows}\nAVERAGE: {num_chars}")
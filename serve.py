@@ -0,0 +1,27 @@
+from argparse import ArgumentParser
+from talmudifier.render_service import RenderService
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--recipes", nargs="*", default=["default.json"])
+    parser.add_argument("--jobs", nargs="?", default=1, type=int)
+    parser.add_argument("--host", nargs="?", default="127.0.0.1")
+    parser.add_argument("--port", nargs="?", default=8000, type=int)
+    parser.add_argument("--max_queue", nargs="?", default=64, type=int)
+    parser.add_argument("--server", action="store_true")
+    parser.add_argument("--cache", nargs="?", default=None)
+    parser.add_argument("--engine", nargs="?", default="xelatex")
+    parser.add_argument("--capped", action="store_true")
+    parser.add_argument("--page_cache", nargs="?", default=None)
+    parser.add_argument("--no_warm_up", action="store_true")
+    parser.add_argument("--job_timeout", nargs="?", default=3600, type=float)
+
+    args = parser.parse_args()
+
+    service = RenderService(recipes=args.recipes, jobs=args.jobs, max_queue=args.max_queue, host=args.host,
+                            port=args.port, warm_up=not args.no_warm_up, job_timeout=args.job_timeout, use_server=args.server,
+                            cache_path=args.cache, engine=args.engine, capped=args.capped,
+                            page_cache_path=args.page_cache)
+    print(f"Serving on http://{service.host}:{service.port}")
+    service.start(block=True)
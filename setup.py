@@ -20,7 +20,7 @@ setup(
     # Versions should comply with PEP440.  For a discussion on single-sourcing
     # the version across setup.py and the project code, see
     # https://packaging.python.org/en/latest/single_source_version.html
-    version="1.1.0",
+    version="1.2.0",
 
     description='Generate Talmud-esque PDFs.',
     long_description="Given three blocks of text (corresponding to three columns), generate a Talmud page.",
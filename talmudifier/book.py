@@ -0,0 +1,264 @@
+from json import load
+from multiprocessing import Pool
+from os import getpid
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+import io
+from tqdm import tqdm
+from talmudifier.compiled_recipe import CompiledRecipe
+from talmudifier.row_cache import RowCache
+from talmudifier.page_cache import PageCache
+from talmudifier.util import output_directory
+
+
+class Page:
+    """
+    The markdown text of one page, and an optional chapter title.
+    """
+
+    def __init__(self, left: str, center: str, right: str, chapter=""):
+        """
+        :param left: The markdown text of the left column.
+        :param center: The markdown text of the center column.
+        :param right: The markdown text of the right column.
+        :param chapter: If not empty, start the page with this chapter title.
+        """
+
+        self.left = left
+        self.center = center
+        self.right = right
+        self.chapter = chapter
+
+    @staticmethod
+    def read(path: str, chapter="") -> 'Page':
+        """
+        Read a page from a markdown file with a `# Left`, `# Center`, and `# Right` section (see test/test_input.md).
+
+        :param path: The path to the file.
+        :param chapter: If not empty, start the page with this chapter title.
+        """
+
+        sections = {"left": [], "center": [], "right": []}
+        section = None
+        with io.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("#") and line.lstrip("#").strip().lower() in sections:
+                    section = line.lstrip("#").strip().lower()
+                elif section is not None and line != "":
+                    sections[section].append(line)
+        return Page(" ".join(sections["left"]), " ".join(sections["center"]), " ".join(sections["right"]), chapter)
+
+
+class Book:
+    """
+    Lay out many pages in a pool of worker processes.
+    Each worker compiles the recipe once (see `CompiledRecipe`) and keeps it, and its measurement server, between pages.
+
+    ```python
+    from talmudifier.book import Book
+
+    book = Book.read_manifest("manifest.json", jobs=8)
+    book.write_book("my_book")
+    ```
+
+    A manifest is a JSON file:
+
+    ```json
+    {"recipe": "default.json",
+     "pages": [{"chapter": "Chapter 1", "left": "...", "center": "...", "right": "..."},
+               {"file": "page_2.md"}]}
+    ```
+
+    Each page is either markdown text or the path to a markdown file with `# Left`, `# Center`, and `# Right` sections.
+    """
+
+    # This worker process's compiled recipe, the arguments that it was compiled with, and the process ID.
+    _recipe: Optional[CompiledRecipe] = None
+    _recipe_args: Optional[tuple] = None
+    _recipe_pid = -1
+
+    def __init__(self, pages: List[Page], recipe_filename="default.json", jobs=1, use_server=False,
+                 cache_path: Optional[str] = None, simulate=False, batch_size=1, label_words=False, engine="xelatex",
+                 capped=False, page_cache_path: Optional[str] = None):
+        """
+        :param pages: The pages.
+        :param recipe_filename: The filename of the recipe, located in recipes/
+        :param jobs: The number of worker processes.
+        :param use_server: If true, each worker measures rows with its own long-lived xelatex process.
+        :param cache_path: If not None, the path to a SQLite row cache (see `RowCache`) shared by the workers.
+        :param simulate: If true, predict row breaks with font metrics and confirm them with xelatex.
+        :param batch_size: The number of candidates that a row maker measures in one compile at each step of its search.
+        :param label_words: If true, find the row of every word of a column in one compile and cut the column there.
+        :param engine: The TeX engine: "xelatex" or "lualatex" (see `Typesetter`).
+        :param capped: If true, find the shortest column by measuring only the first rows of each column.
+        :param page_cache_path: If not None, the path to a page cache (see `PageCache`) shared by the workers:
+                                a directory, or a SQLite database if the path ends with .db or .sqlite.
+        """
+
+        assert jobs > 0, f"Invalid number of jobs: {jobs}"
+        self.pages = pages
+        self.jobs = jobs
+        self.recipe_args = (recipe_filename, use_server, cache_path, simulate, batch_size, label_words, engine,
+                            capped, page_cache_path)
+
+    @staticmethod
+    def read_manifest(path: str, **kwargs) -> 'Book':
+        """
+        Returns a book from a manifest file.
+
+        :param path: The path to the manifest JSON file. Page files are relative to the manifest's directory.
+        :param kwargs: Parameters for the `Book` constructor.
+                       If the manifest has a recipe, it overrides `recipe_filename`.
+        """
+
+        with io.open(path, "rt", encoding="utf-8") as f:
+            manifest = load(f)
+        assert "pages" in manifest, f"No pages found in manifest: {path}"
+
+        pages = []
+        for data in manifest["pages"]:
+            chapter = data["chapter"] if "chapter" in data else ""
+            if "file" in data:
+                pages.append(Page.read(str(Path(path).parent.joinpath(data["file"])), chapter))
+            else:
+                for key in ["left", "center", "right"]:
+                    assert key in data, f"Page {len(pages)} doesn't have a {key} column."
+                pages.append(Page(data["left"], data["center"], data["right"], chapter))
+        if "recipe" in manifest:
+            kwargs["recipe_filename"] = manifest["recipe"]
+        return Book(pages, **kwargs)
+
+    def get_tex(self, progress=True) -> List[str]:
+        """
+        Lay out every page. Returns the LaTeX body of each page (without the preamble), in order.
+
+        :param progress: If true, show a progress bar.
+        """
+
+        return [tex for tex, _ in self._run([(page, None, None) for page in self.pages], progress)]
+
+    def write_pages(self, name="page", directory: str = output_directory, pdf=True, progress=True) -> List[str]:
+        """
+        Lay out every page, and write each page to its own .tex file and (optionally) its own PDF.
+        The workers write the PDFs. Returns the paths to the .tex files.
+
+        :param name: The filenames are `name_0`, `name_1`, etc.
+        :param directory: The output directory.
+        :param pdf: If true, create a PDF of each page.
+        :param progress: If true, show a progress bar.
+        """
+
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        tasks = [(page, str(Path(directory).resolve().joinpath(f"{name}_{i}")), pdf)
+                 for i, page in enumerate(self.pages)]
+        return [path for _, path in self._run(tasks, progress)]
+
+    def write_book(self, output_filename="book", directory: str = output_directory, pdf=True, progress=True) -> str:
+        """
+        Lay out every page and combine them into one document. Returns the path to the .tex file.
+        Each page is written to the .tex file as soon as it is laid out, so the book is never all in memory.
+
+        :param output_filename: The name of the output file.
+        :param directory: The output directory.
+        :param pdf: If true, create a PDF.
+        :param progress: If true, show a progress bar.
+        """
+
+        Book._initialize_worker(*self.recipe_args)
+        writer = Book._recipe.writer
+        path = str(Path(directory).resolve().joinpath(output_filename + ".tex"))
+        with writer.get_tex_file(path) as f:
+            for tex, _ in self._run([(page, None, None) for page in self.pages], progress):
+                f.write(tex)
+        if pdf:
+            writer.write_file(path)
+        return path
+
+    def _run(self, tasks: List[Tuple[Page, Optional[str], Optional[bool]]], progress: bool) \
+            -> Iterator[Tuple[str, str]]:
+        """
+        Run tasks in the worker processes and yield the results in order (see `Book._lay_out()`).
+
+        :param tasks: The tasks.
+        :param progress: If true, show a progress bar.
+        """
+
+        if self.jobs == 1 or len(tasks) <= 1:
+            Book._initialize_worker(*self.recipe_args)
+            for task in tqdm(tasks, disable=not progress):
+                yield Book._lay_out(task)
+            return
+        with Pool(min(self.jobs, len(tasks)), initializer=Book._initialize_worker, initargs=self.recipe_args) as pool:
+            yield from tqdm(pool.imap(Book._lay_out, tasks), total=len(tasks), disable=not progress)
+            # Let the workers exit on their own so that they stop their servers and remove their scratch directories.
+            pool.close()
+            pool.join()
+
+    @staticmethod
+    def _initialize_worker(recipe_filename: str, use_server: bool, cache_path: Optional[str], simulate: bool,
+                           batch_size: int, label_words: bool, engine: str, capped: bool,
+                           page_cache_path: Optional[str]) -> None:
+        """
+        Compile the recipe once per worker process.
+
+        :param recipe_filename: The filename of the recipe.
+        :param use_server: If true, measure rows with a long-lived xelatex process.
+        :param cache_path: If not None, the path to the SQLite row cache.
+        :param simulate: If true, predict row breaks with font metrics.
+        :param batch_size: The row maker batch size.
+        :param label_words: If true, label the row of every word.
+        :param engine: The TeX engine.
+        :param capped: If true, use capped measurements.
+        :param page_cache_path: If not None, the path to the page cache.
+        """
+
+        args = (recipe_filename, use_server, cache_path, simulate, batch_size, label_words, engine, capped,
+                page_cache_path)
+        if Book._recipe_args == args and Book._recipe_pid == getpid():
+            return
+        # A forked worker doesn't own its parent's measurement server.
+        if Book._recipe is not None and Book._recipe_pid == getpid():
+            Book._recipe.close()
+        Book._recipe_args = args
+        Book._recipe_pid = getpid()
+        cache = RowCache(path=cache_path) if cache_path is not None else None
+        page_cache = PageCache(page_cache_path) if page_cache_path is not None else None
+        Book._recipe = CompiledRecipe(recipe_filename, use_server=use_server, cache=cache, simulate=simulate,
+                                      batch_size=batch_size, label_words=label_words, engine=engine,
+                                      capped=capped, page_cache=page_cache)
+
+    @staticmethod
+    def _lay_out(task: Tuple[Page, Optional[str], Optional[bool]]) -> Tuple[str, str]:
+        """
+        Lay out one page in this worker process.
+        Returns the LaTeX body of the page, and the path to the .tex file (or an empty string).
+
+        :param task: A tuple: The page, the output path without an extension (or None), and whether to create a PDF.
+        """
+
+        page, path, pdf = task
+        recipe = Book._recipe
+        tex = recipe.get_chapter(page.chapter) + "\n" if page.chapter != "" else ""
+        tex += recipe.get_tex(page.left, page.center, page.right)
+        if path is None:
+            return tex, ""
+
+        with recipe.writer.get_tex_file(path + ".tex") as f:
+            f.write(tex)
+        if not pdf:
+            return tex, f.path
+        if recipe.page_cache is None:
+            recipe.writer.write_file(f.path)
+            return tex, f.path
+
+        # Copy the cached PDF, or create the PDF and cache it.
+        key = recipe.get_page_key(page.left, page.center, page.right, page.chapter)
+        cached = recipe.page_cache.get(key)
+        pdf_path = Path(path + ".pdf")
+        if cached is not None and cached[1] is not None:
+            pdf_path.write_bytes(cached[1])
+        else:
+            recipe.writer.write_file(f.path)
+            recipe.page_cache.put(key, tex, pdf_path.read_bytes())
+        return tex, f.path
@@ -17,6 +17,7 @@ class Citation:
         # Set the command to start the citation and the pattern to search for.
         self.command = data["command"]
         self.pattern = data["pattern"]
+        self.regex = re.compile(self.pattern)
 
     def apply_citation_to(self, word: str) -> (str, bool):
         """
@@ -26,7 +27,7 @@ class Citation:
         :return: (The modified word, True if the word was modified)
         """
 
-        match = re.match(self.pattern, word)
+        match = self.regex.match(word)
         if match is not None:
             return self.command + "{" + match.group(1) + "}", True
         else:
@@ -1,23 +1,29 @@
 from talmudifier.word import Word
-from typing import List
-from talmudifier.style import Style
+from typing import Iterator, List, Optional
+from talmudifier.tex_builder import TexBuilder
 
 
 class Column:
     """
     A column is a list of words and a font rule.
     From this, a valid block of TeX text can be generated.
+
+    The words can be read lazily from a source: `self.words` is only the words that have been read so far.
+    Call `self.fill()` to read more words.
     """
 
-    def __init__(self, words: List[Word], font: str, font_size: int, font_skip: int):
+    def __init__(self, words: List[Word], font: str, font_size: int, font_skip: int,
+                 source: Optional[Iterator[Word]] = None):
         """
         :param words: The list of words in the column.
         :param font: The command used to start the font.
         :param font_size: The font size.
         :param font_skip: The font skip size.
+        :param source: If not None, the rest of the words, after `words`. They are read when they are needed.
         """
 
         self.words = words
+        self.source = source
         self.font = font
         self.font_size = font_size
         self.font_skip = font_skip
@@ -27,82 +33,109 @@ class Column:
         else:
             self.font_command = ""
 
-    def get_tex(self, close_braces: bool, start_index=0, end_index=-1) -> str:
+        # The cached TeX builder (see `get_prefix_tex()`) and the list of words that it was built from.
+        self._builder: Optional[TexBuilder] = None
+        self._builder_words: Optional[List[Word]] = None
+
+    def get_tex(self, close_braces: bool, start_index=0, end_index=-1, mark_words=False) -> str:
         """
         Generate a LaTeX string from the words.
 
         :param close_braces: If true, make sure that all curly braces are closed.
         :param start_index: The start index.
         :param end_index: The end index. If this is -1, it is ignored.
+        :param mark_words: If true, start each word with `\\talmudifiermark{index}` (see `LogReader.DEFINE_MARK`).
         """
 
-        # Start the text with the font size and the font command.
-        tex = self.font_command + self.font + " "
-
-        style = Style(False, False, False)
-
         # Get the slice of words.
         if end_index == -1:
-            end_index = len(self.words)
-
-        for word, w in zip(self.words[start_index: end_index], range(start_index, end_index)):
-            # Add a citation word.
-            if word.is_citation:
-                # Close all braces.
-                tex = Column._close_braces(tex)
-                tex += word.word + " " + self.font + " "
-                continue
-
-            # Set bold style.
-            if word.style.bold and not style.bold:
-                tex += r"\textbf{"
-                style.bold = True
-            # Set italic style.
-            if word.style.italic and not style.italic:
-                tex += r"\textit{"
-                style.italic = True
-            # Set underline style.
-            if word.style.underline and not style.underline:
-                tex += r"\underline{"
-                style.underline = True
-
-            # Append the word.
-            tex += word.word
-
-            # Try to close style braces.
-            if w < end_index - 1:
-                next_word = self.words[w + 1]
-                if style.bold and not next_word.style.bold:
-                    style.bold = False
-                    tex += "}"
-                if style.italic and not next_word.style.italic:
-                    style.italic = False
-                    tex += "}"
-                if style.underline and not next_word.style.underline:
-                    style.underline = False
-                    tex += "}"
-
-                tex += " "
-
-        if close_braces:
-            tex = Column._close_braces(tex)
-
-        return tex
-
-    @staticmethod
-    def _close_braces(tex: str) -> str:
-        """
-        Add a } for every {.
-
-        :param tex: The TeX string.
-        """
-
-        num_braces = 0
-        for c in tex:
-            if c == "{":
-                num_braces += 1
-            elif c == "}":
-                num_braces -= 1
-        for i in range(num_braces):
-            tex += "}"
-        return tex
+            end_index = self.fill()
+        else:
+            self.fill(end_index)
+
+        # Prefixes of the column use the cached builder.
+        if start_index == 0 and not mark_words:
+            return self.get_prefix_tex(end_index, close_braces=close_braces)
+
+        builder = TexBuilder(self.font_command, self.font, mark_offset=start_index if mark_words else -1)
+        for word in self.words[start_index: end_index]:
+            builder.append(word)
+        return builder.get_tex(len(builder), close_braces=close_braces)
+
+    def get_prefix_tex(self, num_words: int, fragment: Optional[Word] = None, close_braces=True) -> str:
+        """
+        Generate a LaTeX string from the first words. This is the same as `get_tex(close_braces, 0, num_words)`,
+        but the rendered text is cached, so measuring many prefixes of the same column is fast.
+
+        :param num_words: The number of words.
+        :param fragment: If not None, append this word (e.g. the first half of a hyphenated word).
+        :param close_braces: If true, make sure that all curly braces are closed.
+        """
+
+        self.fill(num_words)
+        builder = self._get_builder()
+        # Render only as many words as needed.
+        while len(builder) < num_words:
+            builder.append(self.words[len(builder)])
+        return builder.get_tex(num_words, close_braces=close_braces, fragment=fragment)
+
+    def fill(self, num_words=-1) -> int:
+        """
+        Read words from the source until there are at least this many words in `self.words`.
+        Returns the number of words in `self.words`. If it is less than `num_words`, there are no more words.
+
+        :param num_words: The number of words. If this is -1, read every word.
+        """
+
+        while self.source is not None and (num_words == -1 or len(self.words) < num_words):
+            word = next(self.source, None)
+            if word is None:
+                self.source = None
+            else:
+                self.words.append(word)
+        return len(self.words)
+
+    def is_empty(self) -> bool:
+        """
+        Returns true if there are no more words.
+        """
+
+        return self.fill(1) == 0
+
+    def clear(self) -> None:
+        """
+        Remove all of the words.
+        """
+
+        self.words = []
+        self.source = None
+
+    def get_remainder(self, num_words: int, first_word: Optional[Word] = None) -> 'Column':
+        """
+        Returns a new column of the words after the first words. The new column reads from my source.
+
+        :param num_words: The number of words to skip.
+        :param first_word: If not None, start the new column with this word (e.g. the second half of a hyphenated word)
+                           and skip one more word.
+        """
+
+        if first_word is None:
+            words = self.words[num_words:]
+        else:
+            words = self.words[num_words + 1:]
+            words.insert(0, first_word)
+        return Column(words, self.font, self.font_size, self.font_skip, source=self.source)
+
+    def _get_builder(self) -> TexBuilder:
+        """
+        Returns the cached builder. If the list of words changed, discard the words that don't match.
+        """
+
+        if self._builder is None or self._builder_words is not self.words:
+            self._builder = TexBuilder(self.font_command, self.font)
+            self._builder_words = self.words
+        builder = self._builder
+        while len(builder) > len(self.words) or \
+                (len(builder) > 0 and builder.words[-1] is not self.words[len(builder) - 1]):
+            builder.pop()
+        return builder
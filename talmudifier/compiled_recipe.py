@@ -0,0 +1,344 @@
+from asyncio import gather
+from pathlib import Path
+from json import load
+from typing import Dict, Iterable, Optional, TextIO, Tuple, Union
+import io
+from talmudifier.util import to_camelcase
+from talmudifier.pdf_writer import PDFWriter
+from talmudifier.citation import Citation
+from talmudifier.substitutions import Substitutions
+from talmudifier.row_maker import RowMaker
+from talmudifier.paracol import Paracol
+from talmudifier.measurement_server import MeasurementServer
+from talmudifier.row_cache import RowCache
+from talmudifier.page_cache import PageCache
+from talmudifier.row_length_estimator import RowLengthEstimator
+from talmudifier.simulator import Simulator
+from talmudifier.typesetter import Typesetter
+from talmudifier.tex_file import TexFile
+
+
+class CompiledRecipe:
+    """
+    A recipe that has been read and compiled once: the preamble, the citations, the substitutions,
+    the paracol headers, the PDF writer, and the row makers.
+    One compiled recipe can lay out any number of pages:
+
+    ```python
+    from talmudifier.compiled_recipe import CompiledRecipe
+
+    recipe = CompiledRecipe("default.json")
+    for left, center, right in pages:
+        tex = recipe.get_tex(left, center, right)
+    recipe.close()
+    ```
+    """
+
+    COLUMN_NAMES = ["left", "center", "right"]
+
+    def __init__(self, recipe_filename="default.json", use_server=False, cache: Optional[RowCache] = None,
+                 simulate=False, batch_size=1, label_words=False, estimator: Optional[RowLengthEstimator] = None,
+                 engine="xelatex", capped=False, page_cache: Optional[PageCache] = None):
+        """
+        :param recipe_filename: The filename of the recipe, located in recipes/
+        :param use_server: If true, measure rows with a long-lived xelatex process that loads the preamble only once.
+        :param cache: If not None, cache row counts here.
+        :param simulate: If true, predict row breaks with font metrics and confirm them with xelatex.
+        :param batch_size: The number of candidates that a row maker measures in one compile at each step of its search.
+        :param label_words: If true, find the row of every word of a column in one compile and cut the column there.
+        :param estimator: If not None, learn the expected length of each block from the row breaks of earlier blocks.
+        :param engine: The TeX engine: "xelatex" or "lualatex" (see `Typesetter`).
+        :param capped: If true, find the shortest column by measuring only the first rows of each column.
+        :param page_cache: If not None, cache whole pages here.
+        """
+
+        # Read the recipe.
+        recipe_path = Path(f"recipes/{recipe_filename}")
+        if not recipe_path.exists():
+            print(f"Couldn't find recipe: {recipe_filename}; using default.json instead.")
+        with io.open(str(recipe_path.resolve()), "rt", encoding="utf-8") as f:
+            self.recipe = load(f)
+
+        # header.txt is installed next to this module.
+        header_file = str(Path(__file__).resolve().parent.joinpath("header.txt"))
+
+        # Read the preamble.
+        assert Path(header_file).exists()
+        with io.open(header_file, "rt", encoding="utf-8") as f:
+            self.preamble = f.read()
+
+        # Append font declarations.
+        for col_name in CompiledRecipe.COLUMN_NAMES:
+            self.preamble += "\n" + self._get_font_declaration(col_name)
+
+            # Append a citation font declaration, if any.
+            citation_declaration = self._get_citation_font_declaration(col_name)
+            if citation_declaration is not None:
+                self.preamble += "\n" + citation_declaration
+
+        # Append color declarations.
+        if "colors" in self.recipe:
+            for color in self.recipe["colors"]:
+                self.preamble += "\n\\definecolor{" + color + "}{HTML}{" + self.recipe["colors"][color] + "}"
+
+        # Append the chapter command.
+        assert "chapter" in self.recipe, "Chapter not found in recipe."
+        assert "definition" in self.recipe["chapter"], "Chapter definition not found."
+        self.preamble += "\n" + self.recipe["chapter"]["definition"]
+
+        # Append additional definitions.
+        if "misc_definitions" in self.recipe:
+            for d in self.recipe["misc_definitions"]:
+                self.preamble += "\n" + d
+
+        # Create the PDF writer.
+        self.writer = PDFWriter(self.preamble, Typesetter.get(engine))
+
+        # Create the measurement server. It will start when it is first needed.
+        self.server = MeasurementServer(self.writer) if use_server else None
+        self.cache = cache
+        self.simulator = Simulator(self.recipe, self.preamble) if simulate else None
+        assert batch_size > 0, f"Invalid batch size: {batch_size}"
+        self.batch_size = batch_size
+        self.label_words = label_words
+        self.estimator = estimator
+        self.capped = capped
+        self.page_cache = page_cache
+
+        # Compile each column's font sizes, citation, and substitutions.
+        self.font_sizes: Dict[str, Tuple[int, int]] = dict()
+        self.citations: Dict[str, Optional[Citation]] = dict()
+        self.substitutions: Dict[str, Optional[Substitutions]] = dict()
+        for col_name in CompiledRecipe.COLUMN_NAMES:
+            font_data = self.recipe["fonts"][col_name]
+            # Get the font-size command.
+            if "skip" not in font_data or "size" not in font_data:
+                self.font_sizes[col_name] = (-1, -1)
+            else:
+                self.font_sizes[col_name] = (font_data["size"], font_data["skip"])
+            self.citations[col_name] = Citation(font_data["citation"]) if "citation" in font_data else None
+            self.substitutions[col_name] = Substitutions(font_data["substitutions"]) \
+                if "substitutions" in font_data else None
+
+        self._paracol_headers: Dict[Tuple[bool, bool, bool], str] = dict()
+        self._row_makers: Dict[Tuple[bool, bool, bool, str], RowMaker] = dict()
+
+    def _get_font_declaration(self, column_name: str) -> str:
+        """
+        Returns the font declaration in the recipe associated with the column.
+
+        :param column_name: The name of the column (left, center, right).
+        """
+
+        # Check that all required keys are present.
+        assert "fonts" in self.recipe, "No fonts found in recipe!"
+        assert column_name in self.recipe["fonts"], f"No fonts found for: {column_name}"
+        font_data = self.recipe["fonts"][column_name]
+        for required_key in ["path", "ligatures", "regular_font"]:
+            assert required_key in font_data, f"Required key in {column_name} not found: {required_key}"
+
+        # Append a / to the path if needed.
+        path = font_data['path']
+        if not path.endswith("/"):
+            path += "/"
+
+        declaration = f"\\newfontfamily\\{column_name}font[Path={path}, Ligatures={font_data['ligatures']}"
+
+        # Add styles to the declaration.
+        for style_key in ["italic_font", "bold_font", "bold_italic_font"]:
+            if style_key in font_data:
+                declaration += f", {to_camelcase(style_key)}={font_data[style_key]}"
+
+        # Finish the declaration and add the regular font.
+        declaration += "]{" + font_data["regular_font"] + "}"
+        return declaration
+
+    def _get_citation_font_declaration(self, column_name: str) -> Optional[str]:
+        """
+        Returns the font declaration for a citation. May be none.
+
+        :param column_name: The name of the column associated with the citation.
+        """
+
+        # Check that all required keys are present.
+        assert "fonts" in self.recipe, "No fonts found in recipe!"
+        assert column_name in self.recipe["fonts"], f"No fonts found for: {column_name}"
+        font_data = self.recipe["fonts"][column_name]
+
+        # Check if there is a citation.
+        if "citation" not in font_data:
+            return None
+
+        citation_data = font_data["citation"]
+        for required_key in ["path", "font", "font_command", "pattern"]:
+            assert required_key in citation_data, f"Required key in citation {column_name} not found: {required_key}"
+
+        # Append a / to the path if needed.
+        path = citation_data['path']
+        if not path.endswith("/"):
+            path += "/"
+
+        return "\\newfontfamily" + citation_data["font_command"] + "[Path=" + path + "]{" + citation_data["font"] + "}"
+
+    def get_page_key(self, text_left: str, text_center: str, text_right: str, chapter="") -> str:
+        """
+        Returns the page cache key of a page (see `PageCache.get_key()`).
+
+        :param text_left: The markdown text of the left column.
+        :param text_center: The markdown text of the center column.
+        :param text_right: The markdown text of the right column.
+        :param chapter: The chapter title, if any.
+        """
+
+        # The font files are checked every time, in case they changed.
+        fingerprint = PageCache.get_fingerprint(self.recipe, self.writer.preamble, self.writer.typesetter.name)
+        return PageCache.get_key(fingerprint, text_left, text_center, text_right, chapter)
+
+    def get_paracol_header(self, left: bool, center: bool, right: bool) -> str:
+        """
+        Returns a paracol header with the correct column widths (see `Paracol.get_paracol_header()`).
+
+        :param left: If true, a left column exists.
+        :param center: If true, a center column exists.
+        :param right: If true, a right column exists.
+        """
+
+        key = (left, center, right)
+        if key not in self._paracol_headers:
+            self._paracol_headers[key] = Paracol.get_paracol_header(left, center, right)
+        return self._paracol_headers[key]
+
+    def get_row_maker(self, left: bool, center: bool, right: bool, target: str) -> RowMaker:
+        """
+        Returns a row maker that uses my writer, measurement server, cache, and simulator.
+        Row makers don't change between pages, so there is only one for each arrangement of columns.
+
+        :param left: If true, a left column exists.
+        :param center: If true, a center column exists.
+        :param right: If true, a right column exists.
+        :param target: The name of the target column: left, center, or right.
+        """
+
+        key = (left, center, right, target)
+        if key not in self._row_makers:
+            self._row_makers[key] = RowMaker(left, center, right, target, self.writer, self.server, self.cache,
+                                             simulator=self.simulator, batch_size=self.batch_size,
+                                             label_words=self.label_words, estimator=self.estimator)
+        return self._row_makers[key]
+
+    def get_tex(self, text_left: Union[str, TextIO, Iterable[str]], text_center: Union[str, TextIO, Iterable[str]],
+                text_right: Union[str, TextIO, Iterable[str]]) -> str:
+        """
+        Returns the body of a page (see `Talmudifier.get_tex()`).
+
+        :param text_left: The markdown text of the left column: A string, a file, or an iterable of strings.
+        :param text_center: The markdown text of the center column: A string, a file, or an iterable of strings.
+        :param text_right: The markdown text of the right column: A string, a file, or an iterable of strings.
+        """
+
+        # Talmudifier imports this module.
+        from talmudifier.talmudifier import Talmudifier
+
+        return Talmudifier(text_left, text_center, text_right, compiled_recipe=self).get_tex()
+
+    def write_tex(self, tex_file: TexFile, text_left: Union[str, TextIO, Iterable[str]],
+                  text_center: Union[str, TextIO, Iterable[str]], text_right: Union[str, TextIO, Iterable[str]]) -> None:
+        """
+        Lay out a page and write each paracol block to a .tex file as soon as it is laid out
+        (see `Talmudifier.write_tex()`).
+
+        :param tex_file: The .tex file (see `PDFWriter.get_tex_file()`).
+        :param text_left: The markdown text of the left column: A string, a file, or an iterable of strings.
+        :param text_center: The markdown text of the center column: A string, a file, or an iterable of strings.
+        :param text_right: The markdown text of the right column: A string, a file, or an iterable of strings.
+        """
+
+        from talmudifier.talmudifier import Talmudifier
+
+        Talmudifier(text_left, text_center, text_right, compiled_recipe=self).write_tex(tex_file)
+
+    async def get_tex_async(self, text_left: Union[str, TextIO, Iterable[str]],
+                            text_center: Union[str, TextIO, Iterable[str]],
+                            text_right: Union[str, TextIO, Iterable[str]]) -> str:
+        """
+        Returns the body of a page (see `Talmudifier.get_tex_async()`). xelatex runs in asynchronous subprocesses.
+
+        :param text_left: The markdown text of the left column: A string, a file, or an iterable of strings.
+        :param text_center: The markdown text of the center column: A string, a file, or an iterable of strings.
+        :param text_right: The markdown text of the right column: A string, a file, or an iterable of strings.
+        """
+
+        from talmudifier.talmudifier import Talmudifier
+
+        return await Talmudifier(text_left, text_center, text_right, compiled_recipe=self).get_tex_async()
+
+    def create_pdf(self, pages: Iterable[Tuple[str, str, str]], chapter="", output_filename="output",
+                   print_tex=False) -> str:
+        """
+        Lay out many pages and create one PDF. Returns the LaTeX string.
+
+        :param pages: The pages. Each page is a tuple of markdown text: (left, center, right).
+        :param chapter: If not empty, create the header here.
+        :param output_filename: The name of the output file.
+        :param print_tex: If true, print the LaTeX string to the console.
+        """
+
+        # Create the title.
+        tex = self.get_chapter(chapter) + "\n" if chapter != "" else ""
+        # Append the pages.
+        for text_left, text_center, text_right in pages:
+            tex += self.get_tex(text_left, text_center, text_right)
+
+        # Create the PDF.
+        tex = self.writer.write(tex, output_filename)
+        if print_tex:
+            print(tex)
+        return tex
+
+    async def create_pdf_async(self, pages: Iterable[Tuple[str, str, str]], chapter="", output_filename="output",
+                               print_tex=False) -> str:
+        """
+        Lay out many pages concurrently in one event loop and create one PDF (see `self.create_pdf()`).
+        The number of xelatex processes that run at the same time is limited by `PDFWriter.max_compiles`.
+        Returns the LaTeX string.
+
+        :param pages: The pages. Each page is a tuple of markdown text: (left, center, right).
+        :param chapter: If not empty, create the header here.
+        :param output_filename: The name of the output file.
+        :param print_tex: If true, print the LaTeX string to the console.
+        """
+
+        tex = self.get_chapter(chapter) + "\n" if chapter != "" else ""
+        # Lay out the pages concurrently. The results are in order.
+        tex += "".join(await gather(*[self.get_tex_async(text_left, text_center, text_right)
+                                      for text_left, text_center, text_right in pages]))
+
+        tex = await self.writer.write_async(tex, output_filename)
+        if print_tex:
+            print(tex)
+        return tex
+
+    def get_chapter(self, title: str) -> str:
+        """
+        Returns the chapter command.
+
+        :param title: The title of the chapter.
+        """
+
+        assert "chapter" in self.recipe, "Chapter not found in recipe."
+        assert "command" in self.recipe["chapter"], "Chapter command not found in recipe."
+        assert "numbering" in self.recipe["chapter"], "Chapter numbering not found in recipe."
+
+        chapter = "\\chapter"
+        if not self.recipe["chapter"]["numbering"]:
+            chapter += "*"
+        chapter += "{" + self.recipe["chapter"]["command"] + "{" + title + "}}"
+        return chapter
+
+    def close(self) -> None:
+        """
+        Stop the measurement server, if there is one.
+        """
+
+        if self.server is not None:
+            self.server.stop()
@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+from typing import Callable, List, Optional, Tuple
+from talmudifier.substitutions import Substitutions
+import json
+import sqlite3
+
+
+class HyphenationCache:
+    """
+    A cache of hyphenated pairs of words (e.g. Cal- ifornia), keyed by the word and its substitutions.
+
+    The cache has two tiers: an in-memory LRU cache, and an optional SQLite database on disk.
+    The database survives across runs and can be shared between processes.
+    """
+
+    def __init__(self, max_size=100000, path: Optional[str] = None):
+        """
+        :param max_size: The maximum number of entries in memory.
+        :param path: The path to the SQLite database. If None, there is no on-disk tier.
+        """
+
+        self.max_size = max_size
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db: Optional[sqlite3.Connection] = sqlite3.connect(path, timeout=60, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS pairs (key TEXT PRIMARY KEY, pairs TEXT NOT NULL)")
+            self._db.commit()
+        else:
+            self._db = None
+
+    @staticmethod
+    def get_key(word: str, substitutions: Optional[Substitutions]) -> str:
+        """
+        Returns the cache key of a word.
+
+        :param word: The word, before substitutions.
+        :param substitutions: The word's substitutions.
+        """
+
+        h = sha256()
+        h.update(word.encode("utf-8"))
+        h.update(b"\0")
+        if substitutions is not None:
+            h.update(substitutions.key.encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, word: str, substitutions: Optional[Substitutions],
+            hyphenate: Callable[[], List[Tuple[str, str]]]) -> List[Tuple[str, str]]:
+        """
+        Returns the cached pairs of a word. If there aren't any, hyphenate the word and cache the result.
+
+        :param word: The word, before substitutions.
+        :param substitutions: The word's substitutions.
+        :param hyphenate: A function that returns the hyphenated pairs of the word.
+        """
+
+        key = HyphenationCache.get_key(word, substitutions)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+        pairs = self._get_from_disk(key)
+        if pairs is None:
+            pairs = hyphenate()
+            with self._lock:
+                self.misses += 1
+            self._write_to_disk(key, pairs)
+        else:
+            with self._lock:
+                self.disk_hits += 1
+
+        with self._lock:
+            self._memory[key] = pairs
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
+        return pairs
+
+    def get_stats(self) -> dict:
+        """
+        Returns the number of hits, misses, etc. as a dictionary.
+        """
+
+        with self._lock:
+            return {"hits": self.hits,
+                    "disk_hits": self.disk_hits,
+                    "misses": self.misses,
+                    "size": len(self._memory)}
+
+    def clear(self) -> None:
+        """
+        Clear the in-memory cache. The database is unchanged.
+        """
+
+        with self._lock:
+            self._memory.clear()
+
+    def close(self) -> None:
+        """
+        Close the database connection, if any.
+        """
+
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _get_from_disk(self, key: str) -> Optional[List[Tuple[str, str]]]:
+        """
+        Returns the pairs stored in the database, or None if there isn't an entry.
+
+        :param key: The cache key.
+        """
+
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT pairs FROM pairs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return [(p[0], p[1]) for p in json.loads(row[0])]
+
+    def _write_to_disk(self, key: str, pairs: List[Tuple[str, str]]) -> None:
+        """
+        Store the pairs in the database.
+
+        :param key: The cache key.
+        :param pairs: The pairs.
+        """
+
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO pairs (key, pairs) VALUES (?, ?)", (key, json.dumps(pairs)))
+            self._db.commit()
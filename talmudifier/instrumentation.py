@@ -0,0 +1,226 @@
+from json import dump
+from os import getpid
+from pathlib import Path
+from threading import Lock, get_ident
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+import io
+
+
+class Span:
+    """
+    A timed event. Use it as a context manager (see `Instrumentation.span()`).
+    """
+
+    def __init__(self, instrumentation: 'Instrumentation', name: str, category: str, args: dict):
+        """
+        :param instrumentation: The instrumentation that records this span.
+        :param name: The name of the event, e.g. "xelatex".
+        :param category: The category of the event, e.g. "compile".
+        :param args: Additional data.
+        """
+
+        self.instrumentation = instrumentation
+        self.name = name
+        self.category = category
+        self.args = args
+        self.t0 = 0.0
+
+    def set(self, **kwargs) -> None:
+        """
+        Add data to the event.
+        """
+
+        self.args.update(kwargs)
+
+    def add(self, key: str, value=1) -> None:
+        """
+        Add a number to the event's data.
+
+        :param key: The key.
+        :param value: The number.
+        """
+
+        self.args[key] = self.args.get(key, 0) + value
+
+    def __enter__(self):
+        self.t0 = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.instrumentation.record(self.name, self.category, self.t0, perf_counter() - self.t0, self.args)
+
+
+class _NullSpan:
+    """
+    A span that does nothing. `Instrumentation.span()` returns this when instrumentation is disabled.
+    """
+
+    def set(self, **kwargs) -> None:
+        pass
+
+    def add(self, key: str, value=1) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class Instrumentation:
+    """
+    Record where the time goes: each xelatex compile, each PDF parse, each `RowMaker` block, and each iteration of
+    `Talmudifier.get_tex()`. Export a JSON summary or a Chrome trace (open it in chrome://tracing or Perfetto).
+
+    ```python
+    from talmudifier.instrumentation import Instrumentation
+    from talmudifier.talmudifier import Talmudifier
+
+    instrumentation = Instrumentation()
+    instrumentation.start()
+    Talmudifier(left, center, right).create_pdf()
+    instrumentation.stop()
+    instrumentation.write_summary("Output/summary.json")
+    instrumentation.write_trace("Output/trace.json")
+    ```
+
+    When no instrumentation is started, `Instrumentation.span()` returns a span that does nothing.
+    """
+
+    # The instrumentation that is recording, if any.
+    current: Optional['Instrumentation'] = None
+    _NULL_SPAN = _NullSpan()
+
+    def __init__(self, max_events=1000000):
+        """
+        :param max_events: Stop keeping events after this many. They are still counted and sent to the callbacks.
+        """
+
+        self.max_events = max_events
+        self.events: List[dict] = list()
+        self.counters: Dict[str, int] = dict()
+        self.callbacks: List[Callable[[dict], None]] = list()
+        self._t0 = perf_counter()
+        self._lock = Lock()
+
+    def start(self) -> None:
+        """
+        Start recording. Only one instrumentation records at a time.
+        """
+
+        self._t0 = perf_counter()
+        Instrumentation.current = self
+
+    def stop(self) -> None:
+        """
+        Stop recording.
+        """
+
+        if Instrumentation.current is self:
+            Instrumentation.current = None
+
+    def add_callback(self, callback: Callable[[dict], None]) -> None:
+        """
+        Call a function with each event when it ends.
+        An event is a dictionary: `{"name": "xelatex", "cat": "compile", "ts": 0.5, "dur": 1.2, "args": {...}}`.
+        Times are in seconds.
+
+        :param callback: The function.
+        """
+
+        self.callbacks.append(callback)
+
+    @staticmethod
+    def span(name: str, category: str, **kwargs):
+        """
+        Returns a context manager that times an event, or a span that does nothing if nothing is recording.
+
+        :param name: The name of the event, e.g. "xelatex".
+        :param category: The category of the event, e.g. "compile".
+        :param kwargs: Additional data.
+        """
+
+        if Instrumentation.current is None:
+            return Instrumentation._NULL_SPAN
+        return Span(Instrumentation.current, name, category, kwargs)
+
+    @staticmethod
+    def count(name: str, value=1) -> None:
+        """
+        Add to a counter, if anything is recording.
+
+        :param name: The name of the counter.
+        :param value: The number to add.
+        """
+
+        instrumentation = Instrumentation.current
+        if instrumentation is None:
+            return
+        with instrumentation._lock:
+            instrumentation.counters[name] = instrumentation.counters.get(name, 0) + value
+
+    def record(self, name: str, category: str, t0: float, duration: float, args: dict) -> None:
+        """
+        Record an event that has ended.
+
+        :param name: The name of the event.
+        :param category: The category of the event.
+        :param t0: The start time (`time.perf_counter()`).
+        :param duration: The duration in seconds.
+        :param args: Additional data.
+        """
+
+        event = {"name": name, "cat": category, "ts": t0 - self._t0, "dur": duration, "pid": getpid(),
+                 "tid": get_ident(), "args": args}
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+            if len(self.events) < self.max_events:
+                self.events.append(event)
+        for callback in self.callbacks:
+            callback(event)
+
+    def get_summary(self) -> dict:
+        """
+        Returns the counters, and the number, total time, and maximum time of each kind of event.
+        """
+
+        with self._lock:
+            phases = dict()
+            for event in self.events:
+                if event["name"] not in phases:
+                    phases[event["name"]] = {"category": event["cat"], "count": 0, "seconds": 0.0, "max_seconds": 0.0}
+                phase = phases[event["name"]]
+                phase["count"] += 1
+                phase["seconds"] += event["dur"]
+                phase["max_seconds"] = max(phase["max_seconds"], event["dur"])
+            return {"counters": dict(self.counters), "phases": phases, "events": len(self.events)}
+
+    def write_summary(self, path: str) -> None:
+        """
+        Write the summary to a JSON file (see `self.get_summary()`).
+
+        :param path: The path to the file.
+        """
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with io.open(path, "wt", encoding="utf-8") as f:
+            dump(self.get_summary(), f, indent=2)
+
+    def write_trace(self, path: str) -> None:
+        """
+        Write the events to a Chrome trace-event JSON file.
+
+        :param path: The path to the file.
+        """
+
+        with self._lock:
+            trace = [{"name": e["name"], "cat": e["cat"], "ph": "X", "ts": round(e["ts"] * 1000000),
+                      "dur": round(e["dur"] * 1000000), "pid": e["pid"], "tid": e["tid"], "args": e["args"]}
+                     for e in self.events]
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with io.open(path, "wt", encoding="utf-8") as f:
+            dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
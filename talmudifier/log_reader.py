@@ -0,0 +1,131 @@
+from os.path import exists
+from typing import Dict, List, Optional
+import io
+
+
+class LogReader:
+    """
+    Reads the number of rows that a paragraph reported to the xelatex log.
+    This is much faster than extracting the text of a PDF (see `PDFReader`).
+    """
+
+    # The prefix of the line that xelatex writes to the log after it typesets a measured paragraph.
+    ROWS = "TALMUDIFIER_ROWS="
+    # End the paragraph and report its number of rows. Append this to the end of the measured text.
+    REPORT_ROWS = r"\par\typeout{" + ROWS + r"\the\prevgraf}"
+    # The prefix of the line that xelatex writes to the log when it ships out a marked word.
+    WORD = "TALMUDIFIER_WORD="
+    # Define `\talmudifiermark{i}`: when the page is shipped out, write word i's page and baseline position.
+    DEFINE_MARK = r"\def\talmudifiermark#1{\pdfsavepos\write16{" + WORD + r"#1,\thepage,\the\pdflastypos}}"
+
+    @staticmethod
+    def get_num_rows_from_line(line: str) -> Optional[int]:
+        """
+        Returns the number of rows reported on a line of xelatex output, or None if the line isn't a report.
+
+        :param line: The line.
+        """
+
+        # Error messages can quote the measured text, so only accept lines that start with the prefix.
+        if not line.startswith(LogReader.ROWS):
+            return None
+        num_rows = line[len(LogReader.ROWS):].strip()
+        if not num_rows.isdigit():
+            return None
+        # An empty paragraph is one row (see `PDFReader.get_num_rows()`).
+        return max(int(num_rows), 1)
+
+    @staticmethod
+    def get_lines(log_path: str) -> List[str]:
+        """
+        Returns the lines of a log file. If the file doesn't exist, returns an empty list.
+
+        :param log_path: The filepath to the log file.
+        """
+
+        if not exists(log_path):
+            return []
+        with io.open(log_path, "rt", encoding="utf-8", errors="replace") as f:
+            return f.readlines()
+
+    @staticmethod
+    def get_error(lines: List[str], max_lines=12) -> str:
+        """
+        Returns the part of a log that describes the first TeX error: the error message (a line that starts with `!`)
+        through the line of input where it happened (a line that starts with `l.`).
+        If there isn't an error message, returns the end of the log.
+
+        :param lines: The lines of the log.
+        :param max_lines: The maximum number of lines.
+        """
+
+        for i in range(len(lines)):
+            if lines[i].startswith("!"):
+                excerpt = lines[i: i + max_lines]
+                for j in range(len(excerpt)):
+                    if excerpt[j].startswith("l."):
+                        # Include the rest of the input line, which is on the next line of the log.
+                        excerpt = excerpt[: j + 2]
+                        break
+                return "".join(excerpt).rstrip()
+        return "".join(lines[-max_lines:]).rstrip()
+
+    @staticmethod
+    def get_num_rows(log_path: str) -> Optional[int]:
+        """
+        Returns the last number of rows reported in a log file, or None if there isn't a report.
+
+        :param log_path: The filepath to the log file.
+        """
+
+        num_rows = LogReader.get_all_num_rows(log_path)
+        return num_rows[-1] if len(num_rows) > 0 else None
+
+    @staticmethod
+    def get_all_num_rows(log_path: str) -> List[int]:
+        """
+        Returns every number of rows reported in a log file, in order.
+
+        :param log_path: The filepath to the log file.
+        """
+
+        return LogReader.get_all_num_rows_from_lines(LogReader.get_lines(log_path))
+
+    @staticmethod
+    def get_all_num_rows_from_lines(lines: List[str]) -> List[int]:
+        """
+        Returns every number of rows reported in lines of xelatex output, in order.
+
+        :param lines: The lines.
+        """
+
+        num_rows = []
+        for line in lines:
+            n = LogReader.get_num_rows_from_line(line)
+            if n is not None:
+                num_rows.append(n)
+        return num_rows
+
+    @staticmethod
+    def get_word_rows(lines: List[str]) -> Dict[int, int]:
+        """
+        Returns the row of each marked word (see `LogReader.DEFINE_MARK`), starting at 1.
+        Words on the same page with the same baseline are on the same row.
+
+        :param lines: Lines of xelatex output.
+        :return: A dictionary: Key = The index of the word. Value = The row.
+        """
+
+        positions: Dict[int, tuple] = dict()
+        for line in lines:
+            if not line.startswith(LogReader.WORD):
+                continue
+            values = line[len(LogReader.WORD):].strip().split(",")
+            if len(values) != 3 or not all([v.lstrip("-").isdigit() for v in values]):
+                continue
+            # Pages go down; y positions go up.
+            positions[int(values[0])] = (int(values[1]), -int(values[2]))
+
+        # Number the distinct baselines from the top of the first page.
+        rows = {position: i + 1 for i, position in enumerate(sorted(set(positions.values())))}
+        return {word: rows[positions[word]] for word in positions}
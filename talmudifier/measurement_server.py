@@ -0,0 +1,238 @@
+from subprocess import Popen, PIPE, DEVNULL
+from pathlib import Path
+from platform import system
+from queue import Queue, Empty
+from time import monotonic
+from typing import List, Optional
+from collections import deque
+from threading import Lock, Thread
+from multiprocessing import util
+import atexit
+import io
+from talmudifier.pdf_writer import PDFWriter
+from talmudifier.log_reader import LogReader
+from talmudifier.scratch import Scratch
+from talmudifier.instrumentation import Instrumentation
+from talmudifier.typeset_error import TypesetError
+
+
+class MeasurementServer:
+    """
+    A long-lived xelatex (or other TeX engine, see `Typesetter`) process that measures the number of rows of
+    paracol blocks. The preamble and fonts are loaded once. Each request is sent to the process's stdin as a single
+    line of TeX; the engine typesets it and writes the number of rows back to stdout.
+
+    The process is supervised like `PDFWriter`'s compiles: it has the same resource limits, and if it doesn't answer
+    within `MeasurementServer.timeout` seconds, it is killed and `TypesetError` is raised.
+    The next request starts a new process.
+    """
+
+    # The prefix of the line that xelatex writes to stdout when it is ready to read requests.
+    READY = "TALMUDIFIER_READY"
+    # The prefix of the line that xelatex writes to stdout after it ships out a request.
+    DONE = "TALMUDIFIER_DONE"
+    # Read a line from stdin (without a prompt), execute it, and repeat until told to stop.
+    LOOP = r"\newif\iftalmudifierrunning\talmudifierrunningtrue" + "\n" + \
+           r"\def\talmudifierstop{\global\talmudifierrunningfalse}" + "\n" + \
+           r"\def\talmudifierread{{\endlinechar=-1 \global\read-1 to\talmudifierrequest}}" + "\n" + \
+           r"\typeout{" + READY + "}\n" + \
+           r"\loop\talmudifierread\talmudifierrequest\iftalmudifierrunning\repeat" + "\n"
+    # The maximum number of seconds to wait for the process to start or to answer a request. If None, there is no limit.
+    timeout: Optional[float] = 120
+
+    def __init__(self, writer: PDFWriter, jobname="measurement_server", max_requests=1000):
+        """
+        :param writer: The PDF writer. The server uses the writer's preamble.
+        :param jobname: The prefix of the xelatex job name. Each process gets a unique job in the scratch directory.
+        :param max_requests: Restart the process after this many requests, so that the output file doesn't grow forever.
+        """
+
+        self.preamble = writer.preamble
+        self.typesetter = writer.typesetter
+        self.jobname_prefix = jobname
+        self.jobname = ""
+        self.directory = ""
+        self.max_requests = max_requests
+        self.num_requests = 0
+        self.process: Optional[Popen] = None
+        # Lines of the process's stdout. They are read in a thread so that reading can time out.
+        self._lines: Optional[Queue] = None
+        self._reader: Optional[Thread] = None
+        self._registered = False
+        # Requests can come from more than one thread (see `RowMaker.measure_blocks_async()`).
+        self._lock = Lock()
+
+    def start(self) -> None:
+        """
+        Start the xelatex process and wait until it has loaded the preamble.
+        """
+
+        if self.process is not None:
+            return
+
+        # Write the driver file.
+        self.directory = str(Scratch.get_directory())
+        self.jobname = Scratch.get_jobname(self.jobname_prefix)
+        driver_path = Path(self.directory).joinpath(self.jobname + ".tex")
+        with io.open(str(driver_path), "wt", encoding="utf-8") as f:
+            f.write(self.preamble + MeasurementServer.LOOP + PDFWriter.END_DOCUMENT + "\n")
+
+        command = self.typesetter.get_server_command(str(driver_path.resolve()), self.jobname, self.directory)
+        # Start a new session so that the engine can be killed with any process that it starts.
+        self.process = Popen(PDFWriter.get_limited_command(command), stdin=PIPE, stdout=PIPE, stderr=DEVNULL,
+                             universal_newlines=True, encoding="utf-8", errors="replace", bufsize=1,
+                             start_new_session=system() != "Windows")
+        self._lines = Queue()
+        self._reader = Thread(target=MeasurementServer._read_lines, args=(self.process, self._lines), daemon=True)
+        self._reader.start()
+        self.num_requests = 0
+        if not self._registered:
+            atexit.register(self.stop)
+            # Pool workers don't call `atexit` functions. Stop before the scratch directory is removed.
+            util.Finalize(self, self.stop, exitpriority=10)
+            self._registered = True
+
+        self._read_until(MeasurementServer.READY)
+
+    def stop(self) -> None:
+        """
+        Tell the xelatex process to finish the document, wait for it to exit, and delete its files.
+        """
+
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.write("\\talmudifierstop\n")
+            self.process.stdin.flush()
+            self.process.stdin.close()
+            self.process.wait(timeout=30)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._close()
+
+    def get_num_rows(self, tex: str) -> int:
+        """
+        Returns the number of rows reported by a paracol block.
+
+        :param tex: A complete paracol block. The measured text must end with the typesetter's `report_rows`.
+        """
+
+        num_rows = LogReader.get_all_num_rows_from_lines(self.get_output(tex))
+        assert len(num_rows) > 0, f"The block didn't report its number of rows:\n\n{tex}"
+        return num_rows[-1]
+
+    def get_output(self, tex: str) -> List[str]:
+        """
+        Typeset a paracol block, ship out the page, and return everything that xelatex wrote to stdout.
+
+        :param tex: A complete paracol block.
+        """
+
+        # Each request must be one line. A line with unbalanced braces would make xelatex wait for more input.
+        tex = tex.replace("\n", " ")
+        assert tex.count("{") == tex.count("}"), f"Unbalanced curly braces!\n\n{tex}"
+
+        with self._lock:
+            if self.process is not None and self.num_requests >= self.max_requests:
+                self.stop()
+            self.start()
+
+            with Instrumentation.span(self.typesetter.name + "_server", "compile", tex_size=len(tex)):
+                # Typeset the block and ship out the page so that xelatex doesn't hold onto it.
+                try:
+                    self.process.stdin.write(tex + r"\clearpage\typeout{" + MeasurementServer.DONE + "}\n")
+                    self.process.stdin.flush()
+                # If the process exited, `self._read_until()` raises an error that says why.
+                except OSError:
+                    pass
+                self.num_requests += 1
+
+                lines = []
+                self._read_until(MeasurementServer.DONE, lines)
+            return lines
+
+    def _read_until(self, prefix: str, lines: Optional[List[str]] = None) -> str:
+        """
+        Read lines from the xelatex process's stdout until a line starts with the prefix.
+        If the process exits or doesn't write the line in time, stop it and raise a `TypesetError`.
+
+        :param prefix: The prefix.
+        :param lines: If not None, append every line before the prefix to this list.
+        :return: The line.
+        """
+
+        tail = deque(maxlen=20)
+        deadline = monotonic() + MeasurementServer.timeout if MeasurementServer.timeout is not None else None
+        while True:
+            try:
+                line = self._lines.get(timeout=max(deadline - monotonic(), 0) if deadline is not None else None)
+            except Empty:
+                self._close()
+                raise TypesetError(self.typesetter.name, self._get_driver_path(), TypesetError.TIMEOUT, None, 1,
+                                   LogReader.get_error(list(tail)))
+            # The process ended before writing the line.
+            if line is None:
+                returncode = self.process.wait()
+                self._close()
+                raise TypesetError(self.typesetter.name, self._get_driver_path(),
+                                   TypesetError.KILLED if returncode < 0 else TypesetError.ERROR, returncode, 1,
+                                   LogReader.get_error(list(tail)))
+            # Error messages can quote the request, so only accept lines that start with the prefix.
+            if line.startswith(prefix):
+                return line
+            tail.append(line)
+            if lines is not None:
+                lines.append(line)
+
+    def _close(self) -> None:
+        """
+        Kill the process if it is still running, and delete its files.
+        """
+
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            PDFWriter._kill(self.process)
+            self.process.wait()
+        # The reader stops at the end of stdout.
+        self._reader.join(timeout=5)
+        for stream in [self.process.stdin, self.process.stdout]:
+            try:
+                stream.close()
+            except OSError:
+                pass
+        self.process = None
+        self._lines = None
+        self._reader = None
+        Scratch.remove(self.directory, self.jobname)
+
+    def _get_driver_path(self) -> str:
+        """
+        Returns the path to the driver .tex file.
+        """
+
+        return str(Path(self.directory).joinpath(self.jobname + ".tex"))
+
+    @staticmethod
+    def _read_lines(process: Popen, lines: Queue) -> None:
+        """
+        Read every line of a process's stdout into a queue, and then None.
+
+        :param process: The process.
+        :param lines: The queue.
+        """
+
+        try:
+            for line in iter(process.stdout.readline, ""):
+                lines.put(line)
+        except (OSError, ValueError):
+            pass
+        lines.put(None)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
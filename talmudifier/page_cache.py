@@ -0,0 +1,345 @@
+from collections import OrderedDict
+from hashlib import sha256
+from json import dumps
+from os import getpid, replace, utime
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Dict, List, Optional, Tuple
+import io
+import re
+import sqlite3
+from talmudifier.instrumentation import Instrumentation
+
+
+class PageCache:
+    """
+    A cache of whole pages. The key is a hash of everything that affects the layout of a page:
+    the recipe, the preamble (which includes header.txt), the TeX engine, the contents of the font files,
+    the text of each column, and the chapter title.
+    If the recipe or a font file changes, the page has a new key, and old pages are eventually evicted.
+
+    Each entry is the LaTeX body of the page and, optionally, its PDF.
+    The cache is stored on disk, either as files in a directory or in a SQLite database,
+    and can be shared across runs and processes. When the cache is larger than its maximum size,
+    the least-recently-used pages are evicted.
+
+    ```python
+    from talmudifier.compiled_recipe import CompiledRecipe
+    from talmudifier.page_cache import PageCache
+
+    recipe = CompiledRecipe("default.json", page_cache=PageCache("Output/page_cache.db"))
+    tex = recipe.get_tex(left, center, right)
+    ```
+    """
+
+    # The backends.
+    DIRECTORY = "directory"
+    SQLITE = "sqlite"
+    # Font directories are declared in the preamble like this: `\newfontfamily\leftfont[Path=fonts/garamond/, ...]`
+    _FONT_PATH = re.compile(r"Path=([^,\]]+)")
+    # Key = The path to a font file. Value = (The file's size, its modification time, the hash of its contents).
+    _FONT_HASHES: Dict[str, Tuple[int, int, str]] = dict()
+    # Read the cache directory again after this many writes, to find pages that were added by other processes.
+    SCAN_INTERVAL = 100
+
+    def __init__(self, path: str, backend: Optional[str] = None, max_bytes=1000000000, store_pdfs=True):
+        """
+        :param path: The path to the cache directory or the SQLite database.
+        :param backend: "directory" or "sqlite". If None, use SQLite if the path ends with .db or .sqlite.
+        :param max_bytes: The maximum size of the cache in bytes.
+        :param store_pdfs: If true, store PDFs as well as LaTeX.
+        """
+
+        if backend is None:
+            backend = PageCache.SQLITE if Path(path).suffix in [".db", ".sqlite"] else PageCache.DIRECTORY
+        assert backend in [PageCache.DIRECTORY, PageCache.SQLITE], f"Invalid backend: {backend}"
+        self.path = str(Path(path).resolve())
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.store_pdfs = store_pdfs
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = Lock()
+        # The directory backend's pages, from least to most recently used. Key = A cache key. Value = Its size in bytes.
+        self._sizes: OrderedDict = OrderedDict()
+        self._size = 0
+        self._num_writes = 0
+
+        if backend == PageCache.SQLITE:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._db: Optional[sqlite3.Connection] = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, tex TEXT NOT NULL, pdf BLOB, "
+                             "size INTEGER NOT NULL, accessed REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed)")
+            self._db.commit()
+        else:
+            Path(self.path).mkdir(parents=True, exist_ok=True)
+            self._db = None
+            self._scan()
+
+    @staticmethod
+    def get_fingerprint(recipe: dict, preamble: str, engine: str) -> str:
+        """
+        Returns a hash of a compiled recipe: the recipe, the preamble, the TeX engine, and the font files.
+        Font files are only read again if their size or modification time changed.
+
+        :param recipe: The recipe.
+        :param preamble: The preamble.
+        :param engine: The name of the TeX engine.
+        """
+
+        h = sha256()
+        for part in [dumps(recipe, sort_keys=True), preamble, engine]:
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        for font_path in PageCache._get_font_paths(preamble):
+            h.update(font_path.encode("utf-8"))
+            h.update(PageCache._get_font_hash(font_path).encode("utf-8"))
+        return h.hexdigest()
+
+    @staticmethod
+    def get_key(fingerprint: str, left: str, center: str, right: str, chapter="") -> str:
+        """
+        Returns the cache key of a page.
+
+        :param fingerprint: The fingerprint of the compiled recipe (see `PageCache.get_fingerprint()`).
+        :param left: The markdown text of the left column.
+        :param center: The markdown text of the center column.
+        :param right: The markdown text of the right column.
+        :param chapter: The chapter title, if any.
+        """
+
+        h = sha256()
+        for part in [fingerprint, left, center, right, chapter]:
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[str, Optional[bytes]]]:
+        """
+        Returns the cached LaTeX body of a page and its PDF (or None), or None if the page isn't cached.
+
+        :param key: The cache key (see `PageCache.get_key()`).
+        """
+
+        with self._lock:
+            if self._db is not None:
+                row = self._db.execute("SELECT tex, pdf FROM pages WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE pages SET accessed = ? WHERE key = ?", (time(), key))
+                    self._db.commit()
+                    row = (row[0], bytes(row[1]) if row[1] is not None else None)
+            else:
+                row = self._read_files(key)
+                if row is None:
+                    self._remove_entry(key)
+                elif key in self._sizes:
+                    self._sizes.move_to_end(key)
+            if row is None:
+                self.misses += 1
+                Instrumentation.count("page_cache_misses")
+            else:
+                self.hits += 1
+                Instrumentation.count("page_cache_hits")
+            return row
+
+    def put(self, key: str, tex: str, pdf: Optional[bytes] = None) -> None:
+        """
+        Cache a page, and evict the least-recently-used pages if the cache is too large.
+
+        :param key: The cache key (see `PageCache.get_key()`).
+        :param tex: The LaTeX body of the page.
+        :param pdf: The PDF of the page, if any. If `self.store_pdfs` is false, this is ignored.
+        """
+
+        if not self.store_pdfs:
+            pdf = None
+        with self._lock:
+            if self._db is not None:
+                size = len(tex.encode("utf-8")) + (len(pdf) if pdf is not None else 0)
+                self._db.execute("INSERT OR REPLACE INTO pages (key, tex, pdf, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                                 (key, tex, pdf, size, time()))
+                self._db.commit()
+            else:
+                data = tex.encode("utf-8")
+                self._write_file(key + ".tex", data)
+                size = len(data)
+                if pdf is not None:
+                    self._write_file(key + ".pdf", pdf)
+                    size += len(pdf)
+                else:
+                    size += self._get_file_size(key + ".pdf")
+                self._remove_entry(key)
+                self._sizes[key] = size
+                self._size += size
+                self._num_writes += 1
+                if self._num_writes % PageCache.SCAN_INTERVAL == 0:
+                    self._scan()
+            self._evict()
+
+    def get_stats(self) -> dict:
+        """
+        Returns the number of hits, misses, and evictions as a dictionary.
+        """
+
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions}
+
+    def close(self) -> None:
+        """
+        Close the database connection, if any.
+        """
+
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _read_files(self, key: str) -> Optional[Tuple[str, Optional[bytes]]]:
+        """
+        Returns the cached LaTeX body of a page and its PDF (or None) from the cache directory,
+        or None if the page isn't cached. Update the modification times of the files (see `self._evict()`).
+
+        :param key: The cache key.
+        """
+
+        tex_path = Path(self.path).joinpath(key + ".tex")
+        pdf_path = Path(self.path).joinpath(key + ".pdf")
+        try:
+            with io.open(str(tex_path), "rt", encoding="utf-8") as f:
+                tex = f.read()
+            utime(str(tex_path))
+        except OSError:
+            return None
+        try:
+            pdf = pdf_path.read_bytes()
+            utime(str(pdf_path))
+        except OSError:
+            pdf = None
+        return tex, pdf
+
+    def _write_file(self, filename: str, data: bytes) -> None:
+        """
+        Write a file to the cache directory. The file is replaced all at once, so other processes never read part of it.
+
+        :param filename: The filename.
+        :param data: The contents of the file.
+        """
+
+        path = Path(self.path).joinpath(filename)
+        temp = Path(self.path).joinpath(f"{filename}.{getpid()}.tmp")
+        temp.write_bytes(data)
+        replace(str(temp), str(path))
+
+    def _evict(self) -> None:
+        """
+        Evict the least-recently-used pages until the cache isn't larger than `self.max_bytes`.
+        The size of the cache directory is tracked as pages are added (see `self._scan()`), so it isn't read again.
+        The caller must hold the lock.
+        """
+
+        if self._db is not None:
+            size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+            if size <= self.max_bytes:
+                return
+            keys: List[str] = []
+            for key, page_size in self._db.execute("SELECT key, size FROM pages ORDER BY accessed"):
+                if size <= self.max_bytes:
+                    break
+                keys.append(key)
+                size -= page_size
+            self._db.executemany("DELETE FROM pages WHERE key = ?", [(key,) for key in keys])
+            self._db.commit()
+            self.evictions += len(keys)
+            return
+
+        while self._size > self.max_bytes and len(self._sizes) > 0:
+            key, page_size = self._sizes.popitem(last=False)
+            self._size -= page_size
+            for extension in ["tex", "pdf"]:
+                try:
+                    Path(self.path).joinpath(key + "." + extension).unlink()
+                except OSError:
+                    pass
+            self.evictions += 1
+
+    def _scan(self) -> None:
+        """
+        Read the size and modification time of every file in the cache directory.
+        Other processes can share the directory, so this is done once in a while (see `PageCache.SCAN_INTERVAL`).
+        In between, the sizes are updated as pages are added and removed. The caller must hold the lock,
+        or be the constructor.
+        """
+
+        # Key = A cache key. Value = (The last time that the page was used, its size).
+        pages: Dict[str, Tuple[float, int]] = dict()
+        for extension in ["tex", "pdf"]:
+            for path in Path(self.path).glob("*." + extension):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                accessed, page_size = pages.get(path.stem, (0.0, 0))
+                pages[path.stem] = (max(accessed, stat.st_mtime), page_size + stat.st_size)
+        self._sizes.clear()
+        for key in sorted(pages, key=lambda k: pages[k][0]):
+            self._sizes[key] = pages[key][1]
+        self._size = sum(self._sizes.values())
+
+    def _remove_entry(self, key: str) -> None:
+        """
+        Stop tracking the size of a page in the cache directory. The caller must hold the lock.
+
+        :param key: The cache key.
+        """
+
+        if key in self._sizes:
+            self._size -= self._sizes.pop(key)
+
+    def _get_file_size(self, filename: str) -> int:
+        """
+        Returns the size of a file in the cache directory, or 0 if it doesn't exist.
+
+        :param filename: The filename.
+        """
+
+        try:
+            return Path(self.path).joinpath(filename).stat().st_size
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _get_font_paths(preamble: str) -> List[str]:
+        """
+        Returns the paths to every file in every font directory that is declared in the preamble.
+
+        :param preamble: The preamble.
+        """
+
+        font_paths = []
+        for directory in sorted(set([d.strip() for d in PageCache._FONT_PATH.findall(preamble)])):
+            d = Path(directory)
+            if d.is_dir():
+                font_paths.extend(sorted([str(f.resolve()) for f in d.iterdir() if f.is_file()]))
+        return font_paths
+
+    @staticmethod
+    def _get_font_hash(path: str) -> str:
+        """
+        Returns the hash of a font file's contents. The hash is only calculated again if the file changed.
+
+        :param path: The path to the font file.
+        """
+
+        stat = Path(path).stat()
+        if path in PageCache._FONT_HASHES:
+            size, modified, font_hash = PageCache._FONT_HASHES[path]
+            if size == stat.st_size and modified == stat.st_mtime_ns:
+                return font_hash
+        font_hash = sha256(Path(path).read_bytes()).hexdigest()
+        PageCache._FONT_HASHES[path] = (stat.st_size, stat.st_mtime_ns, font_hash)
+        return font_hash
@@ -38,6 +38,27 @@ class Paracol:
         else:
             raise Exception("Tried defining a paracol environment for 0 columns.")
 
+    @staticmethod
+    def get_width(left: bool, center: bool, right: bool, target: str) -> str:
+        """
+        Returns the name of the width of the target column: "one_third", "half", "two_thirds",
+        or an empty string if the target is the only column.
+        These are the widths in a recipe's `character_counts`.
+
+        :param left: If true, a left column exists.
+        :param center: If true, a center column exists.
+        :param right: If true, a right column exists.
+        :param target: The name of the target column: left, center, or right.
+        """
+
+        if len([c for c in [left, center, right] if c]) <= 1:
+            return ""
+        if left and right and not center:
+            return "half"
+        if target == "center" and not (left and right):
+            return "two_thirds"
+        return "one_third"
+
     @staticmethod
     def get_switch_from_left(left: bool, center: bool, right: bool, target: str) -> str:
         """
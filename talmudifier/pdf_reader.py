@@ -5,6 +5,7 @@ from pdfminer.pdfinterp import PDFResourceManager
 from pdfminer.pdfpage import PDFPage
 from pdfminer.layout import LAParams
 import io
+from talmudifier.instrumentation import Instrumentation
 
 
 class PDFReader:
@@ -49,7 +50,8 @@ class PDFReader:
         :param pdf_path: The filepath to the PDF file.
         """
 
-        text = PDFReader.extract_text_from_pdf(pdf_path)
+        with Instrumentation.span("pdf_parse", "parse", path=pdf_path):
+            text = PDFReader.extract_text_from_pdf(pdf_path)
 
         # Get the line numbers.
         lines = text.split("\n")
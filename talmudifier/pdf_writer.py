@@ -1,63 +1,274 @@
-from subprocess import call
+from subprocess import Popen, DEVNULL, TimeoutExpired
 from pathlib import Path
 from platform import system
-from os import devnull
+from os import cpu_count
+from signal import SIGKILL
+import os
+from asyncio import create_subprocess_exec, get_event_loop, subprocess, Semaphore, wait_for, TimeoutError
+from typing import List, Optional, Tuple
+from weakref import WeakKeyDictionary
 from talmudifier.util import output_directory
+from talmudifier.instrumentation import Instrumentation
+from talmudifier.typesetter import Typesetter, XeLaTeX
+from talmudifier.tex_file import TexFile
+from talmudifier.log_reader import LogReader
+from talmudifier.typeset_error import TypesetError
 
 
 class PDFWriter:
     """
-    Given LaTeX text, write a PDF.
+    Given LaTeX text, write a PDF with a TeX engine (see `Typesetter`).
+
+    The engine runs in non-stop mode and halts at the first error, so it never waits for input.
+    Each compile is supervised: it is killed if it takes longer than `PDFWriter.timeout` seconds,
+    it can be limited to `PDFWriter.max_memory` bytes and `PDFWriter.max_cpu_time` seconds (Linux and OS X),
+    and it is retried up to `PDFWriter.max_retries` times if it timed out.
+    If it fails, `TypesetError` is raised with the relevant part of the log.
     """
 
     END_DOCUMENT = r"\end{sloppypar}\end{document}"
+    # The maximum number of TeX processes that `self.write_async()` runs at the same time.
+    max_compiles = cpu_count() or 1
+    # The maximum number of seconds that a compile can take. If None, there is no limit.
+    timeout: Optional[float] = 600
+    # The number of times to try again if a compile timed out. A compile that was killed by a limit isn't retried,
+    # because it would be killed again.
+    max_retries = 1
+    # The maximum memory of a TeX process in bytes. If None, there is no limit.
+    max_memory: Optional[int] = None
+    # The maximum CPU time of a TeX process in seconds. If None, there is no limit.
+    max_cpu_time: Optional[int] = None
+    # One semaphore per event loop.
+    _semaphores: WeakKeyDictionary = WeakKeyDictionary()
 
-    def __init__(self, preamble: str):
+    def __init__(self, preamble: str, typesetter: Optional[Typesetter] = None):
         """
         :param preamble: The preamble text.
+        :param typesetter: The TeX engine. If None, use xelatex.
         """
 
+        self.typesetter = typesetter if typesetter is not None else XeLaTeX()
+
         # Begin the document.
-        self.preamble = preamble + r"\begin{document}\begin{sloppypar}" + "\n\n"
+        self.preamble = preamble + self.typesetter.definitions + r"\begin{document}\begin{sloppypar}" + "\n\n"
+
+    def write(self, text: str, filename: str, pdf=True, directory: str = output_directory) -> str:
+        """
+        Create a PDF from LaTeX text. The document is written to `filename.tex` in the output directory,
+        and the engine typesets that file.
+
+        :param text: The LaTeX text.
+        :param filename: The filename of the PDF.
+        :param pdf: If false, don't create a PDF; only create the .log file (and, with xelatex, the .xdv file).
+                    This is much faster.
+        :param directory: The output directory.
+        :return: The LaTeX text, including the preamble and the end command(s).
+        """
 
-    def write(self, text: str, filename: str) -> str:
+        path = self._write_tex_file(text, filename, directory)
+        self.write_file(path, pdf)
+        return self.preamble + text + PDFWriter.END_DOCUMENT
+
+    async def write_async(self, text: str, filename: str, pdf=True, directory: str = output_directory) -> str:
         """
-        Create a PDF from LaTeX text.
+        Create a PDF from LaTeX text in an asynchronous subprocess (see `self.write()`).
+        At most `PDFWriter.max_compiles` TeX processes run at the same time in each event loop.
 
         :param text: The LaTeX text.
         :param filename: The filename of the PDF.
+        :param pdf: If false, don't create a PDF; only create the .log file (and, with xelatex, the .xdv file).
+                    This is much faster.
+        :param directory: The output directory.
         :return: The LaTeX text, including the preamble and the end command(s).
         """
 
-        # Combine the preamble, the new text, and the end command(s).
-        doc_raw = self.preamble + text + PDFWriter.END_DOCUMENT
-
-        # Replace line breaks with spaces.
-        doc = doc_raw.replace("\n", " ")
-
-        # Verify that all curly braces are balanced.
-        num_start = len([c for c in doc if c == "{"])
-        num_end = len([c for c in doc if c == "}"])
-        assert num_start == num_end, f"Unbalanced curly braces!\n\n{doc_raw}"
-
-        p = system()
-        # Generate the PDF.
-        if p == "Linux" or p == "Darwin":
-            call(
-                ["xelatex",
-                 "-output-directory", str(Path(output_directory).resolve()),
-                 "-jobname", filename, doc],
-                stdout=open(devnull, "wb"))
-        elif p == "Windows":
-            call(['xelatex.exe',
-                  '-output-directory',
-                  str(Path(output_directory).resolve()),
-                  '-job-name=' + filename,
-                  doc],
-                 stdout=open(devnull, "wb"))
+        path = self._write_tex_file(text, filename, directory)
+        await self.write_file_async(path, pdf)
+        return self.preamble + text + PDFWriter.END_DOCUMENT
+
+    def get_tex_file(self, path: str) -> TexFile:
+        """
+        Returns a new .tex file that starts with my preamble (see `TexFile`). Write the body to it, close it,
+        and then typeset it with `self.write_file()`.
+
+        :param path: The path to the .tex file.
+        """
+
+        return TexFile(path, self.preamble, PDFWriter.END_DOCUMENT)
+
+    def write_file(self, path: str, pdf=True) -> None:
+        """
+        Typeset a .tex file (see `self.get_tex_file()`). The output files have the same name and are in the same
+        directory as the .tex file. Raises a `TypesetError` if the engine fails.
+
+        :param path: The path to the .tex file.
+        :param pdf: If false, don't create a PDF; only create the .log file (and, with xelatex, the .xdv file).
+        """
+
+        path, filename, directory = PDFWriter._split_path(path)
+        command = PDFWriter.get_limited_command(self.typesetter.get_command(path, filename, pdf, directory))
+        attempt = 0
+        while True:
+            attempt += 1
+            with Instrumentation.span(self.typesetter.name, "compile", job=filename, pdf=pdf, attempt=attempt) as span:
+                # Start a new session so that the engine and any process that it starts (e.g. xdvipdfmx) can be killed.
+                process = Popen(command, stdout=DEVNULL, start_new_session=system() != "Windows")
+                try:
+                    returncode = process.wait(timeout=PDFWriter.timeout)
+                    timed_out = False
+                except TimeoutExpired:
+                    returncode = None
+                    timed_out = True
+                finally:
+                    if process.returncode is None:
+                        PDFWriter._kill(process)
+                        process.wait()
+                span.set(returncode=returncode)
+                # Don't read the size of the file unless something is recording.
+                if Instrumentation.current is not None:
+                    span.set(tex_size=Path(path).stat().st_size)
+            error = self._get_error(path, filename, directory, pdf, returncode, timed_out, attempt)
+            if error is None:
+                return
+            Instrumentation.count(f"{self.typesetter.name}_{error.reason}")
+            if not error.can_retry() or attempt > PDFWriter.max_retries:
+                raise error
+
+    async def write_file_async(self, path: str, pdf=True) -> None:
+        """
+        Typeset a .tex file in an asynchronous subprocess (see `self.write_file()`).
+
+        :param path: The path to the .tex file.
+        :param pdf: If false, don't create a PDF; only create the .log file (and, with xelatex, the .xdv file).
+        """
+
+        path, filename, directory = PDFWriter._split_path(path)
+        command = PDFWriter.get_limited_command(self.typesetter.get_command(path, filename, pdf, directory))
+        attempt = 0
+        while True:
+            attempt += 1
+            async with PDFWriter._get_semaphore():
+                with Instrumentation.span(self.typesetter.name, "compile", job=filename, pdf=pdf,
+                                          attempt=attempt) as span:
+                    process = await create_subprocess_exec(*command, stdout=subprocess.DEVNULL,
+                                                           start_new_session=system() != "Windows")
+                    try:
+                        returncode = await wait_for(process.wait(), PDFWriter.timeout)
+                        timed_out = False
+                    except TimeoutError:
+                        returncode = None
+                        timed_out = True
+                    finally:
+                        if process.returncode is None:
+                            PDFWriter._kill(process)
+                            await process.wait()
+                    span.set(returncode=returncode)
+                    if Instrumentation.current is not None:
+                        span.set(tex_size=Path(path).stat().st_size)
+            error = self._get_error(path, filename, directory, pdf, returncode, timed_out, attempt)
+            if error is None:
+                return
+            Instrumentation.count(f"{self.typesetter.name}_{error.reason}")
+            if not error.can_retry() or attempt > PDFWriter.max_retries:
+                raise error
+
+    def _write_tex_file(self, text: str, filename: str, directory: str) -> str:
+        """
+        Write a document to a .tex file. Returns the path.
+
+        :param text: The LaTeX text.
+        :param filename: The filename without an extension.
+        :param directory: The output directory.
+        """
+
+        with self.get_tex_file(str(Path(directory).joinpath(filename + ".tex"))) as f:
+            f.write(text)
+        return f.path
+
+    @staticmethod
+    def _split_path(path: str) -> Tuple[str, str, str]:
+        """
+        Returns the absolute path to a .tex file, the filename without an extension, and the directory.
+
+        :param path: The path to the .tex file.
+        """
+
+        p = Path(path).resolve()
+        return str(p), p.stem, str(p.parent)
+
+    def _get_error(self, path: str, filename: str, directory: str, pdf: bool, returncode: Optional[int],
+                   timed_out: bool, attempt: int) -> Optional[TypesetError]:
+        """
+        Returns an error if the engine failed, or None if it created the output file.
+
+        :param path: The path to the .tex file.
+        :param filename: The filename of the output files.
+        :param directory: The output directory.
+        :param pdf: If false, a PDF wasn't created.
+        :param returncode: The engine's exit code, or None if it timed out.
+        :param timed_out: If true, the engine timed out.
+        :param attempt: The number of attempts so far.
+        """
+
+        extension = self.typesetter.get_output_extension(pdf)
+        if timed_out:
+            reason = TypesetError.TIMEOUT
+        elif returncode < 0:
+            reason = TypesetError.KILLED
+        elif returncode > 0:
+            reason = TypesetError.ERROR
+        elif not Path(directory).joinpath(filename + extension).exists():
+            reason = TypesetError.NO_OUTPUT
         else:
-            raise Exception(f"Platform not supported: {p}")
+            return None
+        log = LogReader.get_error(LogReader.get_lines(str(Path(directory).joinpath(filename + ".log"))))
+        return TypesetError(self.typesetter.name, path, reason, returncode, attempt, log)
+
+    @staticmethod
+    def _kill(process) -> None:
+        """
+        Kill a TeX process and every process that it started.
 
-        assert Path(output_directory).joinpath(filename + ".pdf").exists(), f"Failed to create: {filename}"
+        :param process: The process (`subprocess.Popen` or `asyncio.subprocess.Process`).
+        """
+
+        try:
+            if system() == "Windows":
+                process.kill()
+            else:
+                os.killpg(process.pid, SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    @staticmethod
+    def get_limited_command(command: List[str]) -> List[str]:
+        """
+        Returns a command that runs a TeX process with at most `PDFWriter.max_memory` bytes
+        and `PDFWriter.max_cpu_time` seconds. A shell sets the limits (`ulimit`) and then replaces itself
+        with the TeX process, so this process never runs any code between fork and exec,
+        which isn't safe if it has other threads. If there are no limits, or if resources can't be limited
+        on this platform, returns the command as-is.
+
+        :param command: The command.
+        """
+
+        if (PDFWriter.max_memory is None and PDFWriter.max_cpu_time is None) or system() == "Windows":
+            return command
+        limits = []
+        if PDFWriter.max_memory is not None:
+            # ulimit -v is in kilobytes.
+            limits.append(f"ulimit -v {max(int(PDFWriter.max_memory) // 1024, 1)}")
+        if PDFWriter.max_cpu_time is not None:
+            limits.append(f"ulimit -t {max(int(PDFWriter.max_cpu_time), 1)}")
+        return ["/bin/sh", "-c", " && ".join(limits) + ' && exec "$@"', "sh"] + command
+
+    @staticmethod
+    def _get_semaphore() -> Semaphore:
+        """
+        Returns the semaphore that limits the number of TeX processes in the current event loop.
+        """
 
-        return doc_raw
+        loop = get_event_loop()
+        if loop not in PDFWriter._semaphores:
+            PDFWriter._semaphores[loop] = Semaphore(PDFWriter.max_compiles)
+        return PDFWriter._semaphores[loop]
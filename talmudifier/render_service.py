@@ -0,0 +1,547 @@
+from collections import deque, OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from json import dumps, loads
+from multiprocessing import Pool
+from pathlib import Path
+from socketserver import ThreadingMixIn
+from threading import Event, Lock, Thread
+from time import perf_counter
+from typing import Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+from uuid import uuid4
+import sys
+from hyphen import Hyphenator
+from talmudifier.book import Book, Page
+from talmudifier.scratch import Scratch
+from talmudifier.typeset_error import TypesetError
+from talmudifier.util import output_directory
+from talmudifier.word import Word
+
+
+class RenderJob:
+    """
+    A page that was submitted to a `RenderService`.
+    """
+
+    QUEUED = "queued"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, page: Page, recipe_filename: str, pdf: bool):
+        """
+        :param page: The page.
+        :param recipe_filename: The filename of the recipe.
+        :param pdf: If true, create a PDF.
+        """
+
+        self.id = uuid4().hex
+        self.page = page
+        self.recipe_filename = recipe_filename
+        self.pdf = pdf
+        self.status = RenderJob.QUEUED
+        # The LaTeX body of the page.
+        self.tex = ""
+        # The path to the PDF, if any.
+        self.pdf_path = ""
+        # If the job failed, a dictionary that describes the error.
+        self.error: Optional[dict] = None
+        self.submitted = perf_counter()
+        # The number of times that the job was sent to a worker pool. It is sent again if its pool is restarted.
+        self.attempts = 0
+        # If the job isn't done by this time (see `perf_counter()`), it fails. If None, there is no limit.
+        self.deadline: Optional[float] = None
+        # The time from submission to the result, and the time that a worker spent on the page, in seconds.
+        self.latency = 0.0
+        self.render_seconds = 0.0
+        self.done = Event()
+
+    def to_dict(self) -> dict:
+        """
+        Returns the status of the job as a JSON-serializable dictionary.
+        """
+
+        return {"id": self.id, "status": self.status, "recipe": self.recipe_filename, "pdf": self.pdf,
+                "attempts": self.attempts, "latency": self.latency, "render_seconds": self.render_seconds, "error": self.error}
+
+
+class RenderService:
+    """
+    A local HTTP service that lays out pages in pools of warm worker processes, one pool per recipe.
+    Each worker compiles its recipe once, loads the hyphenation dictionary, and typesets a warm-up page
+    (which fills the TeX font caches) before it accepts any jobs.
+
+    ```python
+    from talmudifier.render_service import RenderService
+
+    service = RenderService(recipes=["default.json"], jobs=4, port=8000)
+    service.start()
+    ```
+
+    Or: `python3 serve.py --jobs 4 --port 8000`
+
+    | Request | Description |
+    | --- | --- |
+    | `POST /jobs` | Submit a page: `{"left": "...", "center": "...", "right": "...", "chapter": "", "recipe": "default.json", "pdf": false}`. Returns `202` and the job ID. With `?wait=1`, returns the TeX (or PDF) when the page is done. If the queue is full, returns `503`. |
+    | `GET /jobs/<id>` | The status of a job. |
+    | `GET /jobs/<id>/tex` | The LaTeX body of a finished page. |
+    | `GET /jobs/<id>/pdf` | The PDF of a finished page. |
+    | `GET /metrics` | Queue depth, worker utilization, and latency percentiles. |
+    """
+
+    # The text of the warm-up page.
+    WARM_UP_TEXT = "The quick brown fox jumps over the lazy dog. " * 4
+    # When the service stops, wait this many seconds for the workers to finish their jobs before terminating them.
+    STOP_TIMEOUT = 30
+    # Check for jobs that have timed out at most this often, in seconds.
+    REAP_INTERVAL = 1
+
+    def __init__(self, recipes: Optional[List[str]] = None, jobs=1, max_queue=64, host="127.0.0.1", port=8000,
+                 directory: str = str(Path(output_directory).joinpath("service")), max_jobs=1000, max_latencies=1000,
+                 warm_up=True, job_timeout: Optional[float] = 3600, **kwargs):
+        """
+        :param recipes: The filenames of the recipes, located in recipes/. Each recipe has its own pool of workers.
+                        If None, use default.json.
+        :param jobs: The number of worker processes per recipe.
+        :param max_queue: The maximum number of jobs that are waiting or being laid out. More jobs are rejected.
+        :param host: The host address. By default, the service only accepts connections from this machine.
+        :param port: The port. If 0, use any free port (see `self.port` after `self.start()`).
+        :param directory: The directory of the .tex and PDF files.
+        :param max_jobs: The maximum number of finished jobs to remember. The oldest are forgotten first.
+        :param max_latencies: Latency percentiles are calculated from this many of the most recent jobs.
+        :param warm_up: If true, each worker typesets a warm-up page before it accepts any jobs.
+        :param job_timeout: If a job isn't done this many seconds after it was sent to a worker pool, it fails,
+                            and the pool is terminated and replaced, along with any worker that died or is stuck.
+                            The pool's other jobs are sent to the new pool. If None, there is no limit.
+        :param kwargs: Parameters for each recipe (see `Book`), e.g. `use_server=True`.
+        """
+
+        assert jobs > 0, f"Invalid number of jobs: {jobs}"
+        assert max_queue > 0, f"Invalid queue size: {max_queue}"
+        self.recipes = recipes if recipes is not None else ["default.json"]
+        self.jobs = jobs
+        self.max_queue = max_queue
+        self.host = host
+        self.port = port
+        self.directory = str(Path(directory).resolve())
+        self.max_jobs = max_jobs
+        self.warm_up = warm_up
+        self.job_timeout = job_timeout
+        self.recipe_args: Dict[str, tuple] = {r: Book([], recipe_filename=r, **kwargs).recipe_args
+                                              for r in self.recipes}
+
+        self._pools: Dict[str, Pool] = dict()
+        self._jobs: OrderedDict = OrderedDict()
+        self._pending: Dict[str, int] = {r: 0 for r in self.recipes}
+        self._latencies: Deque[float] = deque(maxlen=max_latencies)
+        self._render_seconds: Deque[float] = deque(maxlen=max_latencies)
+        self._counters = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+        self._busy_seconds = 0.0
+        self._t0 = perf_counter()
+        self._lock = Lock()
+        # Held while a job is sent to a pool or while a pool is replaced.
+        self._pool_lock = Lock()
+        self._server: Optional[HTTPServer] = None
+        self._thread: Optional[Thread] = None
+        self._reaper: Optional[Thread] = None
+        self._stopped = Event()
+
+    def start(self, block=False) -> None:
+        """
+        Start the worker pools and the HTTP server.
+
+        :param block: If true, serve until interrupted. If false, serve in a background thread.
+        """
+
+        Path(self.directory).mkdir(parents=True, exist_ok=True)
+        # Start the workers before the server's threads.
+        for recipe_filename in self.recipes:
+            if recipe_filename not in self._pools:
+                self._pools[recipe_filename] = self._get_pool(recipe_filename)
+        self._t0 = perf_counter()
+        if self.job_timeout is not None and self._reaper is None:
+            self._stopped.clear()
+            self._reaper = Thread(target=self._reap, daemon=True)
+            self._reaper.start()
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.service = self
+        self.port = self._server.server_address[1]
+        if block:
+            try:
+                self._server.serve_forever()
+            finally:
+                self.stop()
+        else:
+            self._thread = Thread(target=self._server.serve_forever, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the HTTP server and the worker pools.
+        """
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        # Stop reaping jobs before the pools stop, so that no pool is replaced.
+        if self._reaper is not None:
+            self._stopped.set()
+            self._reaper.join()
+            self._reaper = None
+        for pool in self._pools.values():
+            pool.close()
+        for pool in self._pools.values():
+            # Let the workers exit on their own so that they stop their servers and remove their scratch directories.
+            joiner = Thread(target=pool.join, daemon=True)
+            joiner.start()
+            joiner.join(RenderService.STOP_TIMEOUT)
+            if joiner.is_alive():
+                pool.terminate()
+                joiner.join()
+        self._pools.clear()
+        # Nothing will finish these jobs now.
+        with self._lock:
+            unfinished = [job for job in self._jobs.values() if not job.done.is_set()]
+        for job in unfinished:
+            self._finish(job, None, Exception("The service stopped."))
+
+    def submit(self, page: Page, recipe_filename: Optional[str] = None, pdf=False) -> Optional[RenderJob]:
+        """
+        Submit a page. Returns the job, or None if the queue is full.
+
+        :param page: The page.
+        :param recipe_filename: The filename of the recipe. If None, use the first recipe.
+        :param pdf: If true, create a PDF.
+        """
+
+        if recipe_filename is None:
+            recipe_filename = self.recipes[0]
+        assert recipe_filename in self._pools, f"Recipe not served: {recipe_filename}"
+        job = RenderJob(page, recipe_filename, pdf)
+        with self._lock:
+            if sum(self._pending.values()) >= self.max_queue:
+                self._counters["rejected"] += 1
+                return None
+            self._pending[recipe_filename] += 1
+            self._counters["submitted"] += 1
+            self._jobs[job.id] = job
+        self._apply(job)
+        return job
+
+    def wait(self, job: RenderJob) -> bool:
+        """
+        Wait for a job to finish. Returns False if the job is long past its deadline, which only happens if
+        the service stopped reaping jobs.
+
+        :param job: The job.
+        """
+
+        while not job.done.wait(RenderService.REAP_INTERVAL):
+            deadline = job.deadline
+            if deadline is not None and perf_counter() > deadline + RenderService.REAP_INTERVAL * 2:
+                return False
+        return True
+
+    def get_job(self, job_id: str) -> Optional[RenderJob]:
+        """
+        Returns a job, or None if there is no job with this ID.
+
+        :param job_id: The ID of the job.
+        """
+
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def get_metrics(self) -> dict:
+        """
+        Returns the number of jobs in the queue, worker utilization, and latency percentiles.
+        Utilization is the time that workers spent laying out pages divided by the workers' uptime.
+        """
+
+        with self._lock:
+            uptime = perf_counter() - self._t0
+            workers = self.jobs * len(self.recipes)
+            recipes = {r: {"pending": self._pending[r], "queue_depth": max(self._pending[r] - self.jobs, 0),
+                           "busy_workers": min(self._pending[r], self.jobs), "workers": self.jobs}
+                       for r in self.recipes}
+            return {"uptime": uptime,
+                    "pending": sum(self._pending.values()),
+                    "queue_depth": sum([r["queue_depth"] for r in recipes.values()]),
+                    "max_queue": self.max_queue,
+                    "workers": workers,
+                    "busy_workers": sum([r["busy_workers"] for r in recipes.values()]),
+                    "utilization": self._busy_seconds / (workers * uptime) if uptime > 0 else 0,
+                    "latency": RenderService._get_percentiles(self._latencies),
+                    "render_seconds": RenderService._get_percentiles(self._render_seconds),
+                    "recipes": recipes,
+                    **self._counters}
+
+    def _get_pool(self, recipe_filename: str) -> Pool:
+        """
+        Returns a new pool of workers for a recipe.
+
+        :param recipe_filename: The filename of the recipe.
+        """
+
+        return Pool(self.jobs, initializer=RenderService._initialize_worker,
+                    initargs=(self.recipe_args[recipe_filename], self.warm_up))
+
+    def _apply(self, job: RenderJob) -> None:
+        """
+        Send a job to its recipe's worker pool.
+
+        :param job: The job.
+        """
+
+        path = str(Path(self.directory).joinpath(job.id)) if job.pdf else None
+        with self._pool_lock:
+            job.attempts += 1
+            attempt = job.attempts
+            if self.job_timeout is not None:
+                job.deadline = perf_counter() + self.job_timeout
+            self._pools[job.recipe_filename].apply_async(
+                RenderService._render, ((job.page, path, job.pdf), ),
+                callback=lambda result: self._finish(job, result, None, attempt),
+                error_callback=lambda error: self._finish(job, None, error, attempt))
+
+    def _finish(self, job: RenderJob, result: Optional[Tuple[str, str, float]],
+                error: Optional[BaseException], attempt: Optional[int] = None) -> None:
+        """
+        Store the result of a job. This is called by a worker pool's result thread, or by the service.
+        A job only finishes once. A result from a pool that was replaced is ignored.
+
+        :param job: The job.
+        :param result: The result of `RenderService._render()`, or None if the job failed.
+        :param error: The error, or None if the job didn't fail.
+        :param attempt: If not None, the attempt (see `RenderJob.attempts`) that this is the result of.
+        """
+
+        with self._lock:
+            if job.status != RenderJob.QUEUED or (attempt is not None and attempt != job.attempts):
+                return
+            if error is None:
+                job.tex, tex_path, job.render_seconds = result
+                job.pdf_path = tex_path[:-4] + ".pdf" if job.pdf else ""
+                job.status = RenderJob.DONE
+            else:
+                job.status = RenderJob.FAILED
+                job.error = {"type": type(error).__name__, "message": str(error)}
+                if isinstance(error, TypesetError):
+                    job.error.update({"engine": error.engine, "reason": error.reason, "returncode": error.returncode,
+                                      "attempts": error.attempts, "log": error.log})
+            job.latency = perf_counter() - job.submitted
+            self._pending[job.recipe_filename] -= 1
+            self._counters["completed" if error is None else "failed"] += 1
+            self._latencies.append(job.latency)
+            self._render_seconds.append(job.render_seconds)
+            self._busy_seconds += job.render_seconds
+            self._forget()
+        job.done.set()
+
+    def _reap(self) -> None:
+        """
+        Replace every pool that has a job that timed out, until the service stops. This runs in its own thread.
+        """
+
+        while not self._stopped.wait(min(RenderService.REAP_INTERVAL, self.job_timeout)):
+            t = perf_counter()
+            with self._lock:
+                expired = set([job.recipe_filename for job in self._jobs.values()
+                               if job.status == RenderJob.QUEUED and job.deadline is not None and t >= job.deadline])
+            for recipe_filename in sorted(expired):
+                self._restart_pool(recipe_filename)
+
+    def _restart_pool(self, recipe_filename: str) -> None:
+        """
+        Terminate a recipe's worker pool and start a new one. A job that timed out fails, and every other job that
+        was sent to the old pool is sent to the new pool.
+
+        A timed-out job keeps its place in the queue until its worker is terminated, so the pool never has more than
+        `self.max_queue` jobs, and a worker never writes a job's files after the job finished.
+
+        :param recipe_filename: The filename of the recipe.
+        """
+
+        with self._pool_lock:
+            pool = self._pools[recipe_filename]
+            # The workers won't remove their own scratch directories.
+            pids = [worker.pid for worker in pool._pool]
+            pool.terminate()
+            for pid in pids:
+                Scratch.remove_directory(pid)
+            self._pools[recipe_filename] = self._get_pool(recipe_filename)
+            # Jobs that haven't been sent to a pool yet will be sent to the new pool.
+            with self._lock:
+                jobs = [job for job in self._jobs.values() if job.recipe_filename == recipe_filename and
+                        job.status == RenderJob.QUEUED and job.attempts > 0]
+        t = perf_counter()
+        for job in jobs:
+            if t >= job.deadline:
+                self._finish(job, None, TimeoutError(f"The job didn't finish within {self.job_timeout} seconds."))
+            else:
+                self._apply(job)
+
+    def _forget(self) -> None:
+        """
+        Forget the oldest finished jobs, and delete their files. The caller must hold the lock.
+        """
+
+        finished = [job_id for job_id, job in self._jobs.items() if job.done.is_set()]
+        for job_id in finished[:max(len(self._jobs) - self.max_jobs, 0)]:
+            del self._jobs[job_id]
+            for f in Path(self.directory).glob(job_id + ".*"):
+                try:
+                    f.unlink()
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _get_percentiles(values: Deque[float]) -> Dict[str, float]:
+        """
+        Returns the 50th, 90th, and 99th percentiles and the maximum of some values (nearest rank).
+
+        :param values: The values.
+        """
+
+        if len(values) == 0:
+            return {"p50": 0, "p90": 0, "p99": 0, "max": 0}
+        s = sorted(values)
+        percentiles = {"p" + str(p): s[max(0, -(-len(s) * p // 100) - 1)] for p in [50, 90, 99]}
+        percentiles["max"] = s[-1]
+        return percentiles
+
+    @staticmethod
+    def _initialize_worker(recipe_args: tuple, warm_up: bool) -> None:
+        """
+        Compile the recipe once per worker process and warm up the worker.
+
+        :param recipe_args: The arguments of the recipe (see `Book._initialize_worker()`).
+        :param warm_up: If true, load the hyphenation dictionary and typeset a warm-up page.
+        """
+
+        Book._initialize_worker(*recipe_args)
+        if not warm_up:
+            return
+        # A worker that can't warm up will report its error on its first job.
+        try:
+            if Word.H is None:
+                Word.H = Hyphenator('en_US')
+            # Lists of strings aren't cached (see `PageCache`), so the warm-up page is always typeset.
+            text = [RenderService.WARM_UP_TEXT]
+            Book._recipe.get_tex(text, text, text)
+        except Exception as e:
+            print(f"Failed to warm up a worker: {e}", file=sys.stderr)
+
+    @staticmethod
+    def _render(task: Tuple[Page, Optional[str], bool]) -> Tuple[str, str, float]:
+        """
+        Lay out a page in a worker process (see `Book._lay_out()`).
+        Returns the LaTeX body, the path to the .tex file (or an empty string), and the time it took.
+
+        :param task: A tuple: The page, the output path without an extension (or None), and whether to create a PDF.
+        """
+
+        t0 = perf_counter()
+        tex, tex_path = Book._lay_out(task)
+        return tex, tex_path, perf_counter() - t0
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    """
+    An HTTP server that handles each request in its own thread.
+    """
+
+    daemon_threads = True
+    service: RenderService = None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Handles requests to a `RenderService` (see `RenderService`).
+    """
+
+    def do_GET(self) -> None:
+        service: RenderService = self.server.service
+        parts = [p for p in urlparse(self.path).path.split("/") if p != ""]
+        if parts == ["metrics"]:
+            self._send_json(200, service.get_metrics())
+            return
+        if len(parts) < 2 or parts[0] != "jobs" or len(parts) > 3:
+            self._send_json(404, {"error": "Not found."})
+            return
+        job = service.get_job(parts[1])
+        if job is None:
+            self._send_json(404, {"error": f"No such job: {parts[1]}"})
+        elif len(parts) == 2:
+            self._send_json(200, job.to_dict())
+        elif not job.done.is_set() or job.status != RenderJob.DONE:
+            self._send_json(409, job.to_dict())
+        else:
+            self._send_result(job, parts[2])
+
+    def do_POST(self) -> None:
+        service: RenderService = self.server.service
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            self._send_json(404, {"error": "Not found."})
+            return
+        try:
+            data = loads(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+            page = Page(data["left"], data["center"], data["right"], data.get("chapter", ""))
+            for text in [page.left, page.center, page.right, page.chapter]:
+                if not isinstance(text, str):
+                    raise TypeError(f"Not a string: {text}")
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"Invalid page: {e}"})
+            return
+        recipe_filename = data.get("recipe", service.recipes[0])
+        if recipe_filename not in service.recipes:
+            self._send_json(404, {"error": f"Recipe not served: {recipe_filename}"})
+            return
+        pdf = bool(data.get("pdf", False))
+        job = service.submit(page, recipe_filename, pdf)
+        # Backpressure.
+        if job is None:
+            self._send_json(503, {"error": "The queue is full."}, {"Retry-After": "1"})
+            return
+        if parse_qs(url.query).get("wait", ["0"])[0] not in ["1", "true"]:
+            self._send_json(202, job.to_dict(), {"Location": f"/jobs/{job.id}"})
+            return
+        if not service.wait(job):
+            self._send_json(504, job.to_dict())
+        elif job.status == RenderJob.DONE:
+            self._send_result(job, "pdf" if pdf else "tex")
+        else:
+            self._send_json(500, job.to_dict())
+
+    def _send_result(self, job: RenderJob, kind: str) -> None:
+        """
+        Send the TeX or PDF of a finished job.
+
+        :param job: The job.
+        :param kind: "tex" or "pdf".
+        """
+
+        if kind == "tex":
+            self._send(200, job.tex.encode("utf-8"), "text/plain; charset=utf-8", {"X-Job-Id": job.id})
+        elif kind == "pdf" and job.pdf_path != "" and Path(job.pdf_path).exists():
+            self._send(200, Path(job.pdf_path).read_bytes(), "application/pdf", {"X-Job-Id": job.id})
+        else:
+            self._send_json(404, {"error": f"No {kind} for job: {job.id}"})
+
+    def _send_json(self, status: int, data: dict, headers: Optional[Dict[str, str]] = None) -> None:
+        self._send(status, dumps(data).encode("utf-8"), "application/json", headers)
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if headers is not None:
+            for key in headers:
+                self.send_header(key, headers[key])
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        # Don't print every request.
+        pass
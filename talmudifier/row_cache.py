@@ -0,0 +1,331 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Callable, Dict, List, Optional, Tuple
+import sqlite3
+from talmudifier.instrumentation import Instrumentation
+
+
+class RowCache:
+    """
+    A content-addressed cache of row counts. The key is a hash of everything that affects the number of rows:
+    the preamble, the paracol header, the column switch, and the TeX string.
+
+    The cache has two tiers: an in-memory LRU cache, and an optional SQLite database on disk.
+    The database survives across runs and can be shared between processes.
+    If two threads request the same key at the same time, only one of them measures it.
+    """
+
+    # Evict old entries from the database after this many writes.
+    EVICT_INTERVAL = 100
+
+    def __init__(self, max_size=100000, path: Optional[str] = None, max_disk_size=1000000):
+        """
+        :param max_size: The maximum number of entries in memory.
+        :param path: The path to the SQLite database. If None, there is no on-disk tier.
+        :param max_disk_size: The maximum number of entries in the database.
+        """
+
+        self.max_size = max_size
+        self.max_disk_size = max_disk_size
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+        self.evictions = 0
+
+        self._memory: OrderedDict = OrderedDict()
+        self._pending: Dict[str, Future] = dict()
+        self._lock = Lock()
+        self._num_writes = 0
+
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db: Optional[sqlite3.Connection] = sqlite3.connect(path, timeout=60, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS row_counts "
+                             "(key TEXT PRIMARY KEY, num_rows INTEGER NOT NULL, accessed REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS row_counts_accessed ON row_counts (accessed)")
+            self._db.commit()
+        else:
+            self._db = None
+
+    @staticmethod
+    def get_key(preamble: str, paracol: str, switch: str, tex: str) -> str:
+        """
+        Returns the cache key of a measurement.
+
+        :param preamble: The preamble of the document.
+        :param paracol: The paracol header.
+        :param switch: The column switch command.
+        :param tex: The TeX string of the column.
+        """
+
+        h = sha256()
+        for part in [preamble, paracol, switch, tex]:
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get(self, key: str, measure: Callable[[], int]) -> int:
+        """
+        Returns the cached number of rows. If there isn't one, measure the rows and cache the result.
+
+        :param key: The cache key (see `RowCache.get_key()`).
+        :param measure: A function that measures the number of rows.
+        """
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                Instrumentation.count("row_cache_hits")
+                return self._memory[key]
+
+            # Wait for another thread that is already measuring this key.
+            pending = self._pending.get(key)
+            waiting = pending is not None
+            if waiting:
+                self.deduplicated += 1
+                Instrumentation.count("row_cache_deduplicated")
+            else:
+                pending = Future()
+                self._pending[key] = pending
+        if waiting:
+            return pending.result()
+
+        try:
+            num_rows = self._get_from_disk(key)
+            if num_rows is None:
+                num_rows = measure()
+                with self._lock:
+                    self.misses += 1
+                    Instrumentation.count("row_cache_misses")
+                self._write_to_disk(key, num_rows)
+            else:
+                with self._lock:
+                    self.disk_hits += 1
+                    Instrumentation.count("row_cache_disk_hits")
+            self._put_in_memory(key, num_rows)
+            pending.set_result(num_rows)
+            return num_rows
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+
+    def claim(self, keys: List[str]) -> Tuple[Dict[str, int], List[str], Dict[str, Future]]:
+        """
+        Claim many keys at once, for a caller that measures its cache misses in one batch.
+        Returns three things:
+
+        1. The cached number of rows of each key that is in the cache.
+        2. The keys that this caller owns: it must measure them and then call `self.release()`, even if it fails.
+        3. The keys that another caller is already measuring, and a future of each number of rows.
+
+        The owned keys should be measured and released *before* waiting for the other callers' futures,
+        so that two callers that claimed each other's keys never wait for each other.
+
+        :param keys: The cache keys (see `RowCache.get_key()`). They can include duplicates.
+        """
+
+        hits: Dict[str, int] = dict()
+        owned: List[str] = list()
+        awaited: Dict[str, Future] = dict()
+        with self._lock:
+            for key in keys:
+                if key in hits or key in awaited or key in owned:
+                    continue
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    Instrumentation.count("row_cache_hits")
+                    hits[key] = self._memory[key]
+                elif key in self._pending:
+                    self.deduplicated += 1
+                    Instrumentation.count("row_cache_deduplicated")
+                    awaited[key] = self._pending[key]
+                else:
+                    self._pending[key] = Future()
+                    owned.append(key)
+
+        # Keys that are in the database don't need to be measured.
+        if self._db is not None:
+            for key in owned[:]:
+                num_rows = self._get_from_disk(key)
+                if num_rows is None:
+                    continue
+                with self._lock:
+                    self.disk_hits += 1
+                    Instrumentation.count("row_cache_disk_hits")
+                hits[key] = num_rows
+                owned.remove(key)
+                self._put_in_memory(key, num_rows)
+                self._resolve(key, num_rows, None)
+        with self._lock:
+            self.misses += len(owned)
+            Instrumentation.count("row_cache_misses", len(owned))
+        return hits, owned, awaited
+
+    def release(self, keys: List[str], num_rows: Dict[str, int], error: Optional[BaseException] = None) -> None:
+        """
+        Cache the number of rows of keys that were claimed with `self.claim()`, and wake up any callers
+        that are waiting for them. A claimed key that wasn't measured fails for the waiting callers.
+
+        :param keys: The claimed keys.
+        :param num_rows: The number of rows of each key that was measured.
+        :param error: The reason that the other keys weren't measured, if any.
+        """
+
+        for key in keys:
+            if key in num_rows:
+                try:
+                    self._write_to_disk(key, num_rows[key])
+                    self._put_in_memory(key, num_rows[key])
+                finally:
+                    self._resolve(key, num_rows[key], None)
+            else:
+                self._resolve(key, None, error if error is not None else Exception(f"Not measured: {key}"))
+
+    def _resolve(self, key: str, num_rows: Optional[int], error: Optional[BaseException]) -> None:
+        """
+        Stop measuring a claimed key, and set the result of its future.
+
+        :param key: The cache key.
+        :param num_rows: The number of rows, or None if the key wasn't measured.
+        :param error: If the key wasn't measured, the reason why.
+        """
+
+        with self._lock:
+            pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        if error is None:
+            pending.set_result(num_rows)
+        else:
+            pending.set_exception(error)
+
+    def lookup(self, key: str) -> Optional[int]:
+        """
+        Returns the cached number of rows, or None if there isn't one. Doesn't wait for in-flight measurements.
+
+        :param key: The cache key (see `RowCache.get_key()`).
+        """
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                Instrumentation.count("row_cache_hits")
+                return self._memory[key]
+        num_rows = self._get_from_disk(key)
+        with self._lock:
+            if num_rows is None:
+                self.misses += 1
+                Instrumentation.count("row_cache_misses")
+                return None
+            self.disk_hits += 1
+            Instrumentation.count("row_cache_disk_hits")
+        self._put_in_memory(key, num_rows)
+        return num_rows
+
+    def put(self, key: str, num_rows: int) -> None:
+        """
+        Cache a number of rows.
+
+        :param key: The cache key (see `RowCache.get_key()`).
+        :param num_rows: The number of rows.
+        """
+
+        self._write_to_disk(key, num_rows)
+        self._put_in_memory(key, num_rows)
+
+    def get_stats(self) -> dict:
+        """
+        Returns the number of hits, misses, etc. as a dictionary.
+        """
+
+        with self._lock:
+            return {"hits": self.hits,
+                    "disk_hits": self.disk_hits,
+                    "misses": self.misses,
+                    "deduplicated": self.deduplicated,
+                    "evictions": self.evictions,
+                    "size": len(self._memory)}
+
+    def clear(self) -> None:
+        """
+        Clear the in-memory cache. The database is unchanged.
+        """
+
+        with self._lock:
+            self._memory.clear()
+
+    def close(self) -> None:
+        """
+        Close the database connection, if any.
+        """
+
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _put_in_memory(self, key: str, num_rows: int) -> None:
+        """
+        Store the number of rows in memory and evict the least-recently-used entries.
+
+        :param key: The cache key.
+        :param num_rows: The number of rows.
+        """
+
+        with self._lock:
+            self._memory[key] = num_rows
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
+                self.evictions += 1
+
+    def _get_from_disk(self, key: str) -> Optional[int]:
+        """
+        Returns the number of rows stored in the database, or None if there isn't an entry.
+
+        :param key: The cache key.
+        """
+
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT num_rows FROM row_counts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE row_counts SET accessed = ? WHERE key = ?", (time(), key))
+            self._db.commit()
+            return row[0]
+
+    def _write_to_disk(self, key: str, num_rows: int) -> None:
+        """
+        Store the number of rows in the database. Every so often, evict the least-recently-used entries.
+
+        :param key: The cache key.
+        :param num_rows: The number of rows.
+        """
+
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO row_counts (key, num_rows, accessed) VALUES (?, ?, ?)",
+                             (key, num_rows, time()))
+            self._num_writes += 1
+            if self._num_writes % RowCache.EVICT_INTERVAL == 0:
+                size = self._db.execute("SELECT COUNT(*) FROM row_counts").fetchone()[0]
+                if size > self.max_disk_size:
+                    self._db.execute("DELETE FROM row_counts WHERE key IN "
+                                     "(SELECT key FROM row_counts ORDER BY accessed LIMIT ?)",
+                                     (size - self.max_disk_size,))
+                    self.evictions += size - self.max_disk_size
+            self._db.commit()
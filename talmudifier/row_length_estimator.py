@@ -0,0 +1,153 @@
+from json import dump, load
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional, Tuple
+import io
+
+
+class RowLengthEstimator:
+    """
+    Learn the number of characters that fill a number of rows from the row breaks that `RowMaker` finds.
+    The estimates are keyed by column, width (e.g. "half"), and font size.
+    They supply the expected length of later blocks and pages, so that each search starts closer to its result.
+
+    Each estimate is an exponential moving average of the observed lengths.
+    There is also an average number of characters per row, which is used for numbers of rows that haven't been seen.
+
+    The learned counts can be saved to a sidecar file and loaded in a later run:
+
+    ```python
+    from talmudifier.row_length_estimator import RowLengthEstimator
+    from talmudifier.talmudifier import Talmudifier
+
+    estimator = RowLengthEstimator(path="recipes/default.learned.json")
+    t = Talmudifier(left, center, right, estimator=estimator)
+    t.create_pdf()
+    estimator.save()
+    ```
+    """
+
+    def __init__(self, path: Optional[str] = None, weight=0.3):
+        """
+        :param path: The path to the sidecar file. If it exists, the learned counts are loaded from it.
+        :param weight: The weight of each new observation, between 0 and 1.
+        """
+
+        assert 0 < weight <= 1, f"Invalid weight: {weight}"
+        self.path = path
+        self.weight = weight
+        self.observations = 0
+
+        # Key = (column, width, font size, number of rows). Value = The average number of characters.
+        self._lengths: Dict[Tuple[str, str, int, int], float] = dict()
+        # Key = (column, width, font size). Value = The average number of characters per row.
+        self._rates: Dict[Tuple[str, str, int], float] = dict()
+        self._lock = Lock()
+
+        if path is not None and Path(path).exists():
+            with io.open(path, "rt", encoding="utf-8") as f:
+                data = load(f)
+            for width in data:
+                for column_name in data[width]:
+                    for font_size in data[width][column_name]:
+                        for num_rows, length in data[width][column_name][font_size].items():
+                            self._observe((column_name, width, int(font_size)), int(num_rows), length)
+
+    def get(self, column_name: str, width: str, font_size: int, num_rows: int,
+            counts: Optional[Dict[str, int]] = None) -> int:
+        """
+        Returns the expected number of characters in a number of rows, or -1 if there's no estimate.
+
+        The estimates are, in order of preference: a learned estimate of this number of rows;
+        the recipe's count of this number of rows; the learned number of characters per row times the number of rows;
+        the recipe's count of 1 row times the number of rows.
+
+        :param column_name: The name of the column.
+        :param width: The width, e.g. half.
+        :param font_size: The font size of the column.
+        :param num_rows: The number of rows.
+        :param counts: The recipe's `character_counts` of this column and width. Can be None.
+        """
+
+        if counts is None:
+            counts = dict()
+        key = (column_name, width, font_size)
+        with self._lock:
+            if key + (num_rows, ) in self._lengths:
+                return round(self._lengths[key + (num_rows, )])
+            if str(num_rows) in counts:
+                return counts[str(num_rows)]
+            if key in self._rates:
+                return round(self._rates[key] * num_rows)
+        if "1" in counts:
+            return counts["1"] * num_rows
+        return -1
+
+    def update(self, column_name: str, width: str, font_size: int, num_rows: int, length: int) -> None:
+        """
+        Learn from a row break: a number of characters filled a number of rows.
+
+        :param column_name: The name of the column.
+        :param width: The width, e.g. half.
+        :param font_size: The font size of the column.
+        :param num_rows: The number of rows.
+        :param length: The number of characters.
+        """
+
+        if num_rows <= 0 or length <= 0:
+            return
+        with self._lock:
+            self._observe((column_name, width, font_size), num_rows, length)
+            self.observations += 1
+
+    def get_counts(self) -> Dict[str, Dict[str, Dict[str, Dict[str, int]]]]:
+        """
+        Returns the learned counts: width, column, font size, number of rows, number of characters.
+        """
+
+        counts = dict()
+        with self._lock:
+            for (column_name, width, font_size, num_rows), length in sorted(self._lengths.items()):
+                if width not in counts:
+                    counts[width] = dict()
+                if column_name not in counts[width]:
+                    counts[width][column_name] = dict()
+                if str(font_size) not in counts[width][column_name]:
+                    counts[width][column_name][str(font_size)] = dict()
+                counts[width][column_name][str(font_size)][str(num_rows)] = round(length)
+        return counts
+
+    def save(self, path: Optional[str] = None) -> str:
+        """
+        Save the learned counts to a sidecar file. Returns the path.
+
+        :param path: The path to the file. If None, use the path that this estimator was created with.
+        """
+
+        if path is None:
+            path = self.path
+        assert path is not None, "No sidecar path."
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with io.open(path, "wt", encoding="utf-8") as f:
+            dump(self.get_counts(), f, indent=2)
+        return path
+
+    def _observe(self, key: Tuple[str, str, int], num_rows: int, length: float) -> None:
+        """
+        Update the moving averages. The caller must hold the lock (or be the constructor).
+
+        :param key: (column, width, font size).
+        :param num_rows: The number of rows.
+        :param length: The number of characters.
+        """
+
+        length_key = key + (num_rows, )
+        if length_key in self._lengths:
+            self._lengths[length_key] += self.weight * (length - self._lengths[length_key])
+        else:
+            self._lengths[length_key] = length
+        rate = length / num_rows
+        if key in self._rates:
+            self._rates[key] += self.weight * (rate - self._rates[key])
+        else:
+            self._rates[key] = rate
@@ -1,8 +1,19 @@
 from talmudifier.column import Column
 from talmudifier.paracol import Paracol
 from talmudifier.pdf_reader import PDFReader
+from talmudifier.log_reader import LogReader
 from talmudifier.pdf_writer import PDFWriter
+from talmudifier.measurement_server import MeasurementServer
+from talmudifier.row_cache import RowCache
+from talmudifier.row_length_estimator import RowLengthEstimator
+from talmudifier.simulator import Simulator
+from talmudifier.word import Word
+from talmudifier.scratch import Scratch
+from talmudifier.instrumentation import Instrumentation
 from pathlib import Path
+from typing import Callable, Dict, Generator, List, Optional, Tuple
+from asyncio import get_event_loop, wrap_future
+from concurrent.futures import Future
 
 
 class RowMaker:
@@ -10,80 +21,554 @@ class RowMaker:
     Create a target number of rows from a column in a paracol environment.
     """
 
-    def __init__(self, left: bool, center: bool, right: bool, target: str, writer: PDFWriter):
+    # Layout processes yield these requests (see `RowMaker.lay_out()`).
+    # Measure the number of rows of TeX strings:
+    # (ROWS, list of (row maker, TeX string), the number of candidates that end with a hyphenated fragment).
+    ROWS = "rows"
+    # Find the row of each word of a column: (WORD_ROWS, row maker, column, number of words).
+    WORD_ROWS = "word_rows"
+
+    def __init__(self, left: bool, center: bool, right: bool, target: str, writer: PDFWriter,
+                 server: Optional[MeasurementServer] = None, cache: Optional[RowCache] = None, read_log=True,
+                 simulator: Optional[Simulator] = None, batch_size=1, label_words=False,
+                 estimator: Optional[RowLengthEstimator] = None):
+        """
+        :param left: If true, a left column exists.
+        :param center: If true, a center column exists.
+        :param right: If true, a right column exists.
+        :param target: The name of the target column: left, center, or right.
+        :param writer: The PDF writer.
+        :param server: If not None, measure rows with this long-lived xelatex process instead of the writer.
+        :param cache: If not None, look up row counts in this cache before measuring them.
+        :param read_log: If true, read the number of rows from the xelatex log instead of the PDF.
+        :param simulator: If not None, search for row breaks with this simulator and confirm them with xelatex.
+        :param batch_size: The number of candidates to measure in one compile at each step of the search.
+        :param label_words: If true, find the row of every word in one compile before searching.
+        :param estimator: If not None, teach this estimator the length of each row break.
+        """
+
         self.paracol = Paracol.get_paracol_header(left, center, right)
         self.switch = Paracol.get_switch_from_left(left, center, right, target)
         self.writer = writer
+        self.server = server
+        self.cache = cache
+        self.read_log = read_log
+        self.simulator = simulator
+        self.target = target
+        assert batch_size > 0, f"Invalid batch size: {batch_size}"
+        self.batch_size = batch_size
+        self.label_words = label_words
+        self.estimator = estimator
+        self.width = Paracol.get_width(left, center, right, target)
+        if self.simulator is not None:
+            columns = [c for c, exists in zip(["left", "center", "right"], [left, center, right]) if exists]
+            self.column_width = self.simulator.get_column_width(self.paracol, columns.index(target))
+        else:
+            self.column_width = -1
 
     def get_text_of_length(self, column: Column, target_num_rows: int, expected_length: int) -> (str, Column):
         """
         Returns enough text to fill the target number of rows.
 
+        The number of words is found with a search rather than one word at a time:
+        Starting from the expected length, gallop forwards or backwards until the target is bracketed,
+        and then bisect until we find the largest number of words that fits in the target number of rows.
+        If the batch size is greater than 1, each step of the search measures that many candidates in one compile.
+
+        If there is a simulator, search with the simulator and then confirm the result with xelatex.
+        If xelatex disagrees, search again with xelatex.
+
+        If `label_words` is true, typeset the column once with each word labeled by its row, cut the column
+        after the target row, and confirm the cut. If the cut can't be confirmed, search with xelatex.
+
+        :param column: The column of words.
+        :param target_num_rows: The target number of rows.
+        :param expected_length: The expected length of characters. Used as a baseline for row-making.
+        """
+
+        return RowMaker.run(self.lay_out(column, target_num_rows, expected_length))
+
+    async def get_text_of_length_async(self, column: Column, target_num_rows: int,
+                                       expected_length: int) -> (str, Column):
+        """
+        Returns enough text to fill the target number of rows (see `self.get_text_of_length()`).
+        xelatex runs in asynchronous subprocesses.
+
+        :param column: The column of words.
+        :param target_num_rows: The target number of rows.
+        :param expected_length: The expected length of characters. Used as a baseline for row-making.
+        """
+
+        return await RowMaker.run_async(self.lay_out(column, target_num_rows, expected_length))
+
+    def lay_out(self, column: Column, target_num_rows: int, expected_length: int, num_rows=-1) -> Generator:
+        """
+        A layout process that fills the target number of rows (see `self.get_text_of_length()`).
+        The process doesn't measure anything. Instead, it yields measurement requests and is sent the results.
+        Run it with `RowMaker.run()` or `RowMaker.run_async()`. Returns (TeX string, new column).
+
+        :param column: The column of words.
+        :param target_num_rows: The target number of rows.
+        :param expected_length: The expected length of characters. Used as a baseline for row-making.
+        :param num_rows: If not -1, the number of rows of the whole column in my paracol environment,
+                         which was already measured. If the whole column fits, nothing is measured.
+        """
+
+        process = self._lay_out(column, target_num_rows, expected_length, num_rows)
+        if Instrumentation.current is None:
+            return (yield from process)
+
+        with Instrumentation.span("block", "row_maker", target=self.target, width=self.width,
+                                  target_rows=target_num_rows, expected_length=expected_length) as span:
+            # Count the requests.
+            try:
+                request = next(process)
+                while True:
+                    span.add("measurements")
+                    if request[0] == RowMaker.ROWS:
+                        span.add("candidates", len(request[1]))
+                        span.add("hyphenation_attempts", request[2])
+                    request = process.send((yield request))
+            except StopIteration as e:
+                span.set(words=len(column.words) - len(e.value[1].words))
+                return e.value
+
+    def _lay_out(self, column: Column, target_num_rows: int, expected_length: int, num_rows: int) -> Generator:
+        """
+        The layout process of `self.lay_out()`.
+
+        :param column: The column of words.
+        :param target_num_rows: The target number of rows.
+        :param expected_length: The expected length of characters. Used as a baseline for row-making.
+        :param num_rows: The number of rows of the whole column, or -1 if it hasn't been measured.
+        """
+
+        # The whole column is known to fit.
+        if 0 <= num_rows <= target_num_rows:
+            return RowMaker._get_result(column, column.fill(), None)
+
+        result = None
+        if self.simulator is not None:
+            num_words, pair = RowMaker._drive(RowMaker._fit(column, target_num_rows, expected_length, self.batch_size),
+                                              lambda candidates: self._get_simulated_num_rows(column, candidates))
+            confirmed = yield from self._confirm(column, target_num_rows, num_words, pair)
+            if confirmed:
+                result = num_words, pair
+
+        if result is None and self.label_words:
+            result = yield from self._fit_with_word_rows(column, target_num_rows, expected_length)
+
+        if result is None:
+            result = yield from self._measure_candidates(
+                column, RowMaker._fit(column, target_num_rows, expected_length, self.batch_size, num_rows))
+
+        self._learn(column, target_num_rows, result[0], result[1])
+        return RowMaker._get_result(column, result[0], result[1])
+
+    def _learn(self, column: Column, target_num_rows: int, num_words: int, pair: Optional[List[Word]]) -> None:
+        """
+        Teach my estimator the number of characters that filled the target number of rows.
+        If the whole column fit, the rows might not be full, so there's nothing to learn.
+
+        :param column: The column of words.
+        :param target_num_rows: The target number of rows.
+        :param num_words: The number of words that fit.
+        :param pair: The hyphenated pair of the next word, or None.
+        """
+
+        if self.estimator is None or num_words >= column.fill(num_words + 1):
+            return
+        # Count the characters the same way that `RowMaker._fit()` does.
+        length = sum([len(w.word) for w in column.words[:num_words]])
+        if pair is not None:
+            length += len(pair[0].word)
+        self.estimator.update(self.target, self.width, column.font_size, target_num_rows, length)
+
+    @staticmethod
+    def run(process: Generator):
+        """
+        Run a layout process (see `self.lay_out()`). Measure each request with xelatex. Returns the process's result.
+
+        :param process: The layout process.
+        """
+
+        return RowMaker._drive(process, RowMaker._measure_request)
+
+    @staticmethod
+    async def run_async(process: Generator):
+        """
+        Run a layout process (see `self.lay_out()`). Measure each request with xelatex in an asynchronous subprocess,
+        so many processes can share one event loop. Returns the process's result.
+
+        :param process: The layout process.
+        """
+
+        try:
+            request = next(process)
+            while True:
+                request = process.send(await RowMaker._measure_request_async(request))
+        except StopIteration as e:
+            return e.value
+
+    @staticmethod
+    def _drive(process: Generator, answer: Callable):
+        """
+        Run a process that yields requests. Returns the process's result.
+
+        :param process: The process.
+        :param answer: A function that returns the answer to a request.
+        """
+
+        try:
+            request = next(process)
+            while True:
+                request = process.send(answer(request))
+        except StopIteration as e:
+            return e.value
+
+    @staticmethod
+    def _measure_request(request: tuple):
+        """
+        Measure a request from a layout process.
+        A request is either (`RowMaker.ROWS`, list of (row maker, TeX string), number of hyphenated candidates) or
+        (`RowMaker.WORD_ROWS`, row maker, column, number of words).
+
+        :param request: The request.
+        """
+
+        if request[0] == RowMaker.ROWS:
+            return RowMaker.get_num_rows_of_many(request[1])
+        elif request[0] == RowMaker.WORD_ROWS:
+            return request[1].get_word_rows(request[2], request[3])
+        else:
+            raise Exception(f"Invalid request: {request[0]}")
+
+    @staticmethod
+    async def _measure_request_async(request: tuple):
+        """
+        Measure a request from a layout process in an asynchronous subprocess (see `RowMaker._measure_request()`).
+
+        :param request: The request.
+        """
+
+        if request[0] == RowMaker.ROWS:
+            return await RowMaker.get_num_rows_of_many_async(request[1])
+        elif request[0] == RowMaker.WORD_ROWS:
+            return await request[1].get_word_rows_async(request[2], request[3])
+        else:
+            raise Exception(f"Invalid request: {request[0]}")
+
+    def _measure_candidates(self, column: Column, process: Generator) -> Generator:
+        """
+        Run a search process that yields candidates (see `self._fit()`).
+        Yield each list of candidates as a request to measure their TeX strings. Returns the search's result.
+
+        :param column: The column of words.
+        :param process: The search process.
+        """
+
+        try:
+            candidates = next(process)
+            while True:
+                num_rows = yield self._get_request(column, candidates)
+                candidates = process.send(num_rows)
+        except StopIteration as e:
+            return e.value
+
+    def _get_request(self, column: Column, candidates: List[Tuple[int, Optional[Word]]]) -> tuple:
+        """
+        Returns a request to measure the number of rows of each candidate in one compile.
+        A candidate is the first k words of the column plus an optional hyphenated fragment.
+
+        :param column: The column of words.
+        :param candidates: A list of candidates: (number of words, fragment or None).
+        """
+
+        texs = [(self, column.get_prefix_tex(num_words, fragment)) for num_words, fragment in candidates]
+        return RowMaker.ROWS, texs, len([fragment for num_words, fragment in candidates if fragment is not None])
+
+    @staticmethod
+    def _fit(column: Column, target_num_rows: int, expected_length: int, batch_size: int,
+             num_rows=-1) -> Generator:
+        """
+        Search for the largest number of words that fits in the target number of rows.
+        Returns the number of words, and a hyphenated pair of the next word (or None).
+
+        This is a generator. It yields lists of candidates and is sent the number of rows of each candidate.
+        A candidate is the first k words of the column plus an optional hyphenated fragment: (k, fragment or None).
+
         :param column: The column of words.
         :param target_num_rows: The target number of rows.
         :param expected_length: The expected length of characters. Used as a baseline for row-making.
+        :param batch_size: The number of candidates to measure at each step of the search.
+        :param num_rows: If not -1, the number of rows of the whole column.
         """
 
-        col_temp = Column([], column.font, column.font_size, column.font_skip)
+        # Only the words that have been read so far. More words are read as the search needs them.
+        num_words = column.fill(1)
 
-        # Try to fill the temporary column with the target number of characters.
-        filled = False if expected_length > 0 else True
-        next_word_index = 0
-        while not filled:
-            if next_word_index >= len(column.words):
-                filled = True
-                continue
-            # Get the next word.
-            col_temp.words.append(column.words[next_word_index])
-            next_word_index += 1
+        # An empty column always fits.
+        if num_words == 0:
+            return 0, None
 
-            # Check if we have exceeded the target length.
-            row_length_estimate = sum([len(w.word) for w in col_temp.words])
-            filled = row_length_estimate > expected_length
+        # The number of rows of each prefix of the column that we've measured so far, keyed by the number of words.
+        rows: Dict[int, int] = {}
+        if num_rows >= 0:
+            rows[column.fill()] = num_rows
 
-        next_word_index = len(col_temp.words)
+        # Get the number of words that fill the target number of characters (plus one word to overflow).
+        guess = 1
+        if expected_length > 0:
+            row_length_estimate = 0
+            guess = 0
+            while guess < column.fill(guess + 1) and row_length_estimate <= expected_length:
+                row_length_estimate += len(column.words[guess].word)
+                guess += 1
+        num_words = column.fill(guess + 1)
 
-        done = False
-        while not done:
-            num_rows = self.get_num_rows(col_temp.get_tex(True))
+        # If the estimate includes every word, check whether the whole column fits.
+        if guess >= num_words:
+            if num_words not in rows:
+                rows[num_words] = (yield [(num_words, None)])[0]
+            if rows[num_words] <= target_num_rows:
+                return num_words, None
+        guess = min(guess, num_words)
 
-            # Try to overflow the column.
-            if num_rows <= target_num_rows:
-                # If there no more words to add, return what we've got.
-                if next_word_index >= len(column.words):
-                    return col_temp.get_tex(True), Column([], column.font, column.font_size, column.font_skip)
+        # Start with the guess and its neighbors: +1, -1, +2, -2, +4, -4...
+        probes = [guess]
+        offset = 1
+        while len(probes) < batch_size:
+            probes.append(guess + offset)
+            if len(probes) < batch_size:
+                probes.append(guess - offset)
+            offset *= 2
 
-                # Append a new word.
-                col_temp.words.append(column.words[next_word_index])
-                next_word_index += 1
-            # Walk it back.
+        # The largest prefix that fits is between lo (fits) and hi (overflows). An empty prefix always fits.
+        step = 1
+        while True:
+            # Read enough words to tell whether the longest probe is the whole column.
+            num_words = column.fill(max(probes) + 1)
+            ks = sorted(set([k for k in probes if 0 < k <= num_words and k not in rows]))
+            if len(ks) > 0:
+                rows.update(zip(ks, (yield [(k, None) for k in ks])))
+            lo = max([0] + [k for k in rows if rows[k] <= target_num_rows])
+            hi = min([num_words + 1] + [k for k in rows if rows[k] > target_num_rows and k > lo])
+            # The whole column fits.
+            if lo == num_words:
+                return num_words, None
+            if hi - lo <= 1:
+                break
+            # Gallop forwards.
+            if hi > num_words:
+                probes = []
+                for i in range(batch_size):
+                    probes.append(lo + step)
+                    step *= 2
+                num_words = column.fill(max(probes) + 1)
+                probes = [min(k, num_words) for k in probes]
+            # Gallop backwards.
+            elif lo == 0 and len([k for k in rows if k < hi]) == 0:
+                probes = []
+                for i in range(batch_size):
+                    probes.append(max(hi - step, 1))
+                    step *= 2
+            # Bisect.
             else:
-                if len(col_temp.words) == 0:
-                    raise Exception("Empty column? I got nothin'.")
+                probes = [lo + (hi - lo) * (i + 1) // (batch_size + 1) for i in range(batch_size)]
+
+        # The number of rows of the prefix that fits. An empty prefix is never measured.
+        num_rows = rows[lo] if lo in rows else target_num_rows
+        pair = yield from RowMaker._get_pair(column, target_num_rows, lo, num_rows, batch_size)
+        return lo, pair
+
+    @staticmethod
+    def _get_pair(column: Column, target_num_rows: int, num_words: int, num_rows: int,
+                  batch_size: int) -> Generator:
+        """
+        If the first words of the column fill the target number of rows,
+        try adding hyphenated fragments of the overflowing word. Returns the first pair that fits, or None.
+
+        This is a generator that yields candidates (see `RowMaker._fit()`).
+
+        :param column: The column of words.
+        :param target_num_rows: The target number of rows.
+        :param num_words: The number of words that fit.
+        :param num_rows: The number of rows of the words that fit.
+        :param batch_size: The number of candidates to measure at once.
+        """
+
+        if num_rows != target_num_rows or num_words >= column.fill(num_words + 1):
+            return None
+        pairs = column.words[num_words].pairs
+        for i in range(0, len(pairs), batch_size):
+            batch = pairs[i: i + batch_size]
+            num_rows = yield [(num_words, pair[0]) for pair in batch]
+            for pair, n in zip(batch, num_rows):
+                # The hyphenated fragment fits!
+                if n == target_num_rows:
+                    return pair
+        # No hyphenated pair worked.
+        return None
 
-                # Remove the last word.
-                last_word = col_temp.words.pop()
+    def _fit_with_word_rows(self, column: Column, target_num_rows: int, expected_length: int) -> Generator:
+        """
+        Typeset the column once with each word marked, and cut it after the last word on the target row.
+        Then confirm the cut with one more compile. Returns (number of words, hyphenated pair or None),
+        or None if the cut couldn't be confirmed.
+
+        This is a layout process (see `self.lay_out()`).
+
+        :param column: The column of words.
+        :param target_num_rows: The target number of rows.
+        :param expected_length: The expected length of characters. If greater than 0, only typeset enough words
+                                to fill about twice this length.
+        """
+
+        if column.is_empty():
+            return 0, None
 
-                num_rows = self.get_num_rows(col_temp.get_tex(True))
+        # Get the number of words to typeset.
+        if expected_length > 0:
+            length = 0
+            end_index = 0
+            while end_index < column.fill(end_index + 1) and length <= 2 * expected_length:
+                length += len(column.words[end_index].word)
+                end_index += 1
+        else:
+            end_index = column.fill()
 
-                # If removing the last word gave us the target number of rows, try adding hyphenated fragments.
-                if num_rows == target_num_rows:
-                    for pair in last_word.pairs:
-                        # Create a temporary column that includes the first half of the pair.
-                        words = col_temp.words[:]
+        word_rows = yield RowMaker.WORD_ROWS, self, column, end_index
+        if len(word_rows) == 0:
+            return None
 
-                        words.append(pair[0])
-                        col_temp_temp = Column(words, column.font, column.font_size, column.font_skip)
+        # Count the words on the target rows.
+        k = 0
+        while k < end_index and k in word_rows and word_rows[k] <= target_num_rows:
+            k += 1
 
-                        # The hyphenated fragment fits! Add it and return the truncated column.
-                        if self.get_num_rows(col_temp_temp.get_tex(True)) == target_num_rows:
-                            words = column.words[len(col_temp.words) + 1:]
+        # Confirm the cut, and allow the last word to be one too many (e.g. because it was hyphenated).
+        num_words = column.fill(k + 2)
+        candidates = [c for c in [k - 1, k, k + 1] if 0 < c <= num_words]
+        rows = dict(zip(candidates, (yield self._get_request(column, [(c, None) for c in candidates]))))
+        rows[0] = 0
+        if k == num_words and rows[k] <= target_num_rows:
+            return num_words, None
+        for c in [k, k - 1]:
+            if c in rows and c + 1 in rows and rows[c] <= target_num_rows < rows[c + 1]:
+                num_rows = rows[c] if c > 0 else target_num_rows
+                pair = yield from self._measure_candidates(
+                    column, RowMaker._get_pair(column, target_num_rows, c, num_rows, self.batch_size))
+                return c, pair
+        return None
 
-                            # Insert the second half of the word pair to the words list and add it to a new column.
-                            words.insert(0, pair[1])
-                            return col_temp_temp.get_tex(True), Column(words, column.font, column.font_size, column.font_skip)
-                    # No hyphenated pair worked. Return what we've got.
-                    return col_temp.get_tex(True), Column(column.words[len(col_temp.words):], column.font, column.font_size, column.font_skip)
+    def get_word_rows(self, column: Column, end_index: int) -> Dict[int, int]:
+        """
+        Typeset the first words of the column in one compile and return the row of each word.
+
+        :param column: The column of words.
+        :param end_index: The number of words to typeset.
+        :return: A dictionary: Key = The index of the word. Value = The row, starting at 1.
+        """
+
+        block = self._get_word_rows_block(column, end_index)
+        with self._get_word_rows_span(end_index):
+            if self.server is not None:
+                lines = self.server.get_output(block)
+            else:
+                with Scratch.job("word_rows") as (directory, jobname):
+                    self.writer.write(block, jobname, pdf=False, directory=directory)
+                    lines = LogReader.get_lines(str(Path(directory).joinpath(jobname + ".log")))
+        return LogReader.get_word_rows(lines)
+
+    async def get_word_rows_async(self, column: Column, end_index: int) -> Dict[int, int]:
+        """
+        Typeset the first words of the column in an asynchronous subprocess and return the row of each word.
+
+        :param column: The column of words.
+        :param end_index: The number of words to typeset.
+        :return: A dictionary: Key = The index of the word. Value = The row, starting at 1.
+        """
+
+        block = self._get_word_rows_block(column, end_index)
+        with self._get_word_rows_span(end_index):
+            if self.server is not None:
+                lines = await get_event_loop().run_in_executor(None, self.server.get_output, block)
+            else:
+                with Scratch.job("word_rows") as (directory, jobname):
+                    await self.writer.write_async(block, jobname, pdf=False, directory=directory)
+                    lines = LogReader.get_lines(str(Path(directory).joinpath(jobname + ".log")))
+        return LogReader.get_word_rows(lines)
+
+    def _get_word_rows_block(self, column: Column, end_index: int) -> str:
+        """
+        Returns a paracol block of the first words of the column, with each word marked.
+
+        :param column: The column of words.
+        :param end_index: The number of words to typeset.
+        """
+
+        return self.writer.typesetter.define_mark + self.get_block(column.get_tex(True, 0, end_index, mark_words=True))
+
+    def _confirm(self, column: Column, target_num_rows: int, num_words: int, pair: Optional[List[Word]]) -> Generator:
+        """
+        Returns true if xelatex agrees with a result of `self._fit()`:
+        The text fits in the target number of rows, and one more word would overflow.
+        Both candidates are measured in one compile.
+
+        This is a layout process (see `self.lay_out()`).
+
+        :param column: The column of words.
+        :param target_num_rows: The target number of rows.
+        :param num_words: The number of words.
+        :param pair: The hyphenated pair of the next word, or None.
+        """
+
+        # The whole column fits.
+        if num_words == column.fill(num_words + 1):
+            return (yield self._get_request(column, [(num_words, None)]))[0] <= target_num_rows
+        # Only check the overflow.
+        if pair is None and num_words == 0:
+            return (yield self._get_request(column, [(1, None)]))[0] > target_num_rows
+
+        num_rows = yield self._get_request(column, [(num_words, pair[0] if pair is not None else None),
+                                                    (num_words + 1, None)])
+        if pair is not None and num_rows[0] != target_num_rows:
+            return False
+        return num_rows[0] <= target_num_rows < num_rows[1]
+
+    @staticmethod
+    def _get_result(column: Column, num_words: int, pair: Optional[List[Word]]) -> (str, Column):
+        """
+        Returns the TeX string of the first words of the column and a new column of the remaining words.
+
+        :param column: The column of words.
+        :param num_words: The number of words.
+        :param pair: If not None, end the TeX string with the first half of this pair,
+                     and start the new column with the second half.
+        """
+
+        if pair is None:
+            return column.get_prefix_tex(num_words), column.get_remainder(num_words)
+
+        # Start the new column with the second half of the word pair.
+        return column.get_prefix_tex(num_words, pair[0]), column.get_remainder(num_words, pair[1])
+
+    def _get_simulated_num_rows(self, column: Column, candidates: List[Tuple[int, Optional[Word]]]) -> List[int]:
+        """
+        Returns the simulated number of rows of each candidate.
+        A candidate is the first k words of the column plus an optional hyphenated fragment.
+
+        :param column: The column of words.
+        :param candidates: A list of candidates: (number of words, fragment or None).
+        """
+
+        num_rows = []
+        for num_words, fragment in candidates:
+            words = column.words[:num_words]
+            if fragment is not None:
+                words.append(fragment)
+            num_rows.append(self.simulator.get_num_rows(words, self.target, self.column_width, column.font_size))
+        return num_rows
 
     def get_num_rows(self, tex: str) -> int:
         """
@@ -92,8 +577,273 @@ class RowMaker:
         :param tex: The TeX string.
         """
 
-        tex = r"\internallinenumbers \begin{linenumbers}" + tex + r"\end{linenumbers} \resetlinenumber[1]"
-        tex = self.paracol + self.switch + " " + tex + "\n\n\\end{paracol}"
-        self.writer.write(tex, "line_count")
-        output_path = str(Path("Output/line_count.pdf").resolve())
-        return PDFReader.get_num_rows(output_path)
+        if self.cache is None:
+            return self._measure_blocks([self.get_block(tex)])[0]
+        return self.cache.get(self._get_cache_key(tex), lambda: self._measure_blocks([self.get_block(tex)])[0])
+
+    def get_num_rows_batch(self, texs: List[str]) -> List[int]:
+        """
+        Returns the number of rows that each TeX string fills in the paracol environment.
+        All of the strings are measured in one compile.
+
+        :param texs: The TeX strings.
+        """
+
+        return RowMaker.get_num_rows_of_many([(self, tex) for tex in texs])
+
+    @staticmethod
+    def get_num_rows_of_many(requests: List[Tuple["RowMaker", str]]) -> List[int]:
+        """
+        Returns the number of rows of many TeX strings, each in the paracol environment of its own row maker.
+        Cached strings aren't measured. The rest are measured in one compile (each in its own paracol block).
+        The row makers must all use the same writer.
+
+        :param requests: A list of (row maker, TeX string).
+        """
+
+        num_rows, misses, claims, awaited = RowMaker._look_up(requests)
+        error = None
+        try:
+            if len(misses) > 0:
+                blocks = [requests[i][0].get_block(requests[i][1]) for i in misses]
+                with RowMaker._get_measure_span(requests, misses, blocks):
+                    measured = requests[misses[0]][0]._measure_blocks(blocks)
+                RowMaker._store(num_rows, misses, measured)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            RowMaker._release(num_rows, claims, error)
+
+        # Wait for the strings that other callers are measuring.
+        for i, future in awaited:
+            num_rows[i] = future.result()
+        return num_rows
+
+    @staticmethod
+    async def get_num_rows_of_many_async(requests: List[Tuple["RowMaker", str]]) -> List[int]:
+        """
+        Returns the number of rows of many TeX strings (see `RowMaker.get_num_rows_of_many()`).
+        xelatex runs in an asynchronous subprocess.
+
+        :param requests: A list of (row maker, TeX string).
+        """
+
+        num_rows, misses, claims, awaited = RowMaker._look_up(requests)
+        error = None
+        try:
+            if len(misses) > 0:
+                rowmaker = requests[misses[0]][0]
+                blocks = [requests[i][0].get_block(requests[i][1]) for i in misses]
+                with RowMaker._get_measure_span(requests, misses, blocks):
+                    measured = await RowMaker.measure_blocks_async(rowmaker.writer, blocks, rowmaker.server,
+                                                                   rowmaker.read_log)
+                RowMaker._store(num_rows, misses, measured)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            RowMaker._release(num_rows, claims, error)
+
+        # Wait for the strings that other callers are measuring, without blocking the event loop.
+        for i, future in awaited:
+            num_rows[i] = await wrap_future(future)
+        return num_rows
+
+    def _get_word_rows_span(self, end_index: int):
+        """
+        Returns an instrumentation span of a measurement of the row of each word (see `Instrumentation.span()`).
+
+        :param end_index: The number of words.
+        """
+
+        if Instrumentation.current is None:
+            return Instrumentation.span("measure", "measure")
+        return Instrumentation.span("measure", "measure", caller="word_rows", configs=[self.width + "/" + self.target],
+                                    words=end_index)
+
+    @staticmethod
+    def _get_measure_span(requests: List[Tuple["RowMaker", str]], misses: List[int], blocks: List[str]):
+        """
+        Returns an instrumentation span of a measurement (see `Instrumentation.span()`).
+
+        :param requests: A list of (row maker, TeX string).
+        :param misses: The indices of the cache misses.
+        :param blocks: The paracol blocks that will be measured.
+        """
+
+        if Instrumentation.current is None:
+            return Instrumentation.span("measure", "measure")
+        return Instrumentation.span("measure", "measure", caller="rows",
+                                    configs=sorted(set([requests[i][0].width + "/" + requests[i][0].target
+                                                        for i in misses])),
+                                    blocks=len(blocks), cached=len(requests) - len(misses),
+                                    tex_size=sum([len(block) for block in blocks]))
+
+    @staticmethod
+    def _look_up(requests: List[Tuple["RowMaker", str]]) \
+            -> Tuple[List[Optional[int]], List[int], List[Tuple[RowCache, Dict[str, List[int]]]],
+                     List[Tuple[int, Future]]]:
+        """
+        Claim the cache key of each request in its row maker's cache (see `RowCache.claim()`). Returns:
+
+        1. The number of rows of each request (None if it isn't cached yet).
+        2. The indices of the requests that this caller must measure.
+        3. Each cache, and the indices of each key that this caller claimed. They must be released.
+        4. The indices of the requests that another caller is measuring, and a future of each number of rows.
+
+        :param requests: A list of (row maker, TeX string).
+        """
+
+        num_rows: List[Optional[int]] = [None] * len(requests)
+        misses = []
+        # Key = The ID of a cache. Value = (The cache, the indices of each cache key).
+        keys: Dict[int, Tuple[RowCache, Dict[str, List[int]]]] = dict()
+        for i, (rowmaker, tex) in enumerate(requests):
+            if rowmaker.cache is None:
+                misses.append(i)
+            else:
+                indices = keys.setdefault(id(rowmaker.cache), (rowmaker.cache, dict()))[1]
+                indices.setdefault(rowmaker._get_cache_key(tex), []).append(i)
+
+        claims = []
+        awaited = []
+        for cache, indices in keys.values():
+            hits, owned, pending = cache.claim(list(indices.keys()))
+            claims.append((cache, {key: indices[key] for key in owned}))
+            for key in hits:
+                for i in indices[key]:
+                    num_rows[i] = hits[key]
+            for key in owned:
+                misses.extend(indices[key])
+            for key in pending:
+                awaited.extend([(i, pending[key]) for i in indices[key]])
+        misses.sort()
+        return num_rows, misses, claims, awaited
+
+    @staticmethod
+    def _store(num_rows: List[Optional[int]], misses: List[int], measured: List[int]) -> None:
+        """
+        Fill in the measured number of rows of each cache miss.
+
+        :param num_rows: The number of rows of each request. Cache misses are None.
+        :param misses: The indices of the cache misses.
+        :param measured: The measured number of rows of each cache miss.
+        """
+
+        for i, n in zip(misses, measured):
+            num_rows[i] = n
+
+    @staticmethod
+    def _release(num_rows: List[Optional[int]], claims: List[Tuple[RowCache, Dict[str, List[int]]]],
+                 error: Optional[BaseException]) -> None:
+        """
+        Cache the number of rows of each claimed key, and wake up the other callers that are waiting for them
+        (see `RowCache.release()`). Claimed keys that weren't measured fail.
+
+        :param num_rows: The number of rows of each request. Requests that weren't measured are None.
+        :param claims: Each cache, and the indices of each key that was claimed.
+        :param error: The reason that the keys weren't measured, if any.
+        """
+
+        for cache, indices in claims:
+            cache.release(list(indices.keys()),
+                          {key: num_rows[indices[key][0]] for key in indices if num_rows[indices[key][0]] is not None},
+                          error)
+
+    def get_block(self, tex: str) -> str:
+        """
+        Returns a paracol block that typesets the TeX string in the target column and reports its number of rows.
+
+        :param tex: The TeX string.
+        """
+
+        # The paragraph reports its own number of rows.
+        tex = r"\internallinenumbers \begin{linenumbers}" + tex + self.writer.typesetter.report_rows + \
+              r"\end{linenumbers} \resetlinenumber[1]"
+        return self.paracol + self.switch + " " + tex + "\n\n\\end{paracol}"
+
+    def _get_cache_key(self, tex: str) -> str:
+        """
+        Returns the cache key of a TeX string.
+
+        :param tex: The TeX string.
+        """
+
+        return RowCache.get_key(self.writer.preamble, self.paracol, self.switch, tex)
+
+    def _measure_blocks(self, blocks: List[str]) -> List[int]:
+        """
+        Typeset paracol blocks (see `self.get_block()`) with my writer or server and return the number of rows of each.
+
+        :param blocks: The paracol blocks.
+        """
+
+        return RowMaker.measure_blocks(self.writer, blocks, self.server, self.read_log)
+
+    @staticmethod
+    def measure_blocks(writer: PDFWriter, blocks: List[str], server: Optional[MeasurementServer] = None,
+                       read_log=True) -> List[int]:
+        """
+        Typeset paracol blocks and return the number of rows of each.
+        If there is more than one block, they are typeset in one document, each on its own page.
+        Each block must report its number of rows (see `Typesetter.report_rows`).
+
+        :param writer: The PDF writer.
+        :param blocks: The paracol blocks.
+        :param server: If not None, measure rows with this long-lived xelatex process instead of the writer.
+        :param read_log: If true, read the number of rows from the xelatex log instead of the PDF.
+        """
+
+        # Measure the rows with the server.
+        if server is not None:
+            return [server.get_num_rows(block) for block in blocks]
+
+        # Typeset the text in a unique job in the scratch directory. The job's files are deleted afterwards.
+        with Scratch.job("line_count") as (directory, jobname):
+            # Read the number of rows from the log.
+            if read_log:
+                writer.write("\n\n\\clearpage\n\n".join(blocks), jobname, pdf=False, directory=directory)
+                num_rows = LogReader.get_all_num_rows(str(Path(directory).joinpath(jobname + ".log")))
+                if len(num_rows) == len(blocks):
+                    return num_rows
+
+            # Fall back to reading the line numbers in the PDF, one block at a time.
+            num_rows = []
+            for block in blocks:
+                writer.write(block, jobname, directory=directory)
+                num_rows.append(PDFReader.get_num_rows(str(Path(directory).joinpath(jobname + ".pdf"))))
+            return num_rows
+
+    @staticmethod
+    async def measure_blocks_async(writer: PDFWriter, blocks: List[str], server: Optional[MeasurementServer] = None,
+                                   read_log=True) -> List[int]:
+        """
+        Typeset paracol blocks and return the number of rows of each (see `RowMaker.measure_blocks()`).
+        xelatex runs in an asynchronous subprocess. A measurement server runs in the event loop's default executor.
+
+        :param writer: The PDF writer.
+        :param blocks: The paracol blocks.
+        :param server: If not None, measure rows with this long-lived xelatex process instead of the writer.
+        :param read_log: If true, read the number of rows from the xelatex log instead of the PDF.
+        """
+
+        loop = get_event_loop()
+
+        # Measure the rows with the server.
+        if server is not None:
+            return [await loop.run_in_executor(None, server.get_num_rows, block) for block in blocks]
+
+        with Scratch.job("line_count") as (directory, jobname):
+            if read_log:
+                await writer.write_async("\n\n\\clearpage\n\n".join(blocks), jobname, pdf=False, directory=directory)
+                num_rows = LogReader.get_all_num_rows(str(Path(directory).joinpath(jobname + ".log")))
+                if len(num_rows) == len(blocks):
+                    return num_rows
+
+            num_rows = []
+            for block in blocks:
+                await writer.write_async(block, jobname, directory=directory)
+                num_rows.append(await loop.run_in_executor(None, PDFReader.get_num_rows,
+                                                           str(Path(directory).joinpath(jobname + ".pdf"))))
+            return num_rows
@@ -0,0 +1,134 @@
+from contextlib import contextmanager
+from itertools import count
+from multiprocessing import util
+from os import environ, getpid
+from pathlib import Path
+from shutil import rmtree
+from threading import Lock
+from typing import Optional
+import atexit
+from talmudifier.util import output_directory
+
+
+class Scratch:
+    """
+    Per-process scratch directories for measurement files.
+    Every measurement gets a unique job name, so many threads and processes can measure at the same time.
+
+    The root directory is, in order of priority:
+    The path set with `Scratch.set_root()`, the environment variable `TALMUDIFIER_SCRATCH`, or `Output/scratch`.
+    Point it at a tmpfs (e.g. `/dev/shm/talmudifier`) to keep measurements off the disk.
+    """
+
+    ENVIRONMENT_VARIABLE = "TALMUDIFIER_SCRATCH"
+
+    _root: Optional[str] = None
+    _counter = count()
+    _lock = Lock()
+    _directories = set()
+
+    @staticmethod
+    def set_root(path: Optional[str]) -> None:
+        """
+        Set the root scratch directory. If None, use the environment variable or the default directory.
+
+        :param path: The path to the root directory.
+        """
+
+        Scratch._root = path
+
+    @staticmethod
+    def get_root() -> Path:
+        """
+        Returns the root scratch directory.
+        """
+
+        if Scratch._root is not None:
+            return Path(Scratch._root)
+        if Scratch.ENVIRONMENT_VARIABLE in environ and environ[Scratch.ENVIRONMENT_VARIABLE] != "":
+            return Path(environ[Scratch.ENVIRONMENT_VARIABLE])
+        return Path(output_directory).joinpath("scratch")
+
+    @staticmethod
+    def get_directory() -> Path:
+        """
+        Returns this process's scratch directory. It is created if needed and removed when the process exits.
+        Worker processes don't call `atexit` functions, so the directory is also removed by a multiprocessing
+        finalizer, which a worker calls when its pool is closed and joined. If the pool is terminated instead,
+        the parent process removes the directory with `Scratch.remove_directory()`.
+        """
+
+        directory = Scratch.get_root().joinpath(f"worker-{getpid()}").resolve()
+        with Scratch._lock:
+            if directory not in Scratch._directories:
+                directory.mkdir(parents=True, exist_ok=True)
+                if len(Scratch._directories) == 0:
+                    atexit.register(Scratch._remove_directories)
+                    util.Finalize(None, Scratch._remove_directories, exitpriority=0)
+                Scratch._directories.add(directory)
+        return directory
+
+    @staticmethod
+    def get_jobname(prefix: str) -> str:
+        """
+        Returns a job name that is unique within this process.
+
+        :param prefix: The prefix of the job name, e.g. "line_count"
+        """
+
+        with Scratch._lock:
+            return f"{prefix}_{next(Scratch._counter)}"
+
+    @staticmethod
+    @contextmanager
+    def job(prefix: str):
+        """
+        A context manager that yields a scratch directory and a unique job name.
+        On exit, all of the job's files are deleted.
+
+        :param prefix: The prefix of the job name, e.g. "line_count"
+        """
+
+        directory = Scratch.get_directory()
+        jobname = Scratch.get_jobname(prefix)
+        try:
+            yield str(directory), jobname
+        finally:
+            Scratch.remove(str(directory), jobname)
+
+    @staticmethod
+    def remove(directory: str, jobname: str) -> None:
+        """
+        Delete all of a job's files (.tex, .log, .aux, .xdv, .pdf, etc.)
+
+        :param directory: The directory.
+        :param jobname: The job name.
+        """
+
+        for f in Path(directory).glob(jobname + ".*"):
+            try:
+                f.unlink()
+            except OSError:
+                pass
+
+    @staticmethod
+    def remove_directory(pid: int) -> None:
+        """
+        Remove another process's scratch directory. A terminated worker process can't remove its own.
+
+        :param pid: The process ID.
+        """
+
+        rmtree(str(Scratch.get_root().joinpath(f"worker-{pid}")), ignore_errors=True)
+
+    @staticmethod
+    def _remove_directories() -> None:
+        """
+        Remove this process's scratch directories. A forked process doesn't remove its parent's directories.
+        """
+
+        with Scratch._lock:
+            for directory in Scratch._directories:
+                if directory.name == f"worker-{getpid()}":
+                    rmtree(str(directory), ignore_errors=True)
+            Scratch._directories.clear()
@@ -0,0 +1,310 @@
+from pathlib import Path
+from struct import unpack_from
+from typing import Dict, List, Optional, Tuple
+import re
+from talmudifier.word import Word
+
+
+class FontMetrics:
+    """
+    The glyph advance widths of a TrueType or OpenType font, read directly from the font file.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: The path to the .ttf or .otf file.
+        """
+
+        assert Path(path).exists(), f"Font not found: {path}"
+        data = Path(path).read_bytes()
+
+        # Read the table directory.
+        tables: Dict[str, Tuple[int, int]] = dict()
+        num_tables = unpack_from(">H", data, 4)[0]
+        for i in range(num_tables):
+            tag, _, offset, length = unpack_from(">4sIII", data, 12 + i * 16)
+            tables[tag.decode("latin-1")] = (offset, length)
+        for tag in ["head", "hhea", "hmtx", "cmap"]:
+            assert tag in tables, f"Font {path} doesn't have a {tag} table."
+
+        self.units_per_em = unpack_from(">H", data, tables["head"][0] + 18)[0]
+
+        # Read the advance widths.
+        num_h_metrics = unpack_from(">H", data, tables["hhea"][0] + 34)[0]
+        hmtx = tables["hmtx"][0]
+        self.advances: List[int] = [unpack_from(">H", data, hmtx + i * 4)[0] for i in range(num_h_metrics)]
+
+        self.cmap = FontMetrics._read_cmap(data, tables["cmap"][0])
+
+        # Use the width of a zero for characters that aren't in the font.
+        self.default_advance = self._get_advance("0") if ord("0") in self.cmap else self.units_per_em // 2
+        self.space = self._get_advance(" ") if ord(" ") in self.cmap else self.units_per_em // 4
+
+        self._widths: Dict[str, int] = dict()
+
+    @staticmethod
+    def _read_cmap(data: bytes, offset: int) -> Dict[int, int]:
+        """
+        Returns a dictionary of Unicode code points to glyph indices.
+
+        :param data: The font file.
+        :param offset: The offset of the cmap table.
+        """
+
+        # Prefer the full Unicode subtable (format 12), then the BMP subtable (format 4).
+        subtables = dict()
+        num_subtables = unpack_from(">H", data, offset + 2)[0]
+        for i in range(num_subtables):
+            platform, encoding, sub_offset = unpack_from(">HHI", data, offset + 4 + i * 8)
+            subtable = offset + sub_offset
+            fmt = unpack_from(">H", data, subtable)[0]
+            if platform in [0, 3] and fmt in [4, 12]:
+                subtables[fmt] = subtable
+
+        cmap: Dict[int, int] = dict()
+        if 12 in subtables:
+            subtable = subtables[12]
+            num_groups = unpack_from(">I", data, subtable + 12)[0]
+            for i in range(num_groups):
+                start, end, glyph = unpack_from(">III", data, subtable + 16 + i * 12)
+                for c in range(start, end + 1):
+                    cmap[c] = glyph + c - start
+        elif 4 in subtables:
+            subtable = subtables[4]
+            seg_count = unpack_from(">H", data, subtable + 6)[0] // 2
+            end_codes = subtable + 14
+            start_codes = end_codes + seg_count * 2 + 2
+            id_deltas = start_codes + seg_count * 2
+            id_range_offsets = id_deltas + seg_count * 2
+            for i in range(seg_count):
+                end = unpack_from(">H", data, end_codes + i * 2)[0]
+                start = unpack_from(">H", data, start_codes + i * 2)[0]
+                delta = unpack_from(">h", data, id_deltas + i * 2)[0]
+                range_offset = unpack_from(">H", data, id_range_offsets + i * 2)[0]
+                for c in range(start, min(end, 0xFFFE) + 1):
+                    if range_offset == 0:
+                        glyph = (c + delta) & 0xFFFF
+                    else:
+                        glyph_address = id_range_offsets + i * 2 + range_offset + (c - start) * 2
+                        glyph = unpack_from(">H", data, glyph_address)[0]
+                        if glyph != 0:
+                            glyph = (glyph + delta) & 0xFFFF
+                    if glyph != 0:
+                        cmap[c] = glyph
+        return cmap
+
+    def _get_advance(self, c: str) -> int:
+        """
+        Returns the advance width of a character in font units.
+
+        :param c: The character.
+        """
+
+        glyph = self.cmap.get(ord(c))
+        if glyph is None:
+            return self.default_advance
+        return self.advances[min(glyph, len(self.advances) - 1)]
+
+    def get_width(self, text: str, size: float) -> float:
+        """
+        Returns the width of a string in points. Kerning is ignored.
+
+        :param text: The string.
+        :param size: The font size in points.
+        """
+
+        if text not in self._widths:
+            self._widths[text] = sum([self._get_advance(c) for c in text])
+        return self._widths[text] * size / self.units_per_em
+
+    def get_space(self, size: float) -> float:
+        """
+        Returns the width of the interword space in points.
+
+        :param size: The font size in points.
+        """
+
+        return self.space * size / self.units_per_em
+
+
+class Simulator:
+    """
+    Predict the number of rows of a column without running TeX.
+    Glyph widths are read from the recipe's fonts, column widths from the paracol header and the preamble,
+    and lines are broken with a Knuth-Plass-style total-fit line breaker.
+
+    This is an estimate: TeX's own hyphenation and kerning aren't simulated. Always confirm the result with xelatex.
+    """
+
+    # Lengths in points.
+    UNITS = {"pt": 1, "in": 72.27, "cm": 28.4528, "mm": 2.84528, "bp": 1.00375}
+    # Paper widths in points.
+    PAPER_WIDTHS = {"letterpaper": 8.5 * 72.27, "a4paper": 210 * 2.84528, "legalpaper": 8.5 * 72.27}
+    # Remove marginal notes (they don't take up any space in the column) and then TeX commands and braces.
+    MARGINNOTE = re.compile(r"\\marginnote\{(?:[^{}]|\{[^{}]*\})*\}")
+    COMMAND = re.compile(r"\\[a-zA-Z]+\*?|[{}]")
+    # TeX's \linepenalty.
+    LINE_PENALTY = 10
+
+    def __init__(self, recipe: dict, preamble: str):
+        """
+        :param recipe: The recipe dictionary.
+        :param preamble: The preamble text (see header.txt).
+        """
+
+        self.recipe = recipe
+
+        # The default font size.
+        match = re.search(r"\\documentclass\[.*?(\d+)pt", preamble)
+        self.default_font_size = float(match.group(1)) if match is not None else 10
+
+        # Get the width of the text block.
+        paper_width = Simulator.PAPER_WIDTHS["letterpaper"]
+        for paper in Simulator.PAPER_WIDTHS:
+            if paper in preamble:
+                paper_width = Simulator.PAPER_WIDTHS[paper]
+                break
+        self.text_width = paper_width
+        for key, default in [("left", "1in"), ("right", "1in"), ("bindingoffset", "0in")]:
+            match = re.search(r"[\[,\s]" + key + r"\s*=\s*([\d.]+\s*[a-z]+)", preamble)
+            self.text_width -= self._get_length(match.group(1) if match is not None else default)
+
+        match = re.search(r"\\setlength\{?\\columnsep\}?\{([\d.]+\s*[a-z]+)\}", preamble)
+        self.column_sep = self._get_length(match.group(1) if match is not None else "10pt")
+
+        # sloppypar.
+        self.tolerance = 9999
+        self.emergency_stretch = self._get_length("3em")
+
+        self._fonts: Dict[str, FontMetrics] = dict()
+
+    def _get_length(self, length: str) -> float:
+        """
+        Returns a TeX length in points.
+
+        :param length: The length, e.g. "1.25em"
+        """
+
+        match = re.match(r"([\d.]+)\s*([a-z]+)", length.strip())
+        assert match is not None, f"Invalid length: {length}"
+        value = float(match.group(1))
+        unit = match.group(2)
+        if unit == "em":
+            return value * self.default_font_size
+        assert unit in Simulator.UNITS, f"Unsupported unit: {unit}"
+        return value * Simulator.UNITS[unit]
+
+    def get_column_width(self, paracol: str, target_index: int) -> float:
+        """
+        Returns the width of a column in points.
+
+        :param paracol: The paracol header (see `Paracol.get_paracol_header()`).
+        :param target_index: The index of the column in the paracol environment.
+        """
+
+        num_columns = int(re.search(r"\\begin\{paracol\}\{(\d+)\}", paracol).group(1))
+        match = re.search(r"\\columnratio\{([^}]*)\}", paracol)
+        ratios = [float(r) for r in match.group(1).split(",")] if match is not None else []
+
+        # Columns without a ratio share what's left.
+        if len(ratios) < num_columns:
+            remainder = max(1 - sum(ratios), 0) / (num_columns - len(ratios))
+            ratios += [remainder] * (num_columns - len(ratios))
+        return ratios[target_index] * (self.text_width - (num_columns - 1) * self.column_sep)
+
+    def _get_font(self, column_name: str, word: Word) -> FontMetrics:
+        """
+        Returns the font metrics of the word's style in a column.
+
+        :param column_name: The name of the column.
+        :param word: The word.
+        """
+
+        font_data = self.recipe["fonts"][column_name]
+        key = "regular_font"
+        if word.style.bold and word.style.italic and "bold_italic_font" in font_data:
+            key = "bold_italic_font"
+        elif word.style.bold and "bold_font" in font_data:
+            key = "bold_font"
+        elif word.style.italic and "italic_font" in font_data:
+            key = "italic_font"
+        path = str(Path(font_data["path"]).joinpath(font_data[key]))
+        if path not in self._fonts:
+            self._fonts[path] = FontMetrics(path)
+        return self._fonts[path]
+
+    def get_num_rows(self, words: List[Word], column_name: str, line_width: float, font_size: float) -> int:
+        """
+        Returns the predicted number of rows of a list of words.
+
+        :param words: The words.
+        :param column_name: The name of the column (left, center, right). Used to find the fonts.
+        :param line_width: The width of the column in points.
+        :param font_size: The font size in points. If this is -1, the preamble's default font size is used.
+        """
+
+        if font_size <= 0:
+            font_size = self.default_font_size
+
+        widths: List[float] = []
+        space = 0
+        for word in words:
+            font = self._get_font(column_name, word)
+            text = Simulator.COMMAND.sub("", Simulator.MARGINNOTE.sub("", word.word))
+            widths.append(font.get_width(text, font_size))
+            space = font.get_space(font_size)
+        if len(widths) == 0:
+            return 1
+
+        # Try to break lines within the tolerance, then with emergency stretch, then with any badness.
+        for emergency_stretch, tolerance in [(0, self.tolerance),
+                                             (self.emergency_stretch, self.tolerance),
+                                             (self.emergency_stretch, None)]:
+            num_rows = self._break_lines(widths, space, line_width, emergency_stretch, tolerance)
+            if num_rows is not None:
+                return num_rows
+        raise Exception("Failed to break lines.")
+
+    @staticmethod
+    def _break_lines(widths: List[float], space: float, line_width: float, emergency_stretch: float,
+                     tolerance: Optional[int]) -> Optional[int]:
+        """
+        Break a paragraph into lines with the fewest total demerits. Every line, including the last, is justified
+        (the preamble sets \\parfillskip to 0pt). Returns the number of lines, or None if there's no solution.
+
+        :param widths: The width of each word.
+        :param space: The width of an interword space.
+        :param line_width: The width of a line.
+        :param emergency_stretch: Extra stretchability added to each line.
+        :param tolerance: The maximum badness of a line. If None, any badness is allowed.
+        """
+
+        # OpenType fonts in XeTeX: the interword space stretches by 1/2 and shrinks by 1/3.
+        stretch = space / 2
+        shrink = space / 3
+
+        # The best (demerits, number of lines) of a paragraph that ends before word j.
+        best: List[Optional[Tuple[float, int]]] = [None] * (len(widths) + 1)
+        best[0] = (0, 0)
+        for j in range(1, len(widths) + 1):
+            natural = 0
+            for i in range(j - 1, -1, -1):
+                natural += widths[i] + (space if i < j - 1 else 0)
+                num_spaces = j - 1 - i
+                shortfall = line_width - natural
+                # An overfull line. Longer lines are even more overfull.
+                if shortfall < -shrink * num_spaces:
+                    if i < j - 1:
+                        break
+                    badness = 10000
+                elif shortfall < 0:
+                    badness = 100 * (-shortfall / (shrink * num_spaces)) ** 3
+                else:
+                    total_stretch = stretch * num_spaces + emergency_stretch
+                    badness = 10000 if total_stretch == 0 else min(100 * (shortfall / total_stretch) ** 3, 10000)
+                if best[i] is None or (tolerance is not None and badness > tolerance):
+                    continue
+                demerits = best[i][0] + (Simulator.LINE_PENALTY + badness) ** 2
+                if best[j] is None or demerits < best[j][0]:
+                    best[j] = (demerits, best[i][1] + 1)
+        return best[-1][1] if best[-1] is not None else None
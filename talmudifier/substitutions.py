@@ -0,0 +1,31 @@
+from typing import Dict
+import json
+import re
+
+
+class Substitutions:
+    """
+    The substitutions of a column (see default.json): regular expressions and their replacements.
+    The regular expressions are compiled once.
+    """
+
+    def __init__(self, data: Dict[str, str]):
+        """
+        :param data: The substitutions dictionary. Key = A regular expression. Value = The replacement.
+        """
+
+        self.data = data
+        self.patterns = [(re.compile(key), data[key]) for key in data]
+        # A string that identifies these substitutions (see `HyphenationCache`).
+        self.key = json.dumps(list(data.items()))
+
+    def apply_to(self, word: str) -> str:
+        """
+        Returns the word with the substitutions applied.
+
+        :param word: The word.
+        """
+
+        for pattern, replacement in self.patterns:
+            word = pattern.sub(replacement, word).replace("&", " ")
+        return word
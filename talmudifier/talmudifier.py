@@ -1,17 +1,16 @@
-from pathlib import Path
-from typing import List
-from json import load
+from typing import Dict, Generator, Iterable, List, TextIO, Tuple, Union
 from talmudifier.column import Column
-from talmudifier.util import to_camelcase
-import io
 from typing import Optional
-from talmudifier.pdf_writer import PDFWriter
-from talmudifier.citation import Citation
 from talmudifier.word import Word
-from talmudifier.style import Style
+from talmudifier.tokenizer import Tokenizer
 from talmudifier.row_maker import RowMaker
 from talmudifier.paracol import Paracol
-import pkg_resources
+from talmudifier.row_cache import RowCache
+from talmudifier.page_cache import PageCache
+from talmudifier.row_length_estimator import RowLengthEstimator
+from talmudifier.compiled_recipe import CompiledRecipe
+from talmudifier.instrumentation import Instrumentation
+from talmudifier.tex_file import TexFile
 
 
 class Talmudifier:
@@ -19,194 +18,86 @@ class Talmudifier:
     Generate Talmud-esque page layouts, given markdown plaintext and a recipe JSON file.
     """
 
-    def __init__(self, text_left: str, text_center: str, text_right: str, recipe_filename="default.json"):
+    # In capped mode, the first prefix of each column fills about this many rows (see `self._get_capped_num_rows()`).
+    CAPPED_ROWS = 8
+
+    def __init__(self, text_left: Union[str, TextIO, Iterable[str]], text_center: Union[str, TextIO, Iterable[str]],
+                 text_right: Union[str, TextIO, Iterable[str]], recipe_filename="default.json",
+                 use_server=False, cache: Optional[RowCache] = None, simulate=False, batch_size=1,
+                 label_words=False, estimator: Optional[RowLengthEstimator] = None, engine="xelatex", capped=False,
+                 page_cache: Optional[PageCache] = None, compiled_recipe: Optional[CompiledRecipe] = None):
         """
-        :param text_left: The markdown text of the left column.
-        :param text_center: The markdown text of the center column.
-        :param text_right: The markdown text of the right column.
+        :param text_left: The markdown text of the left column: A string, a file, or an iterable of strings.
+        :param text_center: The markdown text of the center column: A string, a file, or an iterable of strings.
+        :param text_right: The markdown text of the right column: A string, a file, or an iterable of strings.
         :param recipe_filename: The filename of the recipe, located in recipes/
+        :param use_server: If true, measure rows with a long-lived xelatex process that loads the preamble only once.
+        :param cache: If not None, cache row counts here. The same cache can be shared by many Talmudifier objects.
+        :param simulate: If true, predict row breaks with font metrics and confirm them with xelatex.
+        :param batch_size: The number of candidates that a row maker measures in one compile at each step of its search.
+        :param label_words: If true, find the row of every word of a column in one compile and cut the column there.
+        :param estimator: If not None, learn the expected length of each block from the row breaks of earlier blocks.
+                          The same estimator can be shared by many Talmudifier objects.
+        :param engine: The TeX engine: "xelatex" or "lualatex" (see `Typesetter`).
+        :param capped: If true, find the shortest column by measuring only the first rows of each column.
+        :param page_cache: If not None, cache whole pages here. Only pages whose columns are strings are cached.
+        :param compiled_recipe: If not None, use this compiled recipe, and ignore all of the above recipe parameters.
+                                One compiled recipe can be shared by any number of pages.
         """
 
-        # Read the recipe.
-        recipe_path = Path(f"recipes/{recipe_filename}")
-        if not recipe_path.exists():
-            print(f"Couldn't find recipe: {recipe_filename}; using default.json instead.")
-        with io.open(str(recipe_path.resolve()), "rt", encoding="utf-8") as f:
-            self.recipe = load(f)
-
-        header_file = pkg_resources.resource_filename(__name__, "header.txt")
-
-        # Read the preamble.
-        assert Path(header_file).exists()
-        with io.open(header_file, "rt", encoding="utf-8") as f:
-            self.preamble = f.read()
-
-        # Append font declarations.
-        for col_name in ["left", "center", "right"]:
-            self.preamble += "\n" + self._get_font_declaration(col_name)
-
-            # Append a citation font declaration, if any.
-            citation_declaration = self._get_citation_font_declaration(col_name)
-            if citation_declaration is not None:
-                self.preamble += "\n" + citation_declaration
-
-        # Append color declarations.
-        if "colors" in self.recipe:
-            for color in self.recipe["colors"]:
-                self.preamble += "\n\\definecolor{" + color + "}{HTML}{" + self.recipe["colors"][color] + "}"
-
-        # Append the chapter command.
-        assert "chapter" in self.recipe, "Chapter not found in recipe."
-        assert "definition" in self.recipe["chapter"], "Chapter definition not found."
-        self.preamble += "\n" + self.recipe["chapter"]["definition"]
-
-        # Append additional definitions.
-        if "misc_definitions" in self.recipe:
-            for d in self.recipe["misc_definitions"]:
-                self.preamble += "\n" + d
-
-        # Create the PDF writer.
-        self.writer = PDFWriter(self.preamble)
+        if compiled_recipe is None:
+            compiled_recipe = CompiledRecipe(recipe_filename=recipe_filename, use_server=use_server, cache=cache,
+                                             simulate=simulate, batch_size=batch_size, label_words=label_words,
+                                             estimator=estimator, engine=engine, capped=capped,
+                                             page_cache=page_cache)
+            self._owns_compiled_recipe = True
+        else:
+            self._owns_compiled_recipe = False
+        self.compiled_recipe = compiled_recipe
+
+        self.recipe = self.compiled_recipe.recipe
+        self.preamble = self.compiled_recipe.preamble
+        self.writer = self.compiled_recipe.writer
+        self.server = self.compiled_recipe.server
+        self.cache = self.compiled_recipe.cache
+        self.simulator = self.compiled_recipe.simulator
+        self.batch_size = self.compiled_recipe.batch_size
+        self.label_words = self.compiled_recipe.label_words
+        self.estimator = self.compiled_recipe.estimator
+        self.capped = self.compiled_recipe.capped
+        self.page_cache = self.compiled_recipe.page_cache
+        # The page cache key. Files and iterables of strings aren't read ahead of time, so they aren't cached.
+        if self.page_cache is not None and all([isinstance(t, str) for t in [text_left, text_center, text_right]]):
+            self._page_key: Optional[str] = self.compiled_recipe.get_page_key(text_left, text_center, text_right)
+        else:
+            self._page_key = None
 
         self.left = self._get_column(text_left, "left")
         self.center = self._get_column(text_center, "center")
         self.right = self._get_column(text_right, "right")
 
-    def _get_font_declaration(self, column_name: str) -> str:
-        """
-        Returns the font declaration in the recipe associated with the column.
-
-        :param column_name: The name of the column (left, center, right).
-        """
-
-        # Check that all required keys are present.
-        assert "fonts" in self.recipe, "No fonts found in recipe!"
-        assert column_name in self.recipe["fonts"], f"No fonts found for: {column_name}"
-        font_data = self.recipe["fonts"][column_name]
-        for required_key in ["path", "ligatures", "regular_font"]:
-            assert required_key in font_data, f"Required key in {column_name} not found: {required_key}"
-
-        # Append a / to the path if needed.
-        path = font_data['path']
-        if not path.endswith("/"):
-            path += "/"
-
-        declaration = f"\\newfontfamily\\{column_name}font[Path={path}, Ligatures={font_data['ligatures']}"
-
-        # Add styles to the declaration.
-        for style_key in ["italic_font", "bold_font", "bold_italic_font"]:
-            if style_key in font_data:
-                declaration += f", {to_camelcase(style_key)}={font_data[style_key]}"
-
-        # Finish the declaration and add the regular font.
-        declaration += "]{" + font_data["regular_font"] + "}"
-        return declaration
-
-    def _get_citation_font_declaration(self, column_name: str) -> Optional[str]:
-        """
-        Returns the font declaration for a citation. May be none.
-
-        :param column_name: The name of the column associated with the citation.
-        """
-
-        # Check that all required keys are present.
-        assert "fonts" in self.recipe, "No fonts found in recipe!"
-        assert column_name in self.recipe["fonts"], f"No fonts found for: {column_name}"
-        font_data = self.recipe["fonts"][column_name]
-
-        # Check if there is a citation.
-        if "citation" not in font_data:
-            return None
-
-        citation_data = font_data["citation"]
-        for required_key in ["path", "font", "font_command", "pattern"]:
-            assert required_key in citation_data, f"Required key in citation {column_name} not found: {required_key}"
-
-        # Append a / to the path if needed.
-        path = citation_data['path']
-        if not path.endswith("/"):
-            path += "/"
+        # The number of rows of each column that has been measured. Key = The name of the column.
+        # Value = (The column, which columns had words when it was measured (left, center, right), the number of rows).
+        # A column is only measured again if it changed or if the paracol environment changed.
+        self._row_counts: Dict[str, Tuple[Column, Tuple[bool, bool, bool], int]] = dict()
 
-        return "\\newfontfamily" + citation_data["font_command"] + "[Path=" + path + "]{" + citation_data["font"] + "}"
-
-    def _get_column(self, text: str, column_name: str) -> Column:
+    def _get_column(self, text: Union[str, TextIO, Iterable[str]], column_name: str) -> Column:
         """
-        Returns a column of words and font commands.
+        Returns a column of words and font commands. Words are created when they are needed (see `Column.fill()`).
 
-        :param text: The raw markdown text.
+        :param text: The raw markdown text: A string, a file, or an iterable of strings.
         :param column_name: The name of the column.
         """
 
         # Check that all required keys are present.
-        assert "fonts" in self.recipe, "No fonts found in recipe!"
-        assert column_name in self.recipe["fonts"], f"No fonts found for: {column_name}"
-        font_data = self.recipe["fonts"][column_name]
+        assert column_name in self.compiled_recipe.font_sizes, f"No fonts found for: {column_name}"
 
-        # Get the font-size command.
-        if "skip" not in font_data or "size" not in font_data:
-            font_size = -1
-            font_skip = -1
-        else:
-            font_size = font_data["size"]
-            font_skip = font_data["skip"]
+        font_size, font_skip = self.compiled_recipe.font_sizes[column_name]
+        citation = self.compiled_recipe.citations[column_name]
+        substitutions = self.compiled_recipe.substitutions[column_name]
 
-        # Get the citation.
-        if "citation" in font_data:
-            citation = Citation(font_data["citation"])
-        else:
-            citation = None
-
-        # Get the substitutions.
-        if "substitutions" in font_data:
-            substitutions = font_data["substitutions"]
-        else:
-            substitutions = None
-
-        word_str = text.split(" ")
-        words = []
-
-        style = Style(False, False, False)
-
-        for w in word_str:
-            if w.startswith("**"):
-                style.bold = True
-            elif w.endswith("**"):
-                style.bold = True
-
-            if w.startswith("_"):
-                style.italic = True
-            elif w.endswith("_"):
-                style.italic = True
-
-            if w.startswith("_**") or w.startswith("**_"):
-                style.bold = True
-                style.italic = True
-            elif w.endswith("_**") or w.endswith("**_"):
-                style.bold = True
-                style.italic = True
-
-            if "<u>" in w:
-                style.underline = True
-            elif "</u>" in w:
-                style.underline = True
-
-            w_str = w.replace("*", "").replace("_", "").replace("<u>", "").replace("</u>", "")
-
-            # Append the new word.
-            words.append(Word(w_str, Style(style.bold, style.italic, style.underline), substitutions, citation))
-
-            # Check if this was one word, e.g. **this** and apply styles again.
-            if w.endswith("**"):
-                style.bold = False
-            if w.endswith("_"):
-                style.italic = False
-            if w.endswith("_**") or w.endswith("**_"):
-                style.bold = False
-                style.italic = False
-            if "</u>" in w:
-                style.underline = False
-
-        return Column(words, "\\" + column_name + "font", font_size, font_skip)
+        words = (Word(w_str, style, substitutions, citation) for w_str, style in Tokenizer(text))
+        return Column([], "\\" + column_name + "font", font_size, font_skip, source=words)
 
     def _get_expected_length(self, column_name: str, width: str, num_rows: int) -> int:
         """
@@ -221,15 +112,17 @@ class Talmudifier:
         assert "fonts" in self.recipe, "No fonts found in recipe!"
         assert column_name in self.recipe["fonts"], f"No fonts found for: {column_name}"
 
-        if "character_counts" not in self.recipe:
-            return -1
-        if width not in self.recipe["character_counts"]:
-            return -1
+        if "character_counts" not in self.recipe or width not in self.recipe["character_counts"] or \
+                column_name not in self.recipe["character_counts"][width]:
+            counts = dict()
+        else:
+            counts = self.recipe["character_counts"][width][column_name]
 
-        if column_name not in self.recipe["character_counts"][width]:
-            return -1
+        # Prefer the lengths learned from earlier blocks.
+        if self.estimator is not None:
+            return self.estimator.get(column_name, width, self.compiled_recipe.font_sizes[column_name][0], num_rows,
+                                      counts)
 
-        counts = self.recipe["character_counts"][width][column_name]
         if str(num_rows) in counts:
             return counts[str(num_rows)]
         else:
@@ -238,7 +131,19 @@ class Talmudifier:
             else:
                 return -1
 
-    def _get_four_rows_left_right(self, column: Column, column_name: str) -> (str, Column):
+    def _get_row_maker(self, left: bool, center: bool, right: bool, target: str) -> RowMaker:
+        """
+        Returns a row maker that uses my writer, measurement server, cache, and simulator.
+
+        :param left: If true, a left column exists.
+        :param center: If true, a center column exists.
+        :param right: If true, a right column exists.
+        :param target: The name of the target column: left, center, or right.
+        """
+
+        return self.compiled_recipe.get_row_maker(left, center, right, target)
+
+    def _get_four_rows_left_right(self, column: Column, column_name: str) -> Generator:
         """
         Build four rows on the left or right.
 
@@ -248,38 +153,17 @@ class Talmudifier:
         """
 
         # Build 4 rows of the left and right columns.
-        rowmaker = RowMaker(True, False, True, column_name, self.writer)
-        return rowmaker.get_text_of_length(column, 4, self._get_expected_length(column_name, "half", 4))
+        rowmaker = self._get_row_maker(True, False, True, column_name)
+        return rowmaker.lay_out(column, 4, self._get_expected_length(column_name, "half", 4))
 
-    def _get_one_row_left_right(self, column: Column, column_name: str) -> (str, Column):
+    def _get_one_row_left_right(self, column: Column, column_name: str) -> Generator:
         # Build 1 row of the left and right columns.
-        rowmaker = RowMaker(True, True, True, column_name, self.writer)
-        return rowmaker.get_text_of_length(column, 1, self._get_expected_length(column_name, "one_third", 1))
+        rowmaker = self._get_row_maker(True, True, True, column_name)
+        return rowmaker.lay_out(column, 1, self._get_expected_length(column_name, "one_third", 1))
 
     def _get_column_width(self, target: str) -> str:
-        if len(self.left.words) > 0:
-            if len(self.center.words) > 0:
-                if len(self.right.words) > 0:
-                    return "one_third"
-                else:
-                    if target == "left":
-                        return "one_third"
-                    else:
-                        return "two_thirds"
-            elif len(self.right.words) > 0:
-                return "half"
-            else:
-                return ""
-        elif len(self.center.words) > 0:
-            if len(self.right.words) > 0:
-                if target == "center":
-                    return "two_thirds"
-                else:
-                    return "one_third"
-            else:
-                return ""
-        else:
-            return ""
+        return Paracol.get_width(not self.left.is_empty(), not self.center.is_empty(), not self.right.is_empty(),
+                                 target)
 
     def _get_column_name(self, col: Column) -> str:
         """
@@ -302,11 +186,29 @@ class Talmudifier:
         Returns a list of columns that have words.
         """
 
-        return [c for c in [self.left, self.center, self.right] if len(c.words) > 0]
+        return [c for c in [self.left, self.center, self.right] if not c.is_empty()]
+
+    def _get_known_num_rows(self, col: Column, column_name: str, paracol: Tuple[bool, bool, bool]) -> int:
+        """
+        Returns the number of rows of a column that was already measured, or -1 if it needs to be measured.
+
+        :param col: The column.
+        :param column_name: The name of the column.
+        :param paracol: Which columns have words: (left, center, right).
+        """
+
+        if column_name not in self._row_counts:
+            return -1
+        known_col, known_paracol, num_rows = self._row_counts[column_name]
+        # The column was consumed (it's a new object) or cleared, or the column widths changed.
+        if known_col is not col or known_paracol != paracol or col.is_empty():
+            return -1
+        return num_rows
 
-    def _get_shortest(self) -> (Column, str, int, bool):
+    def _get_shortest(self) -> Generator:
         """
         Returns which of my columns is the shortest, its name, the number of lines, and whether any has any lines.
+        This is a layout process (see `RowMaker.lay_out()`).
         """
 
         # Check if any columns have any words.
@@ -320,15 +222,28 @@ class Talmudifier:
         min_lines = 10000000
         min_column_name = ""
 
-        for col in cols:
+        paracol = (self.left in cols, self.center in cols, self.right in cols)
+        if self.capped:
+            all_num_lines = yield from self._get_capped_num_rows(cols, paracol)
+        else:
+            # Get the number of lines of every column that changed in one compile.
+            all_num_lines = [self._get_known_num_rows(col, self._get_column_name(col), paracol) for col in cols]
+            requests = []
+            for col, num_lines in zip(cols, all_num_lines):
+                if num_lines >= 0:
+                    continue
+                # Create the row maker.
+                rowmaker = self._get_row_maker(paracol[0], paracol[1], paracol[2], self._get_column_name(col))
+                requests.append((rowmaker, col.get_tex(True)))
+            if len(requests) > 0:
+                measured = iter((yield RowMaker.ROWS, requests, 0))
+                all_num_lines = [num_lines if num_lines >= 0 else next(measured) for num_lines in all_num_lines]
+            for col, num_lines in zip(cols, all_num_lines):
+                self._row_counts[self._get_column_name(col)] = (col, paracol, num_lines)
+
+        for col, num_lines in zip(cols, all_num_lines):
             column_name = self._get_column_name(col)
 
-            # Create the row maker.
-            rowmaker = RowMaker(self.left in cols, self.center in cols, self.right in cols, column_name, self.writer)
-
-            # Get the number of lines.
-            num_lines = rowmaker.get_num_rows(col.get_tex(True))
-
             # Get the number of lines relative to the left column's font size.
             num_lines = int((col.font_size / self.left.font_size) * num_lines)
 
@@ -339,6 +254,88 @@ class Talmudifier:
 
         return min_col, min_column_name, min_lines, True
 
+    def _get_capped_num_rows(self, cols: List[Column], paracol: Tuple[bool, bool, bool]) -> Generator:
+        """
+        Returns the number of rows of each column, but only the shortest column's number is exact.
+        The other numbers are "at least this many rows": enough to tell that the column isn't the shortest.
+        This is a layout process (see `RowMaker.lay_out()`).
+
+        Each column's first prefix is sized from its expected length (see `self._get_capped_prefixes()`).
+        Every prefix is measured in one compile. A prefix that is shorter than its column only gives a lower bound,
+        so while a column might still be the shortest, its prefix doubles and is measured again.
+
+        :param cols: The columns that have words.
+        :param paracol: Which columns have words: (left, center, right).
+        """
+
+        column_names = [self._get_column_name(col) for col in cols]
+        num_words = self._get_capped_prefixes(cols, column_names)
+        num_rows = [self._get_known_num_rows(col, column_name, paracol)
+                    for col, column_name in zip(cols, column_names)]
+        exact = [n >= 0 for n in num_rows]
+        while True:
+            # Measure every prefix that changed in one compile.
+            indices = [i for i in range(len(cols)) if num_rows[i] < 0]
+            if len(indices) > 0:
+                requests = [(self._get_row_maker(paracol[0], paracol[1], paracol[2], column_names[i]),
+                             cols[i].get_prefix_tex(num_words[i])) for i in indices]
+                for i, n in zip(indices, (yield RowMaker.ROWS, requests, 0)):
+                    num_rows[i] = n
+                    # The prefix is the whole column.
+                    if num_words[i] >= cols[i].fill(num_words[i] + 1):
+                        exact[i] = True
+                        self._row_counts[column_names[i]] = (cols[i], paracol, n)
+
+            # Get the number of lines relative to the left column's font size, as in `self._get_shortest()`.
+            num_lines = [int((col.font_size / self.left.font_size) * n) for col, n in zip(cols, num_rows)]
+
+            # Ties go to the first column.
+            exact_indices = [i for i in range(len(cols)) if exact[i]]
+            if len(exact_indices) > 0:
+                shortest = min(exact_indices, key=lambda i: (num_lines[i], i))
+                grow = [i for i in range(len(cols)) if not exact[i] and
+                        (num_lines[i] < num_lines[shortest] or (num_lines[i] == num_lines[shortest] and i < shortest))]
+            else:
+                least = min(num_lines)
+                grow = [i for i in range(len(cols)) if num_lines[i] == least]
+            if len(grow) == 0:
+                return num_rows
+            for i in grow:
+                num_words[i] = cols[i].fill(num_words[i] * 2)
+                num_rows[i] = -1
+
+    def _get_capped_prefixes(self, cols: List[Column], column_names: List[str]) -> List[int]:
+        """
+        Returns the number of words of each column to measure first in capped mode.
+
+        Each prefix is the words that fill the column's expected length of `Talmudifier.CAPPED_ROWS` rows.
+        The number of rows doubles until the words of at least one column run out, so that the column that is
+        probably the shortest is measured whole. If there is no expected length, the whole column is measured.
+
+        :param cols: The columns that have words.
+        :param column_names: The name of each column.
+        """
+
+        num_rows = Talmudifier.CAPPED_ROWS
+        while True:
+            num_words = []
+            for col, column_name in zip(cols, column_names):
+                expected_length = self._get_expected_length(column_name, self._get_column_width(column_name),
+                                                            num_rows)
+                if expected_length <= 0:
+                    num_words.append(col.fill())
+                    continue
+                # Count the characters the same way that `RowMaker._fit()` does.
+                length = 0
+                n = 0
+                while n < col.fill(n + 1) and length <= expected_length:
+                    length += len(col.words[n].word)
+                    n += 1
+                num_words.append(n)
+            if any([n >= col.fill(n + 1) for col, n in zip(cols, num_words)]):
+                return num_words
+            num_rows *= 2
+
     def get_tex(self) -> str:
         """
         Generate the body of text.
@@ -347,98 +344,158 @@ class Talmudifier:
         2. Create 1 row on the left and right (width = one third).
         3. Until the columns are all done: Find the shortest column and add it. Add other columns up to that length.
         """
-        
-        tex = ""
+
+        return RowMaker.run(self.lay_out())
+
+    async def get_tex_async(self) -> str:
+        """
+        Generate the body of text (see `self.get_tex()`). xelatex runs in asynchronous subprocesses,
+        so many pages can be laid out in one event loop.
+        """
+
+        return await RowMaker.run_async(self.lay_out())
+
+    def write_tex(self, tex_file: TexFile) -> None:
+        """
+        Generate the body of text (see `self.get_tex()`) and write each paracol block to a .tex file
+        as soon as it is laid out, instead of returning the body as a string.
+
+        :param tex_file: The .tex file (see `PDFWriter.get_tex_file()`).
+        """
+
+        RowMaker.run(self.lay_out(tex_file))
+
+    def lay_out(self, tex_file: Optional[TexFile] = None) -> Generator:
+        """
+        A layout process that generates the body of text (see `self.get_tex()` and `RowMaker.lay_out()`).
+
+        :param tex_file: If not None, write each paracol block to this file, and return an empty string.
+        """
+
+        if self._page_key is None:
+            with Instrumentation.span("page", "layout"):
+                return (yield from self._lay_out(tex_file))
+
+        # Get the page from the cache, or lay it out and cache it.
+        cached = self.page_cache.get(self._page_key)
+        if cached is not None:
+            tex = cached[0]
+        else:
+            with Instrumentation.span("page", "layout"):
+                tex = yield from self._lay_out(None)
+            self.page_cache.put(self._page_key, tex)
+        if tex_file is None:
+            return tex
+        tex_file.write(tex)
+        return ""
+
+    def _lay_out(self, tex_file: Optional[TexFile]) -> Generator:
+        """
+        The layout process of `self.lay_out()`.
+
+        :param tex_file: If not None, write each paracol block to this file.
+        """
+
+        blocks: List[str] = []
+        add = blocks.append if tex_file is None else tex_file.write
 
         # Get four row on the left and on the right.
-        left_tex, self.left = self._get_four_rows_left_right(self.left, "left")
-        right_tex, self.right = self._get_four_rows_left_right(self.right, "right")
+        with Instrumentation.span("four_rows", "layout"):
+            left_tex, self.left = yield from self._get_four_rows_left_right(self.left, "left")
+            right_tex, self.right = yield from self._get_four_rows_left_right(self.right, "right")
 
         # Add the paracol environment.
-        tex += "\n\\columnratio{0.5,0.5}\\begin{paracol}{2}\n\n" + left_tex + "\\switchcolumn" + right_tex + "\n\n\\end{paracol}\n\n"
+        add("\n\\columnratio{0.5,0.5}\\begin{paracol}{2}\n\n" + left_tex + "\\switchcolumn" + right_tex + "\n\n\\end{paracol}\n\n")
 
         # Get four row on the left and on the right.
-        left_tex, self.left = self._get_one_row_left_right(self.left, "left")
-        right_tex, self.right = self._get_one_row_left_right(self.right, "right")
+        with Instrumentation.span("one_row", "layout"):
+            left_tex, self.left = yield from self._get_one_row_left_right(self.left, "left")
+            right_tex, self.right = yield from self._get_one_row_left_right(self.right, "right")
 
         # Add the paracol environment.
         three_col_begin = r"\columnratio{" + f"{Paracol.ONE_THIRD},{Paracol.ONE_THIRD},{Paracol.ONE_THIRD}" + "}" + r"\begin{paracol}{3}"
-        tex += "\n" + three_col_begin + "\n\n" + left_tex + "\\switchcolumn[2]" + right_tex + "\n\n\\end{paracol}\n\n"
+        add("\n" + three_col_begin + "\n\n" + left_tex + "\\switchcolumn[2]" + right_tex + "\n\n\\end{paracol}\n\n")
         
         done = False
         while not done:
-            shortest_col, shortest_col_name, num_lines, any_lines = self._get_shortest()
-            done = not any_lines
-            if done:
-                continue
+            with Instrumentation.span("iteration", "layout") as span:
+                if Instrumentation.current is not None:
+                    span.set(columns=len(self._get_columns_with_words()))
+                shortest_col, shortest_col_name, num_lines, any_lines = yield from self._get_shortest()
+                span.set(shortest=shortest_col_name, rows=num_lines)
+                done = not any_lines
+                if done:
+                    continue
 
-            # Just fill the page with the last column's words.
-            if num_lines == -1:
-                tex += "\n\n\\columnratio{1}\\begin{paracol}{1}\n\n" + shortest_col.get_tex(True) + "\n\n\\end{paracol}\n\n"
-                done = True
-                continue
+                # Just fill the page with the last column's words.
+                if num_lines == -1:
+                    add("\n\n\\columnratio{1}\\begin{paracol}{1}\n\n" + shortest_col.get_tex(True) + "\n\n\\end{paracol}\n\n")
+                    done = True
+                    continue
 
-            # Start building the table.
-            table = {shortest_col_name: shortest_col.get_tex(True)}
+                # Start building the table.
+                table = {shortest_col_name: shortest_col.get_tex(True)}
 
-            assert self.left == shortest_col or self.center == shortest_col or self.right == shortest_col
+                assert self.left == shortest_col or self.center == shortest_col or self.right == shortest_col
 
-            paracol = Paracol.get_paracol_header(len(self.left.words) > 0, len(self.center.words) > 0, len(self.right.words) > 0)
+                paracol = self.compiled_recipe.get_paracol_header(not self.left.is_empty(), not self.center.is_empty(), not self.right.is_empty())
 
-            # Fill the other columns, if possible.
-            cols = self._get_columns_with_words()
-            has_left = self.left in cols
-            has_center = self.center in cols
-            has_right = self.right in cols
+                # Fill the other columns, if possible.
+                cols = self._get_columns_with_words()
+                has_left = self.left in cols
+                has_center = self.center in cols
+                has_right = self.right in cols
 
-            for i in range(len(cols)):
-                if cols[i] == shortest_col:
-                    continue
-                col_name = self._get_column_name(cols[i])
-
-                # Build the column.
-                rm = RowMaker(has_left, has_center, has_right, col_name, self.writer)
-
-                # Set the target number of lines based on the font size relative to the left column.
-                target_num_lines = int((self.left.font_size / cols[i].font_size) * num_lines + 1)
-
-                col_tex, col = rm.get_text_of_length(cols[i],
-                                                     target_num_lines,
-                                                     self._get_expected_length(col_name,
-                                                                               self._get_column_width(col_name),
-                                                                               target_num_lines))
-
-                # Update the table.
-                table.update({col_name: col_tex})
-
-                # Update my columns.
-                if col_name == "left":
-                    self.left = col
-                elif col_name == "center":
-                    self.center = col
-                elif col_name == "right":
-                    self.right = col
-                else:
-                    raise Exception()
-
-            # Empty the shortest column.
-            shortest_col.words = []
-
-            # Build the paracol.
-            for col_key in ["left", "center", "right"]:
-                if col_key not in table:
-                    continue
-                paracol += table[col_key]
-                if col_key != "right":
-                    paracol += "\n\n\\switchcolumn\n\n"
+                for i in range(len(cols)):
+                    if cols[i] == shortest_col:
+                        continue
+                    col_name = self._get_column_name(cols[i])
 
-            # End the paracol.
-            paracol += "\n\n\\end{paracol}\n\n"
+                    # Build the column.
+                    rm = self._get_row_maker(has_left, has_center, has_right, col_name)
 
-            # Add the paracol.
-            tex += paracol
+                    # Set the target number of lines based on the font size relative to the left column.
+                    target_num_lines = int((self.left.font_size / cols[i].font_size) * num_lines + 1)
 
-        return tex
+                    col_tex, col = yield from rm.lay_out(cols[i],
+                                                         target_num_lines,
+                                                         self._get_expected_length(col_name,
+                                                                                   self._get_column_width(col_name),
+                                                                                   target_num_lines),
+                                                         self._get_known_num_rows(cols[i], col_name,
+                                                                                  (has_left, has_center, has_right)))
+
+                    # Update the table.
+                    table.update({col_name: col_tex})
+
+                    # Update my columns.
+                    if col_name == "left":
+                        self.left = col
+                    elif col_name == "center":
+                        self.center = col
+                    elif col_name == "right":
+                        self.right = col
+                    else:
+                        raise Exception()
+
+                # Empty the shortest column.
+                shortest_col.clear()
+
+                # Build the paracol.
+                for col_key in ["left", "center", "right"]:
+                    if col_key not in table:
+                        continue
+                    paracol += table[col_key]
+                    if col_key != "right":
+                        paracol += "\n\n\\switchcolumn\n\n"
+
+                # End the paracol.
+                paracol += "\n\n\\end{paracol}\n\n"
+
+                # Add the paracol.
+                add(paracol)
+
+        return "".join(blocks)
 
     def get_chapter(self, title: str) -> str:
         """
@@ -447,15 +504,7 @@ class Talmudifier:
         :param title: The title of the chapter.
         """
 
-        assert "chapter" in self.recipe, "Chapter not found in recipe."
-        assert "command" in self.recipe["chapter"], "Chapter command not found in recipe."
-        assert "numbering" in self.recipe["chapter"], "Chapter numbering not found in recipe."
-
-        chapter = "\\chapter"
-        if not self.recipe["chapter"]["numbering"]:
-            chapter += "*"
-        chapter += "{" + self.recipe["chapter"]["command"] + "{" + title + "}}"
-        return chapter
+        return self.compiled_recipe.get_chapter(title)
 
     def create_pdf(self, chapter="", output_filename="output", print_tex=False) -> str:
         """
@@ -477,3 +526,28 @@ class Talmudifier:
         if print_tex:
             print(tex)
         return tex
+
+    async def create_pdf_async(self, chapter="", output_filename="output", print_tex=False) -> str:
+        """
+        Create a PDF (see `self.create_pdf()`). xelatex runs in asynchronous subprocesses. Returns the LaTeX string.
+
+        :param chapter: If not empty, create the header here.
+        :param output_filename: The name of the output file.
+        :param print_tex: If true, print the LaTeX string to the console.
+        """
+
+        tex = self.get_chapter(chapter) + "\n" if chapter != "" else ""
+        tex += await self.get_tex_async()
+
+        tex = await self.writer.write_async(tex, output_filename)
+        if print_tex:
+            print(tex)
+        return tex
+
+    def close(self) -> None:
+        """
+        Stop the measurement server, if there is one. A shared compiled recipe isn't closed.
+        """
+
+        if self._owns_compiled_recipe:
+            self.compiled_recipe.close()
@@ -0,0 +1,179 @@
+from typing import List, Optional, Tuple
+from talmudifier.word import Word
+from talmudifier.style import Style
+
+
+class TexBuilder:
+    """
+    Incrementally build the TeX string of a list of words.
+    Words can be appended and popped in O(1) amortized time.
+    The open style and the brace depth after each word are tracked, and the rendered text is cached,
+    so the closed TeX string of the first k words is a slice of the cache plus closing braces.
+
+    The output is the same as the output of `Column.get_tex()`.
+    """
+
+    def __init__(self, font_command: str, font: str, mark_offset=-1):
+        """
+        :param font_command: The font size command.
+        :param font: The command used to start the font.
+        :param mark_offset: If this is 0 or greater, start each word with `\\talmudifiermark{index}`,
+                            where the index of the first word is `mark_offset`.
+        """
+
+        self.font = font
+        self.head = font_command + font + " "
+        self.mark_offset = mark_offset
+
+        # The words.
+        self.words: List[Word] = []
+        # Per word: The text that closes the previous word's styles, and the text of this word.
+        self._seps: List[str] = []
+        self._pieces: List[str] = []
+        # Per word: The length of the text, the brace depth, and the open style after the word.
+        self._ends: List[int] = []
+        self._depths: List[int] = []
+        self._styles: List[Style] = []
+
+        self._head_depth = TexBuilder._get_depth(self.head)
+        # The rendered text. Only the first `self._valid` characters are up to date.
+        self._tex = self.head
+        self._valid = len(self.head)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def append(self, word: Word) -> None:
+        """
+        Append a word.
+
+        :param word: The word.
+        """
+
+        sep, piece, style, depth = self._render(len(self.words), word)
+        self.words.append(word)
+        self._seps.append(sep)
+        self._pieces.append(piece)
+        self._ends.append((self._ends[-1] if len(self._ends) > 0 else len(self.head)) + len(sep) + len(piece))
+        self._depths.append(depth)
+        self._styles.append(style)
+
+    def pop(self) -> Word:
+        """
+        Remove the last word and return it.
+        """
+
+        self._seps.pop()
+        self._pieces.pop()
+        self._ends.pop()
+        self._depths.pop()
+        self._styles.pop()
+        self._valid = min(self._valid, self._ends[-1] if len(self._ends) > 0 else len(self.head))
+        return self.words.pop()
+
+    def get_tex(self, num_words: int, close_braces=True, fragment: Optional[Word] = None) -> str:
+        """
+        Returns the TeX string of the first words.
+
+        :param num_words: The number of words.
+        :param close_braces: If true, make sure that all curly braces are closed.
+        :param fragment: If not None, append this word (e.g. a hyphenated fragment) after the first words.
+        """
+
+        assert 0 <= num_words <= len(self.words), f"Invalid number of words: {num_words}"
+
+        # Render any words that aren't in the cached text yet.
+        end = self._ends[num_words - 1] if num_words > 0 else len(self.head)
+        if self._valid < end:
+            if len(self._tex) > self._valid:
+                self._tex = self._tex[:self._valid]
+            # Find the first word that isn't in the cached text.
+            i = num_words
+            while i > 0 and self._ends[i - 1] > self._valid:
+                i -= 1
+            self._tex += "".join([self._seps[j] + self._pieces[j] for j in range(i, len(self.words))])
+            self._valid = len(self._tex)
+
+        tex = self._tex[:end]
+        depth = self._depths[num_words - 1] if num_words > 0 else self._head_depth
+        if fragment is not None:
+            sep, piece, style, depth = self._render(num_words, fragment)
+            tex += sep + piece
+        if close_braces and depth > 0:
+            tex += "}" * depth
+        return tex
+
+    def _render(self, index: int, word: Word) -> Tuple[str, str, Style, int]:
+        """
+        Render a word that follows the first `index` words. Doesn't change anything.
+        Returns the text that closes the previous word's styles, the text of the word,
+        and the style and brace depth after the word.
+
+        :param index: The index of the word.
+        :param word: The word.
+        """
+
+        sep = ""
+        if index == 0:
+            style = Style(False, False, False)
+            depth = self._head_depth
+        else:
+            previous_style = self._styles[index - 1]
+            style = Style(previous_style.bold, previous_style.italic, previous_style.underline)
+            depth = self._depths[index - 1]
+
+            # Try to close the previous word's style braces. Citations don't close anything.
+            if not self.words[index - 1].is_citation:
+                if style.bold and not word.style.bold:
+                    style.bold = False
+                    sep += "}"
+                if style.italic and not word.style.italic:
+                    style.italic = False
+                    sep += "}"
+                if style.underline and not word.style.underline:
+                    style.underline = False
+                    sep += "}"
+                depth -= len(sep)
+                sep += " "
+
+        piece = ""
+        if self.mark_offset >= 0:
+            piece += r"\talmudifiermark{" + str(self.mark_offset + index) + "}"
+
+        # Add a citation word.
+        if word.is_citation:
+            # Close all braces.
+            if depth > 0:
+                piece += "}" * depth
+            piece += word.word + " " + self.font + " "
+            return sep, piece, style, min(depth, 0) + TexBuilder._get_depth(word.word + self.font)
+
+        # Set bold style.
+        if word.style.bold and not style.bold:
+            piece += r"\textbf{"
+            style.bold = True
+            depth += 1
+        # Set italic style.
+        if word.style.italic and not style.italic:
+            piece += r"\textit{"
+            style.italic = True
+            depth += 1
+        # Set underline style.
+        if word.style.underline and not style.underline:
+            piece += r"\underline{"
+            style.underline = True
+            depth += 1
+
+        # Append the word.
+        piece += word.word
+        return sep, piece, style, depth + TexBuilder._get_depth(word.word)
+
+    @staticmethod
+    def _get_depth(tex: str) -> int:
+        """
+        Returns the number of { minus the number of }.
+
+        :param tex: The TeX string.
+        """
+
+        return tex.count("{") - tex.count("}")
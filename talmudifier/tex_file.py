@@ -0,0 +1,142 @@
+from pathlib import Path
+import io
+import re
+
+
+class TexFile:
+    """
+    A LaTeX document that is written to a .tex file one piece at a time, so that the whole document is never in memory.
+    Curly braces are counted as each piece is written, and checked when the file is closed.
+
+    ```python
+    from talmudifier.pdf_writer import PDFWriter
+
+    writer = PDFWriter(preamble)
+    with writer.get_tex_file("Output/book.tex") as f:
+        for page in pages:
+            f.write(page)
+    writer.write_file("Output/book.tex")
+    ```
+
+    The document is typeset as if it were on one line, which is how xelatex used to read it from the command line:
+    a line break is a space, and a blank line is *not* a new paragraph (it is written as a line with only `%`).
+    TeX reads each line into a fixed-size buffer, so long lines are broken at a space.
+    """
+
+    # The maximum length of a line that doesn't need to be broken.
+    MAX_LINE_LENGTH = 4096
+    # A line break that would start a blank line (a line with only spaces is blank).
+    _BLANK_LINE = re.compile(r"\n(?=[ \t]*\n)")
+
+    def __init__(self, path: str, preamble: str, end: str):
+        """
+        :param path: The path to the .tex file.
+        :param preamble: The start of the document.
+        :param end: The end of the document. It is written when the file is closed.
+        """
+
+        self.path = str(Path(path).resolve())
+        self.end = end
+        # The number of open curly braces.
+        self.depth = 0
+        self.size = 0
+        self._line_length = 0
+        # If true, the line that is being written has only spaces so far.
+        self._blank = False
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._file = io.open(self.path, "wt", encoding="utf-8")
+        self.write(preamble)
+
+    def write(self, text: str) -> None:
+        """
+        Append LaTeX text to the document.
+
+        :param text: The LaTeX text.
+        """
+
+        if text == "":
+            return
+        self.depth += text.count("{") - text.count("}")
+        self.size += len(text)
+
+        # Don't write a blank line.
+        if self._blank and text.lstrip(" \t").startswith("\n"):
+            text = "%" + text
+        text = TexFile._BLANK_LINE.sub("\n%", text)
+        if "\n" in text:
+            self._blank = text[text.rfind("\n") + 1:].strip(" \t") == ""
+        else:
+            self._blank = self._blank and text.strip(" \t") == ""
+
+        # Break long lines.
+        lines = text.split("\n")
+        for i in range(len(lines)):
+            if i > 0:
+                self._line_length = 0
+            lines[i] = self._break(lines[i])
+        self._file.write("\n".join(lines))
+
+    def close(self) -> None:
+        """
+        End the document and close the file.
+        """
+
+        if self._file.closed:
+            return
+        self.write(self.end)
+        self._file.close()
+        assert self.depth == 0, f"Unbalanced curly braces ({self.depth}): {self.path}"
+
+    def _break(self, line: str) -> str:
+        """
+        Returns a line, with line breaks in place of spaces wherever it would be longer than `TexFile.MAX_LINE_LENGTH`.
+        The line might continue a line that was already written.
+
+        :param line: The line.
+        """
+
+        if self._line_length + len(line) <= TexFile.MAX_LINE_LENGTH:
+            self._line_length += len(line)
+            return line
+        pieces = []
+        start = 0
+        while self._line_length + len(line) - start > TexFile.MAX_LINE_LENGTH:
+            end = max(start + TexFile.MAX_LINE_LENGTH - self._line_length, start + 1)
+            index = line.rfind(" ", start + 1, end)
+            while index > start and not TexFile._can_break(line, index):
+                index = line.rfind(" ", start + 1, index)
+            # There's no space to break at, so look for one after the maximum length.
+            if index <= start:
+                index = end
+                while index < len(line) and (line[index] != " " or not TexFile._can_break(line, index)):
+                    index += 1
+                if index >= len(line):
+                    break
+            pieces.append(line[start: index])
+            start = index + 1
+            self._line_length = 0
+        pieces.append(line[start:])
+        self._line_length += len(line) - start
+        return "\n".join(pieces)
+
+    @staticmethod
+    def _can_break(line: str, index: int) -> bool:
+        """
+        Returns true if the space at this index can be replaced with a line break.
+        It can't be if the previous character is a space or a backslash (e.g. `\\ `),
+        or if the next line would be empty or start with a space.
+
+        :param line: The line.
+        :param index: The index of the space.
+        """
+
+        return 0 < index < len(line) - 1 and line[index - 1] not in " \t\\" and line[index + 1] not in " \t"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
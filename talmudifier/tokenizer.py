@@ -0,0 +1,115 @@
+from typing import Dict, Iterable, Iterator, TextIO, Tuple, Union
+import re
+from talmudifier.style import Style
+
+
+class Tokenizer:
+    """
+    Split markdown text into words and their styles in a single pass.
+    The text can be a string, a file, or an iterable of strings (e.g. lines or chunks of a file).
+    Words are yielded as they are read, so the whole text never needs to be split at once.
+
+    Words are separated by single spaces, exactly like `text.split(" ")`.
+    One regular expression matches each word and splits it into its leading markers (`**`, `_`, `_**`, `**_`),
+    its text, and its trailing markers. The styles are the same as those of the original word-by-word parser:
+    markers at either end of a word turn a style on, and markers at the end turn it off after the word.
+    """
+
+    # The number of characters to read from a file at a time.
+    CHUNK_SIZE = 65536
+    # A word and the space after it: leading markers, the text, trailing markers.
+    # The text is lazy, so the trailing markers are every marker at the end of the word.
+    # A word that is only markers is all leading markers.
+    _WORD = re.compile(r"([*_]*)([^ ]*?)([*_]*) ")
+    # The last word, which doesn't end with a space.
+    _LAST_WORD = re.compile(r"([*_]*)([^ ]*?)([*_]*)\Z")
+    # Key = Leading markers. Value = (True if bold starts, true if italic starts).
+    _LEADS: Dict[str, Tuple[bool, bool]] = dict()
+    # Key = Trailing markers. Value = (True if bold starts, true if italic starts, true if bold ends, true if italic ends).
+    _TRAILS: Dict[str, Tuple[bool, bool, bool, bool]] = dict()
+
+    def __init__(self, source: Union[str, TextIO, Iterable[str]]):
+        """
+        :param source: The markdown text: A string, a file, or an iterable of strings.
+        """
+
+        self.source = source
+
+    def _get_chunks(self) -> Iterator[str]:
+        """
+        Yields chunks of the text.
+        """
+
+        if isinstance(self.source, str):
+            yield self.source
+        elif hasattr(self.source, "read"):
+            for chunk in iter(lambda: self.source.read(Tokenizer.CHUNK_SIZE), ""):
+                yield chunk
+        else:
+            for chunk in self.source:
+                yield chunk
+
+    def _get_tokens(self) -> Iterator[Tuple[str, str, str]]:
+        """
+        Yields each word of the text as a tuple: leading markers, text, trailing markers.
+        """
+
+        buffer = ""
+        for chunk in self._get_chunks():
+            buffer += chunk
+            end = 0
+            # Only match words that end with a space. The last word might continue in the next chunk.
+            for match in Tokenizer._WORD.finditer(buffer):
+                yield match.groups()
+                end = match.end()
+            buffer = buffer[end:]
+        yield Tokenizer._LAST_WORD.match(buffer).groups()
+
+    def __iter__(self) -> Iterator[Tuple[str, Style]]:
+        """
+        Yields each word, stripped of markdown styling, and its style.
+        """
+
+        bold = False
+        italic = False
+        underline = False
+
+        for lead, text, trail in self._get_tokens():
+            # A word that is only markers both starts and ends with them.
+            if text == "" and trail == "":
+                trail = lead
+            if lead != "":
+                if lead not in Tokenizer._LEADS:
+                    Tokenizer._LEADS[lead] = (lead.startswith("**") or lead.startswith(("_**", "**_")),
+                                              lead.startswith("_") or lead.startswith(("_**", "**_")))
+                start_bold, start_italic = Tokenizer._LEADS[lead]
+                bold = bold or start_bold
+                italic = italic or start_italic
+            if trail != "":
+                if trail not in Tokenizer._TRAILS:
+                    both = trail.endswith(("_**", "**_"))
+                    Tokenizer._TRAILS[trail] = (trail.endswith("**") or both, trail.endswith("_") or both,
+                                                trail.endswith("**") or both, trail.endswith("_") or both)
+                start_bold, start_italic, end_bold, end_italic = Tokenizer._TRAILS[trail]
+                bold = bold or start_bold
+                italic = italic or start_italic
+            else:
+                end_bold = False
+                end_italic = False
+            end_underline = False
+            if "<" in text:
+                end_underline = "</u>" in text
+                if end_underline or "<u>" in text:
+                    underline = True
+            if "*" in text or "_" in text or "<" in text:
+                text = text.replace("*", "").replace("_", "").replace("<u>", "").replace("</u>", "")
+
+            yield text, Style(bold, italic, underline)
+
+            # Check if this was one word, e.g. **this** and apply styles again.
+            if end_bold:
+                bold = False
+            if end_italic:
+                italic = False
+            if end_underline:
+                underline = False
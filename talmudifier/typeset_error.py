@@ -0,0 +1,48 @@
+from typing import Optional
+
+
+class TypesetError(Exception):
+    """
+    A TeX engine failed to typeset a document (see `PDFWriter.write_file()`).
+    """
+
+    # TeX stopped at an error in the document. Retrying won't help.
+    ERROR = "error"
+    # The engine took longer than `PDFWriter.timeout` seconds and was killed.
+    TIMEOUT = "timeout"
+    # The engine was killed by a signal, e.g. because it exceeded `PDFWriter.max_cpu_time`.
+    # The same document would be killed again, so it isn't retried.
+    KILLED = "killed"
+    # The engine exited normally but didn't create the output file.
+    NO_OUTPUT = "no_output"
+
+    def __init__(self, engine: str, path: str, reason: str, returncode: Optional[int], attempts: int, log: str):
+        """
+        :param engine: The name of the engine, e.g. "xelatex".
+        :param path: The path to the .tex file.
+        :param reason: Why it failed, e.g. `TypesetError.TIMEOUT`.
+        :param returncode: The engine's exit code, or None if it timed out.
+        :param attempts: The number of times that the engine tried to typeset the document.
+        :param log: The part of the log that describes the error (see `LogReader.get_error()`).
+        """
+
+        self.engine = engine
+        self.path = path
+        self.reason = reason
+        self.returncode = returncode
+        self.attempts = attempts
+        self.log = log
+        super().__init__(f"{engine} failed to typeset {path} ({reason}, exit code: {returncode}, "
+                         f"attempts: {attempts})\n\n{log}")
+
+    def __reduce__(self):
+        # Errors are sent from worker processes (see `Book`), so they need to be pickled with all of their fields.
+        return TypesetError, (self.engine, self.path, self.reason, self.returncode, self.attempts, self.log)
+
+    def can_retry(self) -> bool:
+        """
+        Returns true if the same document might be typeset if the engine tries again.
+        Only a timeout can be transient (e.g. the machine was busy); errors and resource limits are deterministic.
+        """
+
+        return self.reason == TypesetError.TIMEOUT
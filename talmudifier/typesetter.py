@@ -0,0 +1,140 @@
+from platform import system
+from pathlib import Path
+from typing import List
+from talmudifier.log_reader import LogReader
+
+
+class Typesetter:
+    """
+    A TeX engine. `PDFWriter` and `MeasurementServer` run the engine, and `RowMaker` uses its TeX to report rows.
+    To add an engine, subclass this and register it in `Typesetter.ENGINES`.
+    """
+
+    # Key = The name of an engine. Value = The subclass.
+    ENGINES: dict = dict()
+
+    # The name of the engine's executable, e.g. "xelatex"
+    name = ""
+    # Definitions that are appended to the preamble.
+    definitions = ""
+    # End the paragraph and report its number of rows (see `LogReader`). Append this to the end of the measured text.
+    report_rows = LogReader.REPORT_ROWS
+    # Define `\talmudifiermark{i}` (see `LogReader.DEFINE_MARK`).
+    define_mark = LogReader.DEFINE_MARK
+
+    def get_executable(self) -> str:
+        """
+        Returns the executable of this platform.
+        """
+
+        p = system()
+        if p == "Linux" or p == "Darwin":
+            return self.name
+        elif p == "Windows":
+            return self.name + ".exe"
+        else:
+            raise Exception(f"Platform not supported: {p}")
+
+    def get_command(self, path: str, filename: str, pdf: bool, directory: str) -> List[str]:
+        """
+        Returns the command that typesets a document. The engine runs in non-stop mode and halts at the first error,
+        so it never waits for input.
+
+        :param path: The path to the .tex file.
+        :param filename: The filename of the PDF.
+        :param pdf: If false, don't create a PDF.
+        :param directory: The output directory.
+        """
+
+        options = ["-interaction=nonstopmode", "-halt-on-error"] + self.get_options(pdf)
+        if system() == "Windows":
+            return [self.get_executable()] + options + \
+                   ['-output-directory', str(Path(directory).resolve()), '-job-name=' + filename, path]
+        return [self.get_executable()] + options + \
+            ["-output-directory", str(Path(directory).resolve()), "-jobname", filename, path]
+
+    def get_server_command(self, driver_path: str, jobname: str, directory: str) -> List[str]:
+        """
+        Returns the command that starts a `MeasurementServer`.
+        Scroll mode doesn't stop for errors, but still reads from the terminal. Don't bother making a PDF.
+
+        :param driver_path: The path to the driver .tex file.
+        :param jobname: The job name.
+        :param directory: The output directory.
+        """
+
+        return [self.get_executable(), "-interaction=scrollmode"] + self.get_options(False) + \
+            ["-output-directory", directory, "-jobname", jobname, driver_path]
+
+    def get_options(self, pdf: bool) -> List[str]:
+        """
+        Returns the command-line options.
+
+        :param pdf: If false, don't create a PDF.
+        """
+
+        raise Exception(f"Not implemented: {self.name}")
+
+    def get_output_extension(self, pdf: bool) -> str:
+        """
+        Returns the extension of the file that the engine always creates, e.g. ".pdf"
+
+        :param pdf: If false, a PDF wasn't created.
+        """
+
+        raise Exception(f"Not implemented: {self.name}")
+
+    @staticmethod
+    def get(name: str) -> 'Typesetter':
+        """
+        Returns a typesetter.
+
+        :param name: The name of the engine, e.g. "xelatex"
+        """
+
+        if name not in Typesetter.ENGINES:
+            raise Exception(f"Engine not supported: {name}")
+        return Typesetter.ENGINES[name]()
+
+
+class XeLaTeX(Typesetter):
+    """
+    xelatex. Without a PDF, it creates an .xdv file.
+    """
+
+    name = "xelatex"
+
+    def get_options(self, pdf: bool) -> List[str]:
+        return [] if pdf else ["-no-pdf"]
+
+    def get_output_extension(self, pdf: bool) -> str:
+        return ".pdf" if pdf else ".xdv"
+
+
+class LuaLaTeX(Typesetter):
+    """
+    lualatex. A `post_linebreak_filter` callback counts the lines of each paragraph as it is broken,
+    and the count is written to the log. Without a PDF, lualatex runs in draft mode and doesn't write any output.
+    Fonts are loaded from luaotfload's font cache, which is reused across runs.
+    """
+
+    name = "lualatex"
+    # Count the lines (hlist nodes of subtype "line") of each paragraph.
+    definitions = "\n" + r"\directlua{talmudifier_rows = 0 " \
+                         r"luatexbase.add_to_callback('post_linebreak_filter', function(head) " \
+                         r"local n = 0 " \
+                         r"for line in node.traverse_id(node.id('hlist'), head) do " \
+                         r"if line.subtype == 1 then n = n + 1 end end " \
+                         r"talmudifier_rows = n " \
+                         r"return true end, 'talmudifier_rows')}" + "\n"
+    report_rows = r"\par\typeout{" + LogReader.ROWS + r"\directlua{tex.write(tostring(talmudifier_rows))}}"
+    define_mark = r"\def\talmudifiermark#1{\savepos\write16{" + LogReader.WORD + r"#1,\thepage,\the\lastypos}}"
+
+    def get_options(self, pdf: bool) -> List[str]:
+        return [] if pdf else ["-draftmode"]
+
+    def get_output_extension(self, pdf: bool) -> str:
+        return ".pdf" if pdf else ".log"
+
+
+Typesetter.ENGINES.update({XeLaTeX.name: XeLaTeX, LuaLaTeX.name: LuaLaTeX})
@@ -1,31 +1,41 @@
 from hyphen import Hyphenator
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple, Union
 from talmudifier.style import Style
 from talmudifier.citation import Citation
-import re
+from talmudifier.hyphenation_cache import HyphenationCache
+from talmudifier.substitutions import Substitutions
 
 
 class Word:
     """
     A word is a string plus style metadata (bold, italic, etc.)
+
+    Hyphenated pairs are computed the first time that they are used and cached in `Word.CACHE`.
+    To share the cache across runs: `Word.CACHE = HyphenationCache(path="Output/hyphenation.db")`
     """
 
-    H = Hyphenator('en_US')
+    H: Optional[Hyphenator] = None
+    CACHE = HyphenationCache()
 
     def __init__(self, word: str,
                  style: Style,
-                 substitutions: Optional[Dict[str, str]],
+                 substitutions: Optional[Union[Dict[str, str], Substitutions]],
                  citation: Optional[Citation],
                  get_pairs=True):
         """
         :param word: The actual word, stripped of any markdown styling.
         :param style: The font style for this word.
         :param substitutions: A list of keys to replace for values to make a valid TeX string.
-        :param get_pairs: If true, get pairs of hyphenated fragments.
+                              To avoid recompiling the regular expressions for every word, use `Substitutions`.
+        :param get_pairs: If true, this word can be hyphenated (see `self.pairs`).
         """
 
         self.word = word
-        self.pairs = []
+        if isinstance(substitutions, dict):
+            substitutions = Substitutions(substitutions)
+        self._pairs: Optional[List[List[Word]]] = None
+        # The word and substitutions used to hyphenate the word. If None, the word is never hyphenated.
+        self._hyphenation: Optional[tuple] = None
 
         # Try to make this word a citation. If it is a citation, stop right here (citations are never hyphenated).
         if citation is not None:
@@ -39,47 +49,73 @@ class Word:
         else:
             self.style = style
 
-        # Get the pairs.
+        # Remember how to get the pairs.
         if get_pairs:
-            self.pairs = self._get_hyphenated_pairs(substitutions)
+            self._hyphenation = (word, substitutions)
 
         # Do the substitutions.
         if substitutions is not None:
-            for key in substitutions:
-                self.word = re.sub(key, substitutions[key], self.word).replace("&", " ")
+            self.word = substitutions.apply_to(self.word)
 
         if word.startswith('"'):
             self.word = "``" + word[1:]
         elif word. startswith("'"):
             self.word = "`" + word[1:]
 
-    def _get_hyphenated_pairs(self, substitutions: Dict[str, str]) -> list:
+    @property
+    def pairs(self) -> List[list]:
+        """
+        All possible hyphenated pairs of this word (e.g. Cal- ifornia). Each pair is a list of two words.
+        """
+
+        if self._pairs is None:
+            if self._hyphenation is None:
+                self._pairs = []
+            else:
+                word, substitutions = self._hyphenation
+                pairs_text = Word.CACHE.get(word, substitutions,
+                                            lambda: Word._get_hyphenated_pairs(word, substitutions))
+                self._pairs = [[Word._get_fragment(p, self.style) for p in pair] for pair in pairs_text]
+        return self._pairs
+
+    @staticmethod
+    def _get_hyphenated_pairs(word: str, substitutions: Optional[Substitutions]) -> List[Tuple[str, str]]:
         """
-        Get all possible hyphenated pairs of this word (e.g. Cal- ifornia).
+        Get the text of all possible hyphenated pairs of a word (e.g. Cal- ifornia).
+
+        :param word: The word, before substitutions.
+        :param substitutions: The word's substitutions. These are applied to the first half of each pair.
         """
 
+        if Word.H is None:
+            Word.H = Hyphenator('en_US')
+
         try:
-            pairs_text = self.H.pairs(self.word)
+            pairs_text = Word.H.pairs(word)
         except IndexError:
             return []
 
         pairs = []
-
         for pair in pairs_text:
             # Append the hyphen to the first word.
             p0 = pair[0] + "-"
             p1 = pair[1]
-            h = []
+            pairs.append((Word(p0, Style(False, False, False), substitutions, None, get_pairs=False).word,
+                          Word(p1, Style(False, False, False), None, None, get_pairs=False).word))
+        return pairs
 
-            # Add pairs of Word objects.
-            for p in [p0, p1]:
-                w = Word(p, self.style, substitutions if p == p0 else None,
-                         None,
-                         get_pairs=False)
+    @staticmethod
+    def _get_fragment(text: str, style: Style) -> 'Word':
+        """
+        Returns a hyphenated fragment.
 
-                h.append(w)
-            pairs.append(h)
-        return pairs
+        :param text: The text of the fragment, after substitutions.
+        :param style: The style of the fragment.
+        """
+
+        fragment = Word(text, style, None, None, get_pairs=False)
+        fragment.word = text
+        return fragment
 
     @staticmethod
     def is_valid(word: str) -> bool:
@@ -17,8 +17,5 @@ if __name__ == "__main__":
     t = Talmudifier(left, center, right)
     tex = t.get_chapter("Talmudifier Test Page") + "\n"
     tex += t.get_tex()
-    doc = t.writer.write(tex, "test_page")
-
-    # Output the LaTeX string used to generated the PDF as a .tex file.
-    with io.open("Output/test_page.tex", "wt", encoding="utf-8") as f:
-        f.write(doc)
+    # This also writes the .tex file used to generate the PDF: Output/test_page.tex
+    t.writer.write(tex, "test_page")
@@ -0,0 +1,68 @@
+from platform import system
+from typing import List
+import sys
+import unittest
+from talmudifier.log_reader import LogReader
+from talmudifier.measurement_server import MeasurementServer
+from talmudifier.pdf_writer import PDFWriter
+from talmudifier.typeset_error import TypesetError
+from talmudifier.typesetter import XeLaTeX
+
+
+# A fake engine. It reports 3 rows per request, hangs if the request says "hang", and kills itself if it says "die".
+SERVER = f"""
+import os, signal, sys, time
+print("{MeasurementServer.READY}", flush=True)
+for line in sys.stdin:
+    print("l.1 " + line.strip(), flush=True)
+    if "hang" in line:
+        time.sleep(600)
+    if "die" in line:
+        os.kill(os.getpid(), signal.SIGKILL)
+    print("{LogReader.ROWS}3")
+    print("{MeasurementServer.DONE}", flush=True)
+"""
+
+
+class FakeEngine(XeLaTeX):
+    def get_server_command(self, driver_path: str, jobname: str, directory: str) -> List[str]:
+        return [sys.executable, "-c", SERVER]
+
+
+@unittest.skipIf(system() == "Windows", "The server is killed with its process group.")
+class TestMeasurementServer(unittest.TestCase):
+    """
+    A measurement server that hangs or dies raises a `TypesetError` and is restarted by the next request.
+    """
+
+    def setUp(self):
+        self._timeout = MeasurementServer.timeout
+        MeasurementServer.timeout = 1
+        self.server = MeasurementServer(PDFWriter("", FakeEngine()))
+
+    def tearDown(self):
+        self.server.stop()
+        MeasurementServer.timeout = self._timeout
+
+    def test_timeout(self):
+        self.assertEqual(self.server.get_num_rows("a"), 3)
+        process = self.server.process
+        with self.assertRaises(TypesetError) as context:
+            self.server.get_num_rows("hang")
+        self.assertEqual(context.exception.reason, TypesetError.TIMEOUT)
+        self.assertIn("l.1 hang", context.exception.log)
+        self.assertIsNone(self.server.process)
+        self.assertIsNotNone(process.poll())
+        self.assertEqual(self.server.get_num_rows("b"), 3)
+
+    def test_killed(self):
+        self.assertEqual(self.server.get_num_rows("a"), 3)
+        with self.assertRaises(TypesetError) as context:
+            self.server.get_num_rows("die")
+        self.assertEqual(context.exception.reason, TypesetError.KILLED)
+        self.assertFalse(context.exception.can_retry())
+        self.assertEqual(self.server.get_num_rows("b"), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from talmudifier.page_cache import PageCache
+
+
+class TestPageCache(unittest.TestCase):
+    """
+    The directory backend tracks its size as pages are added, and evicts the least-recently-used pages.
+    """
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_evict(self):
+        cache = PageCache(self.directory.name, max_bytes=300)
+        for key in ["a", "b", "c"]:
+            cache.put(key, "x" * 50, b"y" * 50)
+        # Use "a" so that "b" is the least-recently-used page.
+        self.assertIsNotNone(cache.get("a"))
+        cache.put("d", "x" * 50, b"y" * 50)
+        self.assertIsNone(cache.get("b"))
+        for key in ["a", "c", "d"]:
+            self.assertEqual(cache.get(key), ("x" * 50, b"y" * 50))
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(sorted([f.name for f in Path(self.directory.name).iterdir()]),
+                         ["a.pdf", "a.tex", "c.pdf", "c.tex", "d.pdf", "d.tex"])
+
+    def test_replace(self):
+        cache = PageCache(self.directory.name, max_bytes=300)
+        for i in range(10):
+            cache.put("a", "x" * 100, b"y" * 100)
+        self.assertEqual(cache.evictions, 0)
+        self.assertEqual(cache._size, 200)
+
+    def test_scan(self):
+        # Pages that are already in the directory count towards its size.
+        PageCache(self.directory.name).put("a", "x" * 200)
+        cache = PageCache(self.directory.name, max_bytes=300)
+        self.assertEqual(cache._size, 200)
+        cache.put("b", "x" * 200)
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("b"))
+
+
+if __name__ == "__main__":
+    unittest.main()
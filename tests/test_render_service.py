@@ -0,0 +1,105 @@
+from http.client import HTTPConnection
+from json import dumps, loads
+from platform import system
+from tempfile import TemporaryDirectory
+from time import sleep
+from typing import Optional, Tuple
+import os
+import signal
+import unittest
+from talmudifier.book import Page
+from talmudifier.render_service import RenderJob, RenderService
+
+
+def initialize_worker(recipe_args: tuple, warm_up: bool) -> None:
+    # Don't compile the recipe.
+    pass
+
+
+def render(task: Tuple[Page, Optional[str], bool]) -> Tuple[str, str, float]:
+    # Pretend to lay out the page. Take a long time if the page says so.
+    if task[0].left == "slow":
+        sleep(600)
+    return task[0].left, "", 0.0
+
+
+@unittest.skipIf(system() == "Windows", "The workers are forked and killed with SIGKILL.")
+class TestRenderService(unittest.TestCase):
+    """
+    If a worker process dies or is stuck, its job times out, and its pool is replaced.
+    """
+
+    def setUp(self):
+        self._render = RenderService._render
+        self._initialize_worker = RenderService._initialize_worker
+        self._stop_timeout = RenderService.STOP_TIMEOUT
+        # Don't wait for a slow job when the service stops.
+        RenderService.STOP_TIMEOUT = 1
+        self._reap_interval = RenderService.REAP_INTERVAL
+        RenderService.REAP_INTERVAL = 0.1
+        # The workers are forked, so they have these functions too.
+        RenderService._render = staticmethod(render)
+        RenderService._initialize_worker = staticmethod(initialize_worker)
+        self.directory = TemporaryDirectory()
+        self.service = RenderService(jobs=1, port=0, directory=self.directory.name, warm_up=False, job_timeout=2)
+        self.service.start()
+
+    def tearDown(self):
+        self.service.stop()
+        self.directory.cleanup()
+        RenderService._render = self._render
+        RenderService._initialize_worker = self._initialize_worker
+        RenderService.STOP_TIMEOUT = self._stop_timeout
+        RenderService.REAP_INTERVAL = self._reap_interval
+
+    def test_dead_worker(self):
+        job = self.service.submit(Page("slow", "", ""))
+        self.assertEqual(self.service.get_metrics()["pending"], 1)
+        # Wait for the worker to start the job, and then kill it.
+        sleep(0.5)
+        for worker in self.service._pools["default.json"]._pool:
+            os.kill(worker.pid, signal.SIGKILL)
+        self.assertTrue(job.done.wait(10))
+        self.assertEqual(job.status, RenderJob.FAILED)
+        self.assertEqual(job.error["type"], "TimeoutError")
+        metrics = self.service.get_metrics()
+        self.assertEqual(metrics["pending"], 0)
+        self.assertEqual(metrics["failed"], 1)
+
+        # The pool replaced the worker, so the next job is done.
+        job = self.service.submit(Page("fast", "", ""))
+        self.assertTrue(job.done.wait(10))
+        self.assertEqual(job.status, RenderJob.DONE)
+        self.assertEqual(job.tex, "fast")
+
+    def test_stuck_worker(self):
+        job = self.service.submit(Page("slow", "", ""))
+        sleep(1)
+        pids = [worker.pid for worker in self.service._pools["default.json"]._pool]
+        # This job waits for the stuck worker, and then is sent to the new pool.
+        queued = self.service.submit(Page("fast", "", ""))
+        self.assertTrue(job.done.wait(10))
+        self.assertEqual(job.status, RenderJob.FAILED)
+        self.assertEqual(job.error["type"], "TimeoutError")
+        # The job kept its place in the queue until its worker was terminated.
+        for pid in pids:
+            with self.assertRaises(ProcessLookupError):
+                os.kill(pid, 0)
+        self.assertTrue(queued.done.wait(10))
+        self.assertEqual(queued.status, RenderJob.DONE)
+        self.assertEqual(queued.attempts, 2)
+        self.assertEqual(self.service.get_metrics()["pending"], 0)
+
+    def test_wait(self):
+        # The request returns after the job times out.
+        connection = HTTPConnection("127.0.0.1", self.service.port, timeout=30)
+        connection.request("POST", "/jobs?wait=1", dumps({"left": "slow", "center": "", "right": ""}))
+        response = connection.getresponse()
+        self.assertEqual(response.status, 500)
+        self.assertEqual(loads(response.read().decode("utf-8"))["error"]["type"], "TimeoutError")
+        connection.close()
+        self.assertEqual(self.service.get_metrics()["pending"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
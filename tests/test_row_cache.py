@@ -0,0 +1,94 @@
+from threading import Barrier, Lock, Thread
+from time import sleep
+from typing import List
+import unittest
+from talmudifier.pdf_writer import PDFWriter
+from talmudifier.row_cache import RowCache
+from talmudifier.row_maker import RowMaker
+
+
+class TestRowCache(unittest.TestCase):
+    """
+    Batched measurements that share a `RowCache` measure each string only once.
+    xelatex is replaced with a function that records each block and returns its length.
+    """
+
+    def setUp(self):
+        self.measured: List[str] = list()
+        self.fail = False
+        self._lock = Lock()
+        self._measure_blocks = RowMaker.measure_blocks
+
+        def measure_blocks(writer, blocks, server=None, read_log=True):
+            with self._lock:
+                self.measured.extend(blocks)
+            # Give the other thread time to claim the same keys.
+            sleep(0.3)
+            if self.fail:
+                raise Exception("Failed to measure.")
+            return [len(block) for block in blocks]
+
+        RowMaker.measure_blocks = staticmethod(measure_blocks)
+        self.cache = RowCache()
+        self.rowmaker = RowMaker(True, True, True, "left", PDFWriter(""), cache=self.cache)
+
+    def tearDown(self):
+        RowMaker.measure_blocks = self._measure_blocks
+
+    def _run(self, batches: List[List[str]]) -> list:
+        """
+        Measure each batch in its own thread at the same time. Returns the result (or error) of each batch.
+
+        :param batches: Each thread's TeX strings.
+        """
+
+        results = [None] * len(batches)
+        barrier = Barrier(len(batches))
+
+        def measure(index: int) -> None:
+            barrier.wait()
+            # Stagger the threads so that the first one claims its keys first.
+            sleep(0.05 * index)
+            try:
+                results[index] = self.rowmaker.get_num_rows_batch(batches[index])
+            except Exception as e:
+                results[index] = e
+
+        threads = [Thread(target=measure, args=(i, )) for i in range(len(batches))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_overlapping_batches(self):
+        batches = [["a", "bb", "ccc"], ["bb", "ccc", "dddd", "dddd"]]
+        results = self._run(batches)
+        for batch, result in zip(batches, results):
+            self.assertEqual(result, [len(self.rowmaker.get_block(tex)) for tex in batch])
+        # Each string was measured once, even though both threads asked for "bb" and "ccc".
+        blocks = [self.rowmaker.get_block(tex) for tex in ["a", "bb", "ccc", "dddd"]]
+        self.assertEqual(sorted(set(self.measured)), sorted(blocks))
+        self.assertEqual(len([block for block in self.measured if block != blocks[3]]), 3)
+        self.assertEqual(self.cache.get_stats()["deduplicated"], 2)
+        # Everything is cached now.
+        self.measured.clear()
+        self.assertEqual(self.rowmaker.get_num_rows_batch(batches[0]), results[0])
+        self.assertEqual(len(self.measured), 0)
+
+    def test_failed_batch(self):
+        self.fail = True
+        results = self._run([["a", "bb"], ["bb"]])
+        # The thread that waited for "bb" gets the same error as the thread that measured it.
+        self.assertIsInstance(results[0], Exception)
+        self.assertIs(results[0], results[1])
+        self.assertEqual(len(self.measured), 2)
+        # The keys were released, so they can be measured again.
+        self.fail = False
+        self.measured.clear()
+        self.assertEqual(self.rowmaker.get_num_rows_batch(["bb"]), [len(self.rowmaker.get_block("bb"))])
+        self.assertEqual(len(self.measured), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
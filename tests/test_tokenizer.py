@@ -0,0 +1,99 @@
+from pathlib import Path
+from typing import List, Tuple
+import io
+import unittest
+from talmudifier.style import Style
+from talmudifier.tokenizer import Tokenizer
+
+
+def get_baseline_words(text: str) -> List[Tuple[str, Tuple[bool, bool, bool]]]:
+    """
+    Returns the words and styles of the text, parsed word by word like `Talmudifier` did before `Tokenizer`.
+
+    :param text: The markdown text.
+    """
+
+    words = []
+    style = Style(False, False, False)
+    for w in text.split(" "):
+        if w.startswith("**"):
+            style.bold = True
+        elif w.endswith("**"):
+            style.bold = True
+        if w.startswith("_"):
+            style.italic = True
+        elif w.endswith("_"):
+            style.italic = True
+        if w.startswith("_**") or w.startswith("**_"):
+            style.bold = True
+            style.italic = True
+        elif w.endswith("_**") or w.endswith("**_"):
+            style.bold = True
+            style.italic = True
+        if "<u>" in w:
+            style.underline = True
+        elif "</u>" in w:
+            style.underline = True
+        words.append((w.replace("*", "").replace("_", "").replace("<u>", "").replace("</u>", ""),
+                      (style.bold, style.italic, style.underline)))
+        if w.endswith("**"):
+            style.bold = False
+        if w.endswith("_"):
+            style.italic = False
+        if w.endswith("_**") or w.endswith("**_"):
+            style.bold = False
+            style.italic = False
+        if "</u>" in w:
+            style.underline = False
+    return words
+
+
+def get_words(source) -> List[Tuple[str, Tuple[bool, bool, bool]]]:
+    """
+    Returns the words and styles of the text, parsed by `Tokenizer`.
+
+    :param source: A string, a file, or an iterable of strings.
+    """
+
+    return [(w, (s.bold, s.italic, s.underline)) for w, s in Tokenizer(source)]
+
+
+class TestTokenizer(unittest.TestCase):
+    EDGE_CASES = ["",
+                  " ",
+                  "  two  spaces  ",
+                  "plain words",
+                  "**bold** not bold",
+                  "**bold for a while** not bold",
+                  "_italic_ not _italic for a while_ not",
+                  "**_bold italic_** plain",
+                  "_**bold italic**_ plain",
+                  "**bold _bold italic_ bold** plain",
+                  "_italic **bold italic** italic_ plain",
+                  "**_starts both and ends_ italic? then** plain",
+                  "**bold**, punctuation keeps bold",
+                  "snake_case and a*star in the middle",
+                  "** _ **_ _** *** ____ lone markers",
+                  "<u>underlined words</u> plain <u>one</u> plain",
+                  "**<u>bold underline</u>** plain",
+                  "_<u>italic underline_</u> plain",
+                  "trailing space ",
+                  "**"]
+
+    def test_edge_cases(self):
+        for text in TestTokenizer.EDGE_CASES:
+            self.assertEqual(get_words(text), get_baseline_words(text), text)
+
+    def test_josephus(self):
+        path = Path(__file__).parent.parent.joinpath("test/josephus.txt")
+        with io.open(str(path), "rt", encoding="utf-8") as f:
+            text = f.read()
+        words = get_baseline_words(text)
+        self.assertEqual(get_words(text), words)
+        # Read the text as a file and as chunks that split words.
+        self.assertEqual(get_words(io.StringIO(text)), words)
+        self.assertEqual(get_words([text[i: i + 37] for i in range(0, len(text), 37)]), words)
+
+
+if __name__ == "__main__":
+    unittest.main()